@@ -0,0 +1,654 @@
+from .model import Memory, MemoryModel
+from .stmt import If, ReturnStatement
+from .values import AssignStatement, Const, Expression, Port, \
+    PortType, Statement, Value, Variable
+from .backend import get_expr_key, visit_mem_access
+from .optimize import _Block, _copy_if
+from .scheduler import Scheduler
+from typing import Dict, List, NamedTuple, Tuple, Union
+import functools
+import math
+
+
+class StreamConfig(NamedTuple):
+    name: str
+    access_type: Memory.MemoryAccessType
+    # address difference between two consecutive accesses. None if the
+    # stream is random access
+    spacing: Union[int, None]
+
+
+class SRAMAccess(NamedTuple):
+    access_type: Memory.MemoryAccessType
+    word_addr: int
+    # offsets of the elements written. None if the whole word is accessed
+    mask: Union[Tuple[int, ...], None] = None
+    prefetch: bool = False
+    stream: str = ""
+    # (offset, value) of the elements written
+    data: Tuple[Tuple[int, int], ...] = ()
+    # unique number of the access
+    tag: int = 0
+
+
+class WideWordMemory:
+    """memory made of SRAM words of `word_size` elements. linearly spaced
+    streams are aggregated: writes are collected in an aggregation buffer
+    and written as one word once the stream moves on, reads are served from
+    a prefetch buffer that fetches the next word ahead of demand. random
+    access streams go to the SRAM directly. a read stream buffers up to
+    `prefetch_depth` words, the word being read included, so a depth of 1
+    doesn't prefetch.
+
+    pending writes are forwarded to the reads, and every SRAM write updates
+    the prefetched copies, so the memory behaves like a flat array"""
+
+    def __init__(self, size: int, word_size: int, streams: List[StreamConfig],
+                 prefetch_depth: int = 2):
+        assert size % word_size == 0, \
+            f"{size} is not a multiple of the word size ({word_size})"
+        assert prefetch_depth >= 1
+        self.size = size
+        self.word_size = word_size
+        self.prefetch_depth = prefetch_depth
+        self._num_words = size // word_size
+        self._words = [[0 for _ in range(word_size)]
+                       for _ in range(self._num_words)]
+        # a read and a write stream may share the same name, e.g. the same
+        # address is used to read and write
+        self.read_streams: Dict[str, StreamConfig] = {}
+        self.write_streams: Dict[str, StreamConfig] = {}
+        for stream in streams:
+            # strides as large as the word can't be aggregated
+            if stream.spacing is not None and \
+                    abs(stream.spacing) >= word_size:
+                stream = stream._replace(spacing=None)
+            if stream.access_type == Memory.MemoryAccessType.Read:
+                self.read_streams[stream.name] = stream
+            else:
+                self.write_streams[stream.name] = stream
+        # write stream -> (word address, offset -> value)
+        self._write_buffers: Dict[str, Tuple[int, Dict[int, int]]] = {}
+        # read stream -> word address -> elements, oldest first
+        self._read_buffers: Dict[str, Dict[int, List[int]]] = \
+            {name: {} for name in self.read_streams}
+        # read stream -> word address -> the SRAM read that fetched it
+        self._read_sources: Dict[str, Dict[int, SRAMAccess]] = \
+            {name: {} for name in self.read_streams}
+        # SRAM read that supplied the last read, None if it was forwarded
+        # from an aggregation buffer
+        self.last_source: Union[SRAMAccess, None] = None
+        # SRAM accesses since the last pop_accesses()
+        self._accesses: List[SRAMAccess] = []
+        self._num_accesses = 0
+
+    @classmethod
+    def from_scheduler(cls, scheduler: Scheduler, size: int,
+                       prefetch_depth: int = 2) -> "WideWordMemory":
+        """one stream per access expression, named after the expression"""
+        streams = []
+        for var_access, access_type in \
+                ((scheduler.read_var, Memory.MemoryAccessType.Read),
+                 (scheduler.write_var, Memory.MemoryAccessType.Write)):
+            for ac_var, root_var in var_access.items():
+                streams.append(StreamConfig(str(ac_var), access_type,
+                                            scheduler.update_spacing[root_var]))
+        return cls(size, scheduler.get_elements_per_word(), streams,
+                   prefetch_depth)
+
+    def load(self, values: List[int]):
+        """initialize the SRAM content"""
+        assert len(values) == self.size
+        for word_addr in range(self._num_words):
+            start = word_addr * self.word_size
+            self._words[word_addr] = values[start:start + self.word_size]
+
+    def __split(self, addr: int):
+        return divmod(addr % self.size, self.word_size)
+
+    def __add_access(self, access: SRAMAccess) -> SRAMAccess:
+        self._num_accesses += 1
+        access = access._replace(tag=self._num_accesses)
+        self._accesses.append(access)
+        return access
+
+    def __write_word(self, word_addr: int, elements: Dict[int, int],
+                     stream: str):
+        word = self._words[word_addr]
+        for offset, value in elements.items():
+            word[offset] = value
+        mask = None if len(elements) == self.word_size else \
+            tuple(sorted(elements.keys()))
+        self.__add_access(SRAMAccess(Memory.MemoryAccessType.Write,
+                                     word_addr, mask, stream=stream,
+                                     data=tuple(sorted(elements.items()))))
+        # keep the prefetched copies coherent
+        for buffer in self._read_buffers.values():
+            if word_addr in buffer:
+                buffer[word_addr] = word[:]
+
+    def __read_word(self, word_addr: int, stream: str,
+                    prefetch: bool = False):
+        self.last_source = self.__add_access(
+            SRAMAccess(Memory.MemoryAccessType.Read, word_addr,
+                       prefetch=prefetch, stream=stream))
+        return self._words[word_addr][:]
+
+    def __fetch(self, stream: str, word_addr: int, in_use: int = None):
+        # in_use is the word being read when prefetching, which is never
+        # evicted
+        buffer = self._read_buffers[stream]
+        if word_addr in buffer:
+            return
+        if len(buffer) >= self.prefetch_depth:
+            victims = [addr for addr in buffer if addr != in_use]
+            if not victims:
+                # no room next to the word in use
+                return
+            # evict the oldest word
+            buffer.pop(victims[0])
+            self._read_sources[stream].pop(victims[0])
+        buffer[word_addr] = self.__read_word(word_addr, stream,
+                                             in_use is not None)
+        self._read_sources[stream][word_addr] = self.last_source
+
+    def flush(self, stream: str = None):
+        """write out the aggregation buffers"""
+        names = list(self._write_buffers.keys()) if stream is None \
+            else [stream]
+        for name in names:
+            if name not in self._write_buffers:
+                continue
+            word_addr, elements = self._write_buffers.pop(name)
+            if elements:
+                self.__write_word(word_addr, elements, name)
+
+    def write(self, stream: str, addr: int, value: int):
+        config = self.write_streams[stream]
+        word_addr, offset = self.__split(addr)
+        # the new value supersedes the pending ones
+        for buffer_word, elements in self._write_buffers.values():
+            if buffer_word == word_addr:
+                elements.pop(offset, None)
+        if config.spacing is None:
+            self.__write_word(word_addr, {offset: value}, stream)
+            return
+        if stream in self._write_buffers and \
+                self._write_buffers[stream][0] != word_addr:
+            self.flush(stream)
+        if stream not in self._write_buffers:
+            self._write_buffers[stream] = (word_addr, {})
+        elements = self._write_buffers[stream][1]
+        elements[offset] = value
+        if len(elements) == self.word_size:
+            self.flush(stream)
+
+    def read(self, stream: str, addr: int) -> int:
+        config = self.read_streams[stream]
+        word_addr, offset = self.__split(addr)
+        # forward the pending writes
+        for buffer_word, elements in self._write_buffers.values():
+            if buffer_word == word_addr and offset in elements:
+                self.last_source = None
+                return elements[offset]
+        if config.spacing is None:
+            return self.__read_word(word_addr, stream)[offset]
+        self.__fetch(stream, word_addr)
+        value = self._read_buffers[stream][word_addr][offset]
+        source = self._read_sources[stream][word_addr]
+        if config.spacing != 0:
+            direction = 1 if config.spacing > 0 else -1
+            next_word = (word_addr + direction) % self._num_words
+            self.__fetch(stream, next_word, word_addr)
+        self.last_source = source
+        return value
+
+    def get_sources(self) -> List[SRAMAccess]:
+        """SRAM reads whose words are still buffered"""
+        result = []
+        for sources in self._read_sources.values():
+            result += sources.values()
+        return result
+
+    def pop_accesses(self) -> List[SRAMAccess]:
+        accesses = self._accesses
+        self._accesses = []
+        return accesses
+
+
+class _Buffer(NamedTuple):
+    # one register per element of the word
+    lanes: List[Variable]
+    word: Variable
+    # elements held by a write buffer, 1 bit for a read buffer
+    mask: Variable
+
+
+class _WriteStream(NamedTuple):
+    action: str
+    # aggregation buffer, None if the stream is random access
+    aggregate: Union[_Buffer, None]
+    # elements written to the SRAM at the end of the action. the buffer
+    # keeps them afterwards, so that the actions fired in the same cycle
+    # see them before the SRAM does
+    stage: _Buffer
+    flush: Variable
+
+
+class _ReadStream(NamedTuple):
+    action: str
+    # transpose buffer of the word being read and the word prefetched after
+    # it, None if the stream is random access or doesn't move
+    current: Union[_Buffer, None]
+    prefetch: Union[_Buffer, None]
+    # word step of the stream, 1 or -1
+    direction: int
+    # word address of the SRAM read of the action, shared by the demand
+    # read and the prefetch so that they take one port slot
+    fetch: Union[Variable, None]
+    miss: Union[Variable, None]
+
+
+def _ne(left: Value, right: Union[Value, int]) -> Expression:
+    return (left == right) ^ 1
+
+
+def _bit(mask: Value, index: Union[Value, int]) -> Expression:
+    return (mask >> index) & 1
+
+
+class Aggregation:
+    """rewrites the statements of a model for a memory of SRAM words, see
+    aggregate_model. the SRAM accesses of the result are mapped to the
+    accesses of the model they serve, so that the schedule of the model
+    applies to them"""
+
+    def __init__(self, model: MemoryModel, scheduler: Scheduler):
+        assert model._num_memory == 1, "aggregation needs a single memory"
+        num_lanes = scheduler.get_elements_per_word()
+        assert num_lanes & (num_lanes - 1) == 0, \
+            f"{num_lanes} elements per word is not 2's power"
+        size = model.memory_size.eval()
+        assert size % num_lanes == 0, \
+            f"{size} is not a multiple of the word size ({num_lanes})"
+        self._model = model
+        self._num_lanes = num_lanes
+        self._num_words = size // num_lanes
+        self._shift = int(math.log2(num_lanes))
+        self._lane_width = max(1, scheduler.data_width)
+        # word addresses are as wide as the element addresses
+        self._address_width = max(
+            [1, self._shift] + [var.bit_width
+                                for var in scheduler.update_spacing])
+        self._block = _Block()
+        # the memory is split into one memory per element of the word, which
+        # are accessed at the same word address
+        self.result = MemoryModel(size, num_lanes)
+        # id of a value of the model -> the value in the result
+        self._values: Dict[int, Value] = {}
+        # (action, access type, address) of the SRAM accesses of the result
+        # -> the access of the model
+        self.accesses: Dict[Tuple[str, Memory.MemoryAccessType, object],
+                            Tuple[str, Memory.MemoryAccessType, object]] = {}
+
+        # (action, access type, address) -> address spacing
+        self._spacing: Dict[Tuple[str, Memory.MemoryAccessType, object],
+                            Union[int, None]] = {}
+        for var_access, actions, access_type in \
+                ((scheduler.read_var, scheduler.read_action,
+                  Memory.MemoryAccessType.Read),
+                 (scheduler.write_var, scheduler.write_action,
+                  Memory.MemoryAccessType.Write)):
+            for ac_var, root_var in var_access.items():
+                key = (actions[ac_var], access_type, get_expr_key(ac_var))
+                self._spacing[key] = scheduler.update_spacing[root_var]
+        self._write_streams: Dict[Tuple[str, Memory.MemoryAccessType,
+                                        object], _WriteStream] = {}
+        self._read_streams: Dict[Tuple[str, Memory.MemoryAccessType,
+                                       object], _ReadStream] = {}
+
+    def run(self) -> MemoryModel:
+        self.__copy_model()
+        statements = self._model.produce_statements()
+        assert not self.__get_accesses(self._model.get_global_stmts()), \
+            "global statements can't access the memory"
+        for action_name, stmts in statements.items():
+            for access, access_type in self.__get_accesses(stmts):
+                self.__add_stream(action_name, access, access_type)
+        result = self.result
+        for action_name, stmts in statements.items():
+            stmts = self.__rewrite(action_name, stmts) + \
+                self.__flush(action_name)
+            result._stmts[action_name] = stmts
+            # the statements are rewritten once
+            result._actions[action_name] = functools.partial(
+                result._stmts.__setitem__, action_name, stmts)
+        result._global_stmts += self.__rewrite("",
+                                               self._model.get_global_stmts())
+        return result
+
+    @staticmethod
+    def __get_accesses(stmts: List[Statement]):
+        result = []
+        for stmt in stmts:
+            result += visit_mem_access(stmt)
+        return result
+
+    def __copy_model(self):
+        model = self._model
+        result = self.result
+        for name, var in model.get_config_vars().items():
+            if name == MemoryModel.MEMORY_SIZE:
+                self._values[id(var)] = result.memory_size
+            else:
+                self._values[id(var)] = result.Configurable(
+                    var.name, var.bit_width, var.value)
+        for var in model.get_variables().values():
+            self._values[id(var)] = result.Variable(var.name, var.bit_width,
+                                                    var.value)
+        ports = model.get_ports()
+        for name, port in ports.items():
+            if not isinstance(port, Port) or port.name != name:
+                continue
+            if port.port_type == PortType.In:
+                new_port = result.PortIn(name, port.bit_width)
+            else:
+                new_port = result.PortOut(name, port.bit_width)
+            new_port.value = port.value
+            self._values[id(port)] = new_port
+        # aliases of the handshakes
+        for name, port in ports.items():
+            if name not in result.get_ports():
+                assert id(port) in self._values, f"{name} is not defined"
+                result._ports[name] = self._values[id(port)]
+        result._init_values.update(model._init_values)
+        result._reset_actions += model.get_reset_actions()
+        for var in model.get_loop_vars():
+            result._loop_vars.add(self._values[id(var)])
+        result.model_name = model.model_name
+        # same content as the flat memory
+        data = model._mem[0]._data
+        for lane, mem in enumerate(result._mem):
+            mem._data = data[lane::self._num_lanes]
+
+    def __define(self, name: str, bit_width: int) -> Variable:
+        assert name not in self._model, f"{name} is used by the model"
+        return self.result.Variable(name, bit_width, 0)
+
+    def __define_buffer(self, prefix: str, mask_width: int) -> _Buffer:
+        lanes = [self.__define(f"{prefix}_{lane}", self._lane_width)
+                 for lane in range(self._num_lanes)]
+        mask_name = f"{prefix}_mask" if mask_width > 1 else f"{prefix}_valid"
+        return _Buffer(lanes, self.__define(f"{prefix}_word",
+                                            self._address_width),
+                       self.__define(mask_name, mask_width))
+
+    def __add_stream(self, action_name: str, access: Memory.MemoryAccess,
+                     access_type: Memory.MemoryAccessType):
+        assert not isinstance(access, Memory.MemoryBankAccess)
+        key = (action_name, access_type, get_expr_key(access.var))
+        spacing = self._spacing.get(key, None)
+        # strides as large as the word can't be aggregated
+        linear = spacing is not None and abs(spacing) < self._num_lanes
+        if access_type == Memory.MemoryAccessType.Write:
+            assert key not in self._write_streams, \
+                f"{action_name} writes {access.var} twice"
+            index = len(self._write_streams)
+            aggregate = self.__define_buffer(f"agg{index}", self._num_lanes) \
+                if linear else None
+            stage = self.__define_buffer(f"stage{index}", self._num_lanes)
+            self._write_streams[key] = _WriteStream(
+                action_name, aggregate, stage,
+                self.__define(f"stage{index}_flush", 1))
+            self.accesses[(action_name, access_type,
+                           get_expr_key(stage.word))] = key
+            return
+        assert key not in self._read_streams, \
+            f"{action_name} reads {access.var} twice"
+        index = len(self._read_streams)
+        if not linear:
+            self._read_streams[key] = _ReadStream(action_name, None, None, 0,
+                                                  None, None)
+            return
+        current = self.__define_buffer(f"tb{index}", 1)
+        prefetch = None if spacing == 0 else \
+            self.__define_buffer(f"pf{index}", 1)
+        # the demand reads and the prefetches share the address
+        fetch = self.__define(f"tb{index}_fetch", self._address_width)
+        self._read_streams[key] = _ReadStream(
+            action_name, current, prefetch, 1 if spacing >= 0 else -1,
+            fetch, self.__define(f"tb{index}_miss", 1))
+        self.accesses[(action_name, access_type, get_expr_key(fetch))] = key
+
+    def __value(self, value: Union[Value, int]) -> Union[Value, int]:
+        assert not isinstance(value, Memory.MemoryAccess), \
+            "memory reads have to be assigned to a variable"
+        if isinstance(value, Expression):
+            return Expression(self.__value(value.left),
+                              self.__value(value.right), value.op)
+        elif isinstance(value, Variable):
+            assert id(value) in self._values, f"{value} is not defined"
+            return self._values[id(value)]
+        return value
+
+    def __assign(self, left: Value, right: Union[Value, int]) \
+            -> AssignStatement:
+        return AssignStatement(left, right, self._block)
+
+    def __access(self, lane: Union[Value, int], word: Value) \
+            -> Memory.MemoryBankAccess:
+        lane = Const(lane) if isinstance(lane, int) else lane
+        return Memory.MemoryBankAccess(self.result._mem, lane, word,
+                                       self._block)
+
+    def __select(self, offset: Value, stmts) -> List[Statement]:
+        """the statements of the element at offset, one per element"""
+        result = stmts[-1]
+        for lane in reversed(range(len(stmts) - 1)):
+            result = [_copy_if(offset == lane, stmts[lane], result)]
+        return result
+
+    def __rewrite(self, action_name: str, stmts: List[Statement]) \
+            -> List[Statement]:
+        result = []
+        for stmt in stmts:
+            if isinstance(stmt, If):
+                result.append(_copy_if(
+                    self.__value(stmt.predicate),
+                    self.__rewrite(action_name, stmt.expressions),
+                    self.__rewrite(action_name, stmt.else_expressions)))
+            elif isinstance(stmt, ReturnStatement):
+                result.append(ReturnStatement(
+                    [self.__value(value) for value in stmt.values],
+                    self._block))
+            else:
+                assert isinstance(stmt, AssignStatement)
+                if isinstance(stmt.left, Memory.MemoryAccess):
+                    result += self.__write(action_name, stmt)
+                elif isinstance(stmt.right, Memory.MemoryAccess):
+                    result += self.__read(action_name, stmt)
+                else:
+                    result.append(self.__assign(self.__value(stmt.left),
+                                                self.__value(stmt.right)))
+        return result
+
+    def __split(self, access: Memory.MemoryAccess):
+        addr = self.__value(access.var)
+        return addr >> self._shift, addr & (self._num_lanes - 1)
+
+    def __stage(self, stream: _WriteStream, buffer: _Buffer) \
+            -> List[Statement]:
+        stage = stream.stage
+        result = [self.__assign(lane, value)
+                  for lane, value in zip(stage.lanes, buffer.lanes)]
+        return result + [self.__assign(stage.word, buffer.word),
+                         self.__assign(stage.mask, buffer.mask),
+                         self.__assign(stream.flush, 1)]
+
+    def __write(self, action_name: str, stmt: AssignStatement) \
+            -> List[Statement]:
+        key = (action_name, Memory.MemoryAccessType.Write,
+               get_expr_key(stmt.left.var))
+        stream = self._write_streams[key]
+        word, offset = self.__split(stmt.left)
+        value = self.__value(stmt.right)
+        full = (1 << self._num_lanes) - 1
+        result = []
+        aggregate = stream.aggregate
+        if aggregate is not None:
+            # moving on to another word writes out the elements aggregated
+            result.append(_copy_if(
+                _ne(aggregate.mask, 0) & _ne(aggregate.word, word),
+                self.__stage(stream, aggregate) +
+                [self.__assign(aggregate.mask, 0)], []))
+        # the new value supersedes the pending ones
+        for other in self._write_streams.values():
+            for buffer in (other.aggregate, other.stage):
+                if buffer is None or buffer is aggregate:
+                    continue
+                result.append(_copy_if(
+                    buffer.word == word,
+                    [self.__assign(buffer.mask, buffer.mask &
+                                   ((Const(1) << offset) ^ full))], []))
+        buffer = stream.stage if aggregate is None else aggregate
+        result.append(self.__assign(buffer.word, word))
+        result += self.__select(offset, [[self.__assign(lane, value)]
+                                         for lane in buffer.lanes])
+        if aggregate is None:
+            result += [self.__assign(buffer.mask, Const(1) << offset),
+                       self.__assign(stream.flush, 1)]
+            return result
+        result.append(self.__assign(aggregate.mask,
+                                    aggregate.mask | (Const(1) << offset)))
+        # a complete word is written right away
+        result.append(_copy_if(aggregate.mask == full,
+                               self.__stage(stream, aggregate) +
+                               [self.__assign(aggregate.mask, 0)], []))
+        return result
+
+    def __merge(self, buffer: _Buffer, word: Value) -> List[Statement]:
+        # the staged elements are newer than the SRAM words read in the same
+        # cycle
+        result = []
+        for stream in self._write_streams.values():
+            stage = stream.stage
+            for lane, value in enumerate(stage.lanes):
+                result.append(_copy_if(
+                    (stage.word == word) & _bit(stage.mask, lane),
+                    [self.__assign(buffer.lanes[lane], value)], []))
+        return result
+
+    def __fill(self, buffer: _Buffer, word: Value) -> List[Statement]:
+        result = [self.__assign(lane, self.__access(index, word))
+                  for index, lane in enumerate(buffer.lanes)]
+        return result + self.__merge(buffer, word) + \
+            [self.__assign(buffer.word, word), self.__assign(buffer.mask, 1)]
+
+    def __read(self, action_name: str, stmt: AssignStatement) \
+            -> List[Statement]:
+        key = (action_name, Memory.MemoryAccessType.Read,
+               get_expr_key(stmt.right.var))
+        stream = self._read_streams[key]
+        word, offset = self.__split(stmt.right)
+        target = self.__value(stmt.left)
+        assert not isinstance(target, Memory.MemoryAccess)
+
+        def select(buffer: _Buffer):
+            return self.__select(offset, [[self.__assign(target, lane)]
+                                          for lane in buffer.lanes])
+
+        # the pending writes come first, then the words buffered by the
+        # stream, then the SRAM
+        branches = []
+        for other in self._write_streams.values():
+            for buffer in (other.aggregate, other.stage):
+                if buffer is not None:
+                    branches.append(((buffer.word == word) &
+                                     _bit(buffer.mask, offset),
+                                     select(buffer)))
+        current, prefetch = stream.current, stream.prefetch
+        if current is None:
+            self.accesses[(action_name, Memory.MemoryAccessType.Read,
+                           get_expr_key(word))] = key
+            demand = [self.__assign(target, self.__access(offset, word))]
+        else:
+            branches.append((current.mask & (current.word == word),
+                             select(current)))
+            if prefetch is not None:
+                # the prefetched word becomes the word being read
+                branches.append((prefetch.mask & (prefetch.word == word),
+                                 select(prefetch) +
+                                 [self.__assign(lane, value) for lane, value
+                                  in zip(current.lanes, prefetch.lanes)] +
+                                 [self.__assign(current.word, prefetch.word),
+                                  self.__assign(current.mask, 1),
+                                  self.__assign(prefetch.mask, 0)]))
+            demand = [self.__assign(stream.miss, 1),
+                      self.__assign(stream.fetch, word),
+                      self.__assign(target, self.__access(offset,
+                                                          stream.fetch))]
+            demand += self.__fill(current, stream.fetch)
+        stmts = demand
+        for predicate, branch in reversed(branches):
+            stmts = [_copy_if(predicate, branch, stmts)]
+        if current is None:
+            return stmts
+        result = [self.__assign(stream.miss, 0)] + stmts
+        if prefetch is None:
+            return result
+        # fetch the next word ahead of demand, unless the port was taken by
+        # the demand read
+        next_word = (word + stream.direction) & (self._num_words - 1)
+        predicate = (stream.miss == 0) & \
+            ((prefetch.mask & (prefetch.word == next_word)) == 0) & \
+            ((current.mask & (current.word == next_word)) == 0)
+        result.append(_copy_if(predicate,
+                               [self.__assign(stream.fetch, next_word)] +
+                               self.__fill(prefetch, stream.fetch), []))
+        return result
+
+    def __flush(self, action_name: str) -> List[Statement]:
+        """write the staged elements to the SRAM and update the words
+        buffered by the read streams"""
+        result = []
+        for stream in self._write_streams.values():
+            if stream.action != action_name:
+                continue
+            stage = stream.stage
+            stmts = []
+            for lane, value in enumerate(stage.lanes):
+                lane_stmts = [self.__assign(self.__access(lane, stage.word),
+                                            value)]
+                for read_stream in self._read_streams.values():
+                    for buffer in (read_stream.current,
+                                   read_stream.prefetch):
+                        if buffer is None:
+                            continue
+                        lane_stmts.append(_copy_if(
+                            buffer.mask & (buffer.word == stage.word),
+                            [self.__assign(buffer.lanes[lane], value)], []))
+                stmts.append(_copy_if(_bit(stage.mask, lane), lane_stmts,
+                                      []))
+            stmts.append(self.__assign(stream.flush, 0))
+            result.append(_copy_if(stream.flush, stmts, []))
+        return result
+
+
+def aggregate_model(model: MemoryModel, scheduler: Scheduler) \
+        -> MemoryModel:
+    """rewrite the model for an SRAM whose words hold the elements per word
+    of the scheduler. the memory of the result has one memory per element
+    of the word, all accessed at the same word address.
+
+    linearly spaced writes are collected in an aggregation buffer, which is
+    staged once the stream moves on to another word or the word is
+    complete. the staged elements are written at the end of the action.
+    linearly spaced reads are served from a transpose buffer that holds the
+    word being read, and the next word is prefetched ahead of demand. the
+    accesses that stride over whole words go to the SRAM directly. the
+    pending writes are forwarded to the reads, and every SRAM write updates
+    the buffered words, so the result behaves like the flat memory.
+
+    the ports and variables are copied by name, the model is expected to be
+    configured already"""
+    return Aggregation(model, scheduler).run()
@@ -1,55 +1,129 @@
 from karst.model import *
 from karst.stmt import *
-from typing import Dict, Tuple
-import z3
+from typing import Dict, Tuple, FrozenSet, NamedTuple
+import functools
+import hashlib
+import io
+import math
 import operator
+import pickle
+from karst.util import LazyModule
+from karst.cache import AnalysisCache
+from karst.instrument import timed, timer, count, get_profiler
 
+# z3 is only needed once an analysis is performed
+z3 = LazyModule("z3")
 
-def construct_sym_expr_tree(expression: Union[Expression, Variable],
-                            symbol_table: Dict[str, z3.Int]):
+# maximum number of entries of every memoized function. they are bounded so
+# that a long sweep or regression doesn't keep every term it has seen
+CACHE_SIZE = 1 << 14
+
+
+def get_expr_key(expression: Union[Expression, Variable, int]):
+    """structural key of an expression. configurables are folded into their
+    values, variables are identified by name, and expressions become
+    (op, left, right) tuples"""
+    key = _get_expr_key(expression)
+    if get_profiler() is not None:
+        count("expr_nodes", _count_key_nodes(key))
+    return key
+
+
+def _get_expr_key(expression: Union[Expression, Variable, int]):
     if isinstance(expression, (Const, Configurable)):
         return expression.value
     elif isinstance(expression, Variable):
-        if expression.name not in symbol_table:
-            symbol_table[expression.name] = z3.Int(expression.name)
-        return symbol_table[expression.name]
+        return expression.name
     elif isinstance(expression, int):
         return expression
+    assert isinstance(expression, Expression), \
+        f"{expression} cannot be converted to a symbolic expression"
+    return (expression.op, _get_expr_key(expression.left),
+            _get_expr_key(expression.right))
 
-    left = expression.left
-    right = expression.right
 
-    if isinstance(left, Expression):
-        left = construct_sym_expr_tree(left, symbol_table)
-    elif isinstance(left, (Const, Configurable)):
-        left = left.value
-    else:
-        assert isinstance(left, Variable)
-        if left.name not in symbol_table:
-            symbol_table[left.name] = z3.Int(left.name)
-        left = symbol_table[left.name]
-
-    if isinstance(right, Expression):
-        right = construct_sym_expr_tree(right, symbol_table)
-    elif isinstance(right, (Const, Configurable)):
-        right = right.value
-    else:
-        assert isinstance(right, Variable)
-        if right.name not in symbol_table:
-            symbol_table[right.name] = z3.Int(right.name)
-        right = symbol_table[right.name]
+def _count_key_nodes(key) -> int:
+    if isinstance(key, tuple):
+        return 1 + _count_key_nodes(key[1]) + _count_key_nodes(key[2])
+    return 0
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _get_symbol(name: str):
+    return z3.Int(name)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _get_key_symbols(key) -> FrozenSet[str]:
+    if isinstance(key, str):
+        return frozenset([key])
+    elif isinstance(key, tuple):
+        return _get_key_symbols(key[1]) | _get_key_symbols(key[2])
+    return frozenset()
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _construct_sym_key(key):
+    count("z3.nodes")
+    if isinstance(key, str):
+        return _get_symbol(key)
+    elif isinstance(key, tuple):
+        op, left, right = key
+        return op(_construct_sym_key(left), _construct_sym_key(right))
+    return key
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _simplify_key(key):
+    count("z3.simplify")
+    return z3.simplify(_construct_sym_key(key))
+
+
+def construct_sym_expr_tree(expression: Union[Expression, Variable],
+                            symbol_table: Dict[str, "z3.ArithRef"]):
+    key = get_expr_key(expression)
+    for name in _get_key_symbols(key):
+        if name not in symbol_table:
+            symbol_table[name] = _get_symbol(name)
+    return _construct_sym_key(key)
+
+
+def clear_cache():
+    """clear all the memoized symbolic terms and query results"""
+    for func in _CACHED_FUNCTIONS:
+        func.cache_clear()
+
+
+def cache_info():
+    return {func.__name__: func.cache_info() for func in _CACHED_FUNCTIONS}
 
-    return expression.op(left, right)
+
+_solver = None
+
+
+def _get_solver() -> "z3.Solver":
+    # the solver is shared by the queries. each query is done inside its own
+    # push/pop scope
+    global _solver
+    if _solver is None:
+        _solver = z3.Solver()
+    return _solver
 
 
 def is_exclusive_condition(*args):
-    symbol_table = {}
-    s = z3.Solver()
-    for condition in args:
-        cond = construct_sym_expr_tree(condition, symbol_table)
-        s.add(cond)
+    keys = tuple([get_expr_key(condition) for condition in args])
+    return _is_exclusive_keys(keys)
+
 
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _is_exclusive_keys(keys):
+    count("z3.check")
+    s = _get_solver()
+    s.push()
+    for key in keys:
+        s.add(_construct_sym_key(key))
     r = s.check()
+    s.pop()
     return r == z3.unsat
 
 
@@ -68,42 +142,97 @@ def remove_mod_op(exp: Union[Expression, Value]):
                           remove_mod_op(exp.right), exp.op)
 
 
+def get_affine_form(expression: Union[Expression, Variable, int]) \
+        -> Union[Tuple[Dict[str, int], int], None]:
+    """return the coefficient of each variable and the constant offset if the
+    expression is affine, otherwise None"""
+    form = _get_affine_form(get_expr_key(expression))
+    if form is None:
+        return None
+    coefficients, offset = form
+    return dict(coefficients), offset
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _get_affine_form(key):
+    # coefficients are stored as sorted tuple so that the forms can be
+    # compared and cached directly
+    if isinstance(key, str):
+        return ((key, 1),), 0
+    elif not isinstance(key, tuple):
+        return (), key
+    op, left, right = key
+    left = _get_affine_form(left)
+    right = _get_affine_form(right)
+    if left is None or right is None:
+        return None
+    if op in (operator.add, operator.sub):
+        sign = 1 if op == operator.add else -1
+        coefficients = dict(left[0])
+        for var, c in right[0]:
+            coefficients[var] = coefficients.get(var, 0) + sign * c
+        offset = left[1] + sign * right[1]
+    elif op in (operator.mul, operator.lshift):
+        # one side has to be a constant
+        if left[0] and right[0]:
+            return None
+        if op == operator.lshift:
+            if right[0]:
+                return None
+            right = (), 1 << right[1]
+        factor, (coefficients, offset) = (left[1], right) if not left[0] \
+            else (right[1], left)
+        coefficients = {var: c * factor for var, c in coefficients}
+        offset = offset * factor
+    else:
+        return None
+    coefficients = tuple(sorted([(var, c) for var, c in coefficients.items()
+                                 if c != 0]))
+    return coefficients, offset
+
+
 def get_linear_spacing(*args: Union[Expression, Variable]):
     # this function only handles one single variable
     if len(args) == 1:
         # this is a special case
         return True, 0
-    symbol_table = {}
-    expressions = []
-    # preprocess the expressions and variables
-    # processed = preprocess_expressions(*args)
-    for exp in args:
-        exp_ = remove_mod_op(exp)
-        smt_expr = construct_sym_expr_tree(exp_, symbol_table)
-        expressions.append(smt_expr)
-    assert len(symbol_table) == 1, "Only one variable allowed"
-    sym = symbol_table.popitem()
+    keys = tuple([get_expr_key(remove_mod_op(exp)) for exp in args])
+    return _get_linear_spacing(keys)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _simplify_abs_diff(key1, key2):
+    count("z3.simplify")
+    exp1 = _construct_sym_key(key1)
+    exp2 = _construct_sym_key(key2)
+    return z3.simplify(__abs(exp1 - exp2))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _get_linear_spacing(keys):
     ints = [0]
-    assert sym is not None
-    for idx, exp1 in enumerate(expressions):
-        for exp2 in expressions[idx + 1:]:
-            r = z3.simplify(__abs(exp1 - exp2))
-            if not isinstance(r, z3.IntNumRef) or not r.is_int():
+    forms = [_get_affine_form(key) for key in keys]
+    if None not in forms:
+        # closed form. the differences are constant only if every
+        # expression has the same coefficients
+        coefficients = forms[0][0]
+        for idx, form1 in enumerate(forms):
+            if form1[0] != coefficients:
                 return False, 1
-            ints.append(r.as_long())
+            for form2 in forms[idx + 1:]:
+                ints.append(abs(form1[1] - form2[1]))
+    else:
+        # use z3 to simplify the non-affine expressions
+        for idx, key1 in enumerate(keys):
+            for key2 in keys[idx + 1:]:
+                r = _simplify_abs_diff(key1, key2)
+                if not isinstance(r, z3.IntNumRef) or not r.is_int():
+                    return False, 1
+                ints.append(r.as_long())
     int_set = set(ints)
-    opt = z3.Optimize()
-    gcd = z3.Int("gcd")
-    for idx, i in enumerate(int_set):
-        v = z3.Int(f"int_{idx}")
-        opt.add(v * gcd == i)
-    opt.maximize(gcd)
-    r = opt.check()
-    if r != z3.sat:
-        return False, 1
-    result = opt.model()
-    value = result.eval(gcd).as_long()
-    # this is the actual gcd
+    value = 0
+    for i in int_set:
+        value = math.gcd(value, i)
     # now it's just a simple math trick to verify these are arithmetic
     # sequence
     minimum = min(int_set)
@@ -112,6 +241,11 @@ def get_linear_spacing(*args: Union[Expression, Variable]):
     return int_sum == expected_sum, value
 
 
+_CACHED_FUNCTIONS = (_get_symbol, _get_key_symbols, _construct_sym_key,
+                     _simplify_key, _simplify_abs_diff, _get_affine_form,
+                     _get_linear_spacing, _is_exclusive_keys)
+
+
 def visit_mem_access(tree: Union[Variable, Expression, Statement]):
     if isinstance(tree, If):
         # it has two expressions
@@ -147,6 +281,34 @@ def visit_mem_access(tree: Union[Variable, Expression, Statement]):
         return []
 
 
+class AddressVariable(Variable):
+    """an address computed from several variables. it is used to group the
+    memory accesses that share the same address expression"""
+
+    def __init__(self, expression: Expression):
+        variables = [v for v in get_variables(expression)
+                     if not isinstance(v, Configurable)]
+        bit_width = max([v.bit_width for v in variables])
+        super().__init__(f"addr{expression}", bit_width, variables[0].parent)
+        self.expression = expression
+
+    def eval(self):
+        return self.expression.eval()
+
+    def copy(self):
+        return AddressVariable(self.expression)
+
+
+def get_variables(expression: Union[Expression, Value]) -> List[Variable]:
+    if isinstance(expression, Expression):
+        return get_variables(expression.left) + \
+            get_variables(expression.right)
+    elif isinstance(expression, Variable):
+        return [expression]
+    return []
+
+
+@timed("get_memory_access")
 def get_memory_access(model: MemoryModel) -> \
         Dict[str, List[Tuple[Memory.MemoryAccess, Memory.MemoryAccessType]]]:
     statements = model.produce_statements()
@@ -173,8 +335,8 @@ def get_var_memory_access(access_pattern:
         exp = access.var
         access_expressions.append((exp, t))
 
-    # we need to separate the memory access by address lines
-    # because the linear spacing only handles one variable
+    # we need to separate the memory access by address lines. addresses
+    # computed from several variables get their own address variable
     def __get_variable(exp_: Union[Expression, Variable, Const]) \
             -> Union[Variable, None]:
         if isinstance(exp_, Expression):
@@ -182,10 +344,10 @@ def get_var_memory_access(access_pattern:
             right = __get_variable(exp_.right)
             if left is None:
                 return right
-            elif right is None:
+            elif right is None or left.name == right.name:
                 return left
             else:
-                assert left.name == right.name, "only one variable supported"
+                return AddressVariable(exp_)
         elif isinstance(exp_, Variable) and not isinstance(exp_, Configurable):
             return exp_
         else:
@@ -204,6 +366,114 @@ def get_var_memory_access(access_pattern:
     return variable_access
 
 
+def get_value_key(value: Union[Value, int]):
+    """structural key of a value. unlike get_expr_key it also handles memory
+    accesses, which are identified by the memory and the address"""
+    if isinstance(value, Memory.MemoryBankAccess):
+        return ("mem", id(value._mems), get_value_key(value.index),
+                get_value_key(value.var))
+    elif isinstance(value, Memory.MemoryAccess):
+        return ("mem", id(value.mem), get_value_key(value.var))
+    elif isinstance(value, Expression):
+        return (value.op, get_value_key(value.left),
+                get_value_key(value.right))
+    return get_expr_key(value)
+
+
+def get_stmt_key(stmt: Statement):
+    """canonical structural key of a statement. two statements with the same
+    key have the same effect under the current configuration"""
+    if isinstance(stmt, AssignStatement):
+        return ("assign", get_value_key(stmt.left),
+                get_value_key(stmt.right))
+    elif isinstance(stmt, If):
+        return ("if", get_value_key(stmt.predicate),
+                tuple([get_stmt_key(s) for s in stmt.expressions]),
+                tuple([get_stmt_key(s) for s in stmt.else_expressions]))
+    else:
+        assert isinstance(stmt, ReturnStatement)
+        return ("return", tuple([get_value_key(v) for v in stmt.values]))
+
+
+def _get_canonical_key(key, memories: Dict[int, int]):
+    # operators are replaced by their names and memories by the order they
+    # are accessed, so that the key is the same across runs
+    if isinstance(key, tuple):
+        if len(key) >= 3 and key[0] == "mem" and isinstance(key[1], int):
+            index = memories.setdefault(key[1], len(memories))
+            return ("mem", index) + tuple([_get_canonical_key(k, memories)
+                                           for k in key[2:]])
+        return tuple([_get_canonical_key(k, memories) for k in key])
+    elif callable(key):
+        return key.__name__
+    return key
+
+
+def _get_hash(value) -> str:
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+@timed("fingerprint")
+def get_model_fingerprint(model: MemoryModel) -> str:
+    """hash of the statement IR and the configuration. models with the same
+    fingerprint have the same analysis results"""
+    memories = {}
+    statements = model.produce_statements()
+    actions = tuple([(name, tuple([_get_canonical_key(get_stmt_key(stmt),
+                                                      memories)
+                                   for stmt in stmts]))
+                     for name, stmts in statements.items()])
+    global_stmts = tuple([_get_canonical_key(get_stmt_key(stmt), memories)
+                          for stmt in model.get_global_stmts()])
+    config = tuple(sorted([(name, var.eval()) for name, var in
+                           model.get_config_vars().items()]))
+    return _get_hash((actions, global_stmts, config))
+
+
+class _StatementPickler(pickle.Pickler):
+    def __init__(self, file, model: MemoryModel):
+        super().__init__(file)
+        self._model = model
+        self._memories = {}
+
+    def persistent_id(self, obj):
+        # the model holds the action closures, which can't be pickled
+        if obj is self._model:
+            return "model"
+        elif isinstance(obj, Memory):
+            # only the identity of a memory matters to the analysis
+            if id(obj) not in self._memories:
+                self._memories[id(obj)] = len(self._memories)
+            return "memory", self._memories[id(obj)]
+        return None
+
+
+class _StatementUnpickler(pickle.Unpickler):
+    def __init__(self, file):
+        super().__init__(file)
+        self._memories = {}
+
+    def persistent_load(self, pid):
+        if pid == "model":
+            return None
+        _, index = pid
+        if index not in self._memories:
+            self._memories[index] = Memory(1, None)
+        return self._memories[index]
+
+
+def dump_statements(model: MemoryModel, obj) -> bytes:
+    """serialize statements detached from the model, so that they can be
+    analyzed in another process. the memory content is not kept"""
+    file = io.BytesIO()
+    _StatementPickler(file, model).dump(obj)
+    return file.getvalue()
+
+
+def load_statements(data: bytes):
+    return _StatementUnpickler(io.BytesIO(data)).load()
+
+
 def get_state_updates(expressions):
     def __visit_assignments(node_):
         if isinstance(node_, Expression):
@@ -228,14 +498,13 @@ def get_state_updates(expressions):
                                                   Memory.MemoryAccess)]
         if r:
             stmts += r
-    # a brute force filter to avoid duplicates
-    result = set()
+    # remove the duplicates based on the structural key
+    result = {}
     for stmt in stmts:
-        for stmt_ in result:
-            if stmt.eq(stmt_):
-                continue
-        result.add(stmt)
-    return result
+        key = get_stmt_key(stmt)
+        if key not in result:
+            result[key] = stmt
+    return list(result.values())
 
 
 def get_updated_variables(stmts: List[AssignStatement]):
@@ -247,17 +516,210 @@ def get_updated_variables(stmts: List[AssignStatement]):
         right = stmt.right
         if isinstance(right, Memory.MemoryAccess):
             continue
-        z3_exp = construct_sym_expr_tree(right, {})
-        if isinstance(z3_exp, int):
+        key = get_expr_key(right)
+        if isinstance(key, int):
+            continue
+        form = _get_affine_form(key)
+        if form is not None:
+            if form[0]:
+                result.append(stmt)
+            continue
+        try:
+            z3_exp = _simplify_key(key)
+        except TypeError:
+            # bitwise operators are not supported by z3 integers. we
+            # conservatively treat it as an update
+            result.append(stmt)
             continue
-        z3_exp = z3.simplify(z3_exp)
         if not isinstance(z3_exp, z3.IntNumRef) or not z3_exp.is_int():
             result.append(stmt)
     return result
 
 
+class LoopCounter(NamedTuple):
+    name: str
+    step: int
+    # the counter wraps to 0 once it reaches the bound. None if it never
+    # wraps
+    bound: Union[int, None]
+
+    @property
+    def extent(self) -> Union[int, None]:
+        """number of iterations before the counter wraps"""
+        if self.bound is None or self.bound % self.step != 0:
+            return None
+        return self.bound // self.step
+
+
+def get_loop_counters(stmts: List[Statement]) -> List[LoopCounter]:
+    """extract the nested counters from the statements, innermost first.
+    a counter is either incremented and wrapped with a modulo, or
+    incremented and reset by an if statement that checks its bound. the
+    body of that if statement increments the next counter"""
+    counters = []
+
+    def __get_increment(stmt_):
+        if not isinstance(stmt_, AssignStatement) or \
+                isinstance(stmt_.left, Memory.MemoryAccess) or \
+                not isinstance(stmt_.right, Expression):
+            return None
+        name = stmt_.left.name
+        exp = stmt_.right
+        bound = None
+        if exp.op == operator.mod:
+            bound = get_expr_key(exp.right)
+            if not isinstance(bound, int):
+                return None
+            exp = exp.left
+        form = _get_affine_form(get_expr_key(exp))
+        if form is None or form[0] != ((name, 1),) or form[1] == 0:
+            return None
+        return LoopCounter(name, form[1], bound)
+
+    def __get_wrap(stmt_, name):
+        if not isinstance(stmt_, If):
+            return None
+        predicate = stmt_.predicate
+        if not isinstance(predicate, Expression) or \
+                predicate.op != operator.eq:
+            return None
+        # the operands may be swapped, e.g. var == config becomes
+        # config == var
+        left = get_expr_key(predicate.left)
+        bound = get_expr_key(predicate.right)
+        if left != name:
+            left, bound = bound, left
+        if left != name or not isinstance(bound, int):
+            return None
+        for s in stmt_.expressions:
+            if isinstance(s, AssignStatement) and \
+                    not isinstance(s.left, Memory.MemoryAccess) and \
+                    s.left.name == name and get_expr_key(s.right) == 0:
+                return bound
+        return None
+
+    def __visit(stmts_):
+        increments = [c for c in map(__get_increment, stmts_)
+                      if c is not None]
+        if len(increments) != 1:
+            # only one counter per level
+            return
+        counter = increments[0]
+        for stmt in stmts_:
+            bound = __get_wrap(stmt, counter.name)
+            if bound is not None:
+                counters.append(LoopCounter(counter.name, counter.step,
+                                            bound))
+                __visit(stmt.expressions)
+                return
+        counters.append(counter)
+
+    __visit(stmts)
+    return counters
+
+
+def get_definitions(stmts: List[Statement]) -> Dict[str, Expression]:
+    """variables that are defined by expressions of other variables"""
+    result = {}
+    for stmt in stmts:
+        if not isinstance(stmt, AssignStatement) or \
+                isinstance(stmt.left, Memory.MemoryAccess) or \
+                not isinstance(stmt.right, Expression):
+            continue
+        name = stmt.left.name
+        if name not in _get_key_symbols(get_expr_key(stmt.right)):
+            result[name] = stmt.right
+    return result
+
+
+class AccessDimension(NamedTuple):
+    name: str
+    # address difference between two iterations of the counter
+    stride: int
+    # None if the counter never wraps
+    extent: Union[int, None]
+
+
+class AffineAccessPattern:
+    """address = offset + sum(dim.stride * i_dim), where i_dim iterates over
+    the domain of each nested counter. dimensions are innermost first"""
+
+    def __init__(self, offset: int, dims: List[AccessDimension]):
+        self.offset = offset
+        self.dims = dims
+
+    @property
+    def spacing(self) -> int:
+        """address difference between two consecutive accesses"""
+        return self.dims[0].stride if self.dims else 0
+
+    @property
+    def burst(self) -> Union[int, None]:
+        """number of consecutive accesses that are evenly spaced"""
+        return self.dims[0].extent if self.dims else None
+
+    def get_addresses(self, num: int) -> List[int]:
+        index = [0 for _ in self.dims]
+        result = []
+        for _ in range(num):
+            result.append(self.offset + sum([d.stride * i for d, i in
+                                             zip(self.dims, index)]))
+            for idx, dim in enumerate(self.dims):
+                index[idx] += 1
+                if dim.extent is None or index[idx] < dim.extent:
+                    break
+                index[idx] = 0
+        return result
+
+    def __repr__(self):
+        dims = ", ".join([f"{d.name}: {d.stride} x {d.extent}"
+                          for d in self.dims])
+        return f"{self.offset} + [{dims}]"
+
+
+def _substitute(key, definitions: Dict[str, Expression], visited=()):
+    if isinstance(key, str):
+        if key in definitions and key not in visited:
+            return _substitute(get_expr_key(definitions[key]), definitions,
+                               visited + (key,))
+        return key
+    elif isinstance(key, tuple):
+        op, left, right = key
+        return (op, _substitute(left, definitions, visited),
+                _substitute(right, definitions, visited))
+    return key
+
+
+def get_access_pattern(expression: Union[Expression, Variable],
+                       counters: List[LoopCounter],
+                       definitions: Dict[str, Expression] = None) \
+        -> Union[AffineAccessPattern, None]:
+    """compute the multi-dimensional affine access pattern of an address.
+    variables defined by other variables are substituted first. returns None
+    if the address is not affine in the loop counters"""
+    if isinstance(expression, AddressVariable):
+        expression = expression.expression
+    definitions = {} if definitions is None else definitions
+    key = _substitute(get_expr_key(remove_mod_op(expression)), definitions)
+    form = _get_affine_form(key)
+    if form is None:
+        return None
+    coefficients = dict(form[0])
+    dims = []
+    for counter in counters:
+        stride = coefficients.pop(counter.name, 0)
+        dims.append(AccessDimension(counter.name, stride * counter.step,
+                                    counter.extent))
+    if coefficients:
+        # depends on something we don't know
+        return None
+    return AffineAccessPattern(form[1], dims)
+
+
 def get_mem_access_temporal_spacing(updated_statements: List[AssignStatement],
-                                    mem_access_variable: List[Variable]):
+                                    mem_access_variable: List[Variable],
+                                    counters: List[LoopCounter] = None,
+                                    definitions: Dict[str, Expression] = None):
     assigned_variable = {}
     for stmt in updated_statements:
         var = stmt.left
@@ -278,8 +740,11 @@ def get_mem_access_temporal_spacing(updated_statements: List[AssignStatement],
     result = {}
     for var in mem_access_variable:
         if var not in assigned_variable:
-            # assumes random access
-            result[var] = None
+            pattern = None
+            if counters:
+                pattern = get_access_pattern(var, counters, definitions)
+            # assumes random access if there is no pattern
+            result[var] = None if pattern is None else pattern.spacing
             continue
         # perform one update recursively and compute the difference
         current_update = assigned_variable[var]
@@ -290,3 +755,183 @@ def get_mem_access_temporal_spacing(updated_statements: List[AssignStatement],
         assert success, "Cannot determine relations after one cycle"
         result[var] = diff_int
     return result
+
+
+class ExclusivityAnalysis:
+    """loads the enable predicate of every action and the predicate of every
+    if statement of a model into a single solver. each predicate is guarded
+    by its own assumption literal, so that a pairwise query is just a check
+    under two assumptions"""
+
+    @timed("exclusivity")
+    def __init__(self, model: MemoryModel,
+                 constraints: List[Expression] = None,
+                 cache: AnalysisCache = None):
+        self._model = model
+        # the solver is only created once a query is not cached
+        self._solver: Union["z3.Solver", None] = None
+        self._literals: Dict[str, "z3.BoolRef"] = {}
+        self._predicates: Dict[str, List["z3.BoolRef"]] = {}
+        self._matrix: Dict[Tuple[str, str], bool] = {}
+        # name -> structural keys of the predicate, in the order they are
+        # added
+        self._keys: Dict[str, Tuple] = {}
+
+        statements = model.produce_statements()
+        stmts = []
+        for action_stmts in statements.values():
+            stmts += action_stmts
+        definitions = self.__get_definitions(stmts +
+                                             model.get_global_stmts())
+
+        # global constraints, e.g. inputs that are never asserted together
+        constraints = [] if constraints is None else constraints
+        self._constraints = [get_expr_key(c) for c in constraints]
+
+        # results are keyed by the predicates themselves, so the ones added
+        # later are cached correctly as well
+        self._cache = cache
+        self._cache_key = ""
+        self._cached: Dict[Tuple, bool] = {}
+        # new results not written to the cache yet
+        self._dirty = False
+        if cache is not None:
+            self._cache_key = "exclusivity-" + _get_hash(
+                (get_model_fingerprint(model),
+                 _get_canonical_key(tuple(self._constraints), {})))
+            self._cached = cache.get(self._cache_key, {})
+
+        for action_name, action_stmts in statements.items():
+            en_name = model[f"EN_{action_name}"].name
+            rdy_name = model[f"RDY_{action_name}"].name
+            conditions = [(operator.eq, en_name, 1)]
+            if rdy_name in definitions:
+                conditions.append(_substitute(rdy_name, definitions))
+            else:
+                conditions.append((operator.eq, rdy_name, 1))
+            self.add_predicate(action_name, *conditions)
+            self.__add_if_predicates(action_name, action_stmts, [0])
+
+    @staticmethod
+    def __get_definitions(stmts: List[Statement]):
+        # only the variables that are always defined in the same way can be
+        # substituted
+        result = {}
+        conflicts = set()
+
+        def __visit(stmts_):
+            for stmt in stmts_:
+                if isinstance(stmt, If):
+                    __visit(stmt.expressions)
+                    __visit(stmt.else_expressions)
+                    continue
+                for name, exp in get_definitions([stmt]).items():
+                    if name in result and not exp.eq(result[name]):
+                        conflicts.add(name)
+                    result[name] = exp
+        __visit(stmts)
+        for name in conflicts:
+            result.pop(name)
+        return result
+
+    def __add_if_predicates(self, prefix: str, stmts: List[Statement],
+                            counter: List[int]):
+        for stmt in stmts:
+            if isinstance(stmt, If):
+                name = f"{prefix}.if{counter[0]}"
+                counter[0] += 1
+                self.add_predicate(name, get_expr_key(stmt.predicate))
+                self.__add_if_predicates(prefix, stmt.expressions, counter)
+                self.__add_if_predicates(prefix, stmt.else_expressions,
+                                         counter)
+
+    @staticmethod
+    def __to_bool(key):
+        exp = _construct_sym_key(key)
+        if isinstance(exp, z3.BoolRef):
+            return exp
+        elif isinstance(exp, bool):
+            return z3.BoolVal(exp)
+        # c-style integer predicate
+        return exp != 0
+
+    def add_predicate(self, name: str, *keys):
+        """add a predicate made of the conjunction of the structural keys"""
+        assert name not in self._keys, f"{name} already exists"
+        self._keys[name] = keys
+        if self._solver is not None:
+            self.__add_to_solver(name)
+
+    def __add_to_solver(self, name: str):
+        literal = z3.Bool(f"__pred_{len(self._literals)}")
+        conditions = []
+        for key in self._keys[name]:
+            try:
+                conditions.append(self.__to_bool(key))
+            except (TypeError, z3.Z3Exception):
+                # not supported by z3 integers, e.g. xor. the predicate is
+                # conservatively treated as unconstrained
+                continue
+        if conditions:
+            self._solver.add(z3.Implies(literal, z3.And(*conditions)))
+        self._literals[name] = literal
+        self._predicates[name] = conditions
+
+    def __get_solver(self) -> "z3.Solver":
+        if self._solver is None:
+            with timer("exclusivity_solver"):
+                self._solver = z3.Solver()
+                for key in self._constraints:
+                    self._solver.add(self.__to_bool(key))
+                for name in self._keys:
+                    self.__add_to_solver(name)
+        return self._solver
+
+    @property
+    def predicates(self) -> Dict[str, List["z3.BoolRef"]]:
+        """name -> list of predicates, in the order they are added"""
+        self.__get_solver()
+        return self._predicates
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._keys.keys())
+
+    def is_exclusive(self, name1: str, name2: str) -> bool:
+        """new results are kept in memory until flush()"""
+        pair = (name1, name2) if name1 <= name2 else (name2, name1)
+        if pair not in self._matrix:
+            keys = tuple(sorted([repr(_get_canonical_key(self._keys[name], {}))
+                                 for name in pair]))
+            if keys in self._cached:
+                self._matrix[pair] = self._cached[keys]
+                return self._matrix[pair]
+            solver = self.__get_solver()
+            count("z3.check")
+            r = solver.check(self._literals[name1], self._literals[name2])
+            self._matrix[pair] = r == z3.unsat
+            if self._cache is not None:
+                self._cached[keys] = self._matrix[pair]
+                self._dirty = True
+        return self._matrix[pair]
+
+    def flush(self):
+        """write the new results to the cache"""
+        if self._dirty:
+            self._cache.set(self._cache_key, self._cached)
+            self._dirty = False
+
+    def get_matrix(self, names: List[str] = None) \
+            -> Dict[Tuple[str, str], bool]:
+        """pairwise exclusivity of the given predicates. default to all the
+        actions"""
+        if names is None:
+            names = self._model.get_action_names()
+        result = {}
+        for idx, name1 in enumerate(names):
+            for name2 in names[idx + 1:]:
+                exclusive = self.is_exclusive(name1, name2)
+                result[(name1, name2)] = exclusive
+                result[(name2, name1)] = exclusive
+        self.flush()
+        return result
@@ -244,8 +244,10 @@ def define_double_buffer():
 
         @db.mark
         def switch():
+            # use & instead of and so that the predicate is built as an
+            # expression instead of being evaluated eagerly
             if (db.write_addr >= threshold - 1) \
-                    and (db.y_iter >= threshold - 1):
+                    & (db.y_iter >= threshold - 1):
                 db.select = select ^ 1
 
         @db.action(en_port_name="ren")
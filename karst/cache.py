@@ -0,0 +1,55 @@
+from typing import Any
+import os
+import pickle
+import tempfile
+
+# bump the version whenever the analysis results change, so that the entries
+# written by an older version are not used anymore
+CACHE_VERSION = 1
+
+
+class AnalysisCache:
+    """content-addressed on-disk cache of the analysis results. the keys are
+    hashes of everything the result depends on, e.g. a model fingerprint"""
+
+    def __init__(self, path: str = None):
+        if path is None:
+            path = os.environ.get("KARST_CACHE_DIR",
+                                  os.path.join(os.path.expanduser("~"),
+                                               ".cache", "karst"))
+        self.path = os.path.join(path, f"v{CACHE_VERSION}")
+        self.hits = 0
+        self.misses = 0
+
+    def __get_filename(self, key: str):
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def get(self, key: str, default: Any = None):
+        filename = self.__get_filename(key)
+        try:
+            with open(filename, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing or corrupted entry
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        os.makedirs(self.path, exist_ok=True)
+        # write to a temporary file first so that concurrent runs never see
+        # a partial entry
+        fd, temp_filename = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(temp_filename, self.__get_filename(key))
+
+    def __contains__(self, key: str):
+        return os.path.isfile(self.__get_filename(key))
+
+    def clear(self):
+        if not os.path.isdir(self.path):
+            return
+        for filename in os.listdir(self.path):
+            os.remove(os.path.join(self.path, filename))
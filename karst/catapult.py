@@ -1,43 +1,269 @@
 from karst.cpp import *
-from typing import Set
+from karst.aggregate import aggregate_model
+from karst.scheduler import BasicScheduler, Schedule
+from karst.values import Port, PortType
+from typing import Set, TextIO
 
 
 class CatapultCodeGen(CppCodeGen):
-    def __init__(self, model: MemoryModel):
-        super().__init__(model)
+    """with a scheduler, the class gets an interface function that fires
+    the enabled actions of one iteration, and a top level function with one
+    ac_channel per port wraps it. a call of the top level function serves a
+    period of the schedule: the iterations of the period are unrolled and
+    the function is pipelined at the number of cycles of the period, so that
+    fractional rates are met exactly.
+
+    the memory is mapped to the RAM that has the ports the schedule uses. a
+    read-only and a write-only port map to a 1R1W RAM, where catapult binds
+    the accesses by their type, same as the schedule. on a true dual-port
+    RAM catapult still picks the port of an access, the assignment of the
+    schedule is emitted as comments.
+
+    if an SRAM word holds several elements, the model is rewritten by
+    aggregate_model and the memory is an array of words, where the elements
+    are slices of the words"""
+
+    INTERFACE_NAME = "run"
+    TOP_SUFFIX = "_top"
+    CHANNEL_SUFFIX = "_chan"
+    MEMORY_RESOURCE = "mem_rsc"
+
+    def __init__(self, model: MemoryModel, mapping: BankMapping = None,
+                 scheduler: BasicScheduler = None, optimize: bool = True):
+        # the memory is banked the same way it's scheduled
+        if scheduler is not None and scheduler.mapping is not None:
+            if mapping is None:
+                mapping = scheduler.mapping
+            assert mapping == scheduler.mapping
+        # elements per SRAM word
+        self._num_lanes = 1
+        if scheduler is not None and scheduler.get_elements_per_word() > 1:
+            assert mapping is None, \
+                "banked memories with wide SRAM words are not supported"
+            model = aggregate_model(model, scheduler)
+            self._num_lanes = scheduler.get_elements_per_word()
+        super().__init__(model, mapping, optimize)
 
         # if it uses any inputs or outputs name
         self._ports = self._model.get_ports()
+        self._scheduler = scheduler
+        self._schedule: Union[Schedule, None] = None
+        # member variables of the class, in order
+        self._members: List[Variable] = []
 
-    def code_gen(self) -> str:
-        # return a string
-        s = ""
+    @timed("code_gen")
+    def code_gen_to_stream(self, sink: TextIO):
+        w = self._get_writer(sink)
         template_class = "T"
-        endl = os.linesep
+        self._stmts = self._get_statements()
+        if self._scheduler is not None:
+            self._schedule = self._scheduler.schedule()
 
         # class header
         # include ac_int
-        s += f'#include "ac_int.h"{endl}'
-        s += f"{self._code_gen_template(template_class)}{endl}"
-        s += f"class {self._model.model_name} {{{endl}"
+        w.line('#include "ac_int.h"')
+        if self._schedule is not None:
+            w.line('#include "ac_channel.h"')
+        w.line(self._code_gen_template(template_class))
+        w.line(f"class {self._model.model_name} {{")
 
         # declare everything as public
-        s += f"public:{endl}"
+        w.line("public:")
 
-        # output the variables
-        s += self._code_gen_variables(1, use_ports=False, include_rdy_en=False)
-        # output memory
-        s += self._code_gen_memory(template_class, 1)
+        with w.indent():
+            # output the variables
+            self._members = self._code_gen_variables(
+                w, use_ports=False, include_rdy_en=False,
+                live=self._stmts.live)
+            # output memory
+            self._code_gen_memory(w, template_class)
 
-        s += endl
+        w.line()
         # functions
         param_list = self._get_action_param()
-        use_global_eval = len(self._model.get_global_stmts()) > 0
-        s += self._code_gen_actions(1, use_global_eval, param_list)
+        use_global_eval = len(self._stmts.global_stmts) > 0
+        with w.indent():
+            self._code_gen_actions(w, use_global_eval, param_list)
+            if self._schedule is not None:
+                self._code_gen_interface(w, param_list)
+
+        if self._schedule is None:
+            w.write("};")
+            return
+        w.line("};")
+        w.line()
+        self._code_gen_top(w, param_list)
+
+    def __get_schedule(self) -> Schedule:
+        if self._schedule is not None:
+            return self._schedule
+        return self._scheduler.schedule()
+
+    def get_initiation_interval(self) -> int:
+        """cycles between two calls of the top level function, which serves
+        a period of the schedule"""
+        return self.__get_schedule().num_cycles
+
+    def get_memory_module(self) -> str:
+        # access types served by every port of the schedule
+        port_types: Dict[int, Set[Memory.MemoryAccessType]] = {}
+        for access in self.__get_schedule().accesses:
+            port_types.setdefault(access.port, set()).add(access.access_type)
+        if len(port_types) <= 1:
+            return "ccs_sample_mem.ccs_ram_sync_singleport"
+        elif all([len(types) == 1 for types in port_types.values()]) and \
+                len(set.union(*port_types.values())) == 2:
+            # one read port and one write port
+            return "ccs_sample_mem.ccs_ram_sync_1R1W"
+        else:
+            return "ccs_sample_mem.ccs_ram_sync_dualport"
+
+    def _code_gen_memory(self, w: CodeWriter, t: str):
+        if self._schedule is not None:
+            w.line(f"#pragma hls_resource {self.MEMORY_RESOURCE} "
+                   f'variables="{self.MEMORY_NAME}" '
+                   f'map_to_module="{self.get_memory_module()}"')
+        if self._num_lanes == 1:
+            super()._code_gen_memory(w, t)
+            return
+        num_words = self._model.memory_size.eval() // self._num_lanes
+        w.line(f"{t} {self.MEMORY_NAME}[{num_words}];")
+
+    def __get_lane_width(self) -> int:
+        return max(1, self._scheduler.data_width)
 
-        s += "};"
+    def __code_gen_lane(self, mem_access: Memory.MemoryAccess) -> str:
+        # lsb of the element in the word
+        lane_width = self.__get_lane_width()
+        index = self._get_mem_index(mem_access)
+        if isinstance(index, int):
+            return str(index * lane_width)
+        return f"{self._code_gen_expr(index * lane_width)}"
 
-        return s
+    def _code_gen_mem_access(self, mem_access: Memory.MemoryAccess) -> str:
+        if self._num_lanes == 1:
+            return super()._code_gen_mem_access(mem_access)
+        var = self._code_gen_expr(mem_access.var)
+        lane = self.__code_gen_lane(mem_access)
+        return f"{self.MEMORY_NAME}[{var}]" \
+               f".slc<{self.__get_lane_width()}>({lane})"
+
+    def _code_gen_assign(self, stmt: AssignStatement, eq: str = "="):
+        if self._num_lanes == 1 or \
+                not isinstance(stmt.left, Memory.MemoryAccess):
+            return super()._code_gen_assign(stmt, eq)
+        var = self._code_gen_expr(stmt.left.var)
+        lane = self.__code_gen_lane(stmt.left)
+        value = self._code_gen_expr(stmt.right)
+        return f"{self.MEMORY_NAME}[{var}].set_slc({lane}, {value})"
+
+    def __get_interface_params(self, param_list) -> List[Variable]:
+        # the interface takes every port the actions use plus the enables, in
+        # the order of the signature
+        params = {}
+        for action_param in param_list.values():
+            for var in action_param:
+                params[var.name] = var
+        for action_name in self._model.get_action_names():
+            en = self._model[f"EN_{action_name}"]
+            params[en.name] = en
+        return sorted(params.values(), key=lambda v: self._code_gen_var(
+            v, in_func_signature=True))
+
+    def _code_gen_interface(self, w: CodeWriter, param_list):
+        params = self.__get_interface_params(param_list)
+        params = ", ".join([self._code_gen_var(var, in_func_signature=True)
+                            for var in params])
+        actions = self._model.get_action_names()
+        w.line(f"void {self.INTERFACE_NAME}({params}) {{")
+        with w.indent():
+            use_global_eval = len(self._stmts.global_stmts) > 0
+            global_param = param_list.get(self.GLOBAL_EVAL, [])
+            for action_name in actions:
+                en = self._model[f"EN_{action_name}"]
+                param = list(param_list.get(action_name, []))
+                if use_global_eval:
+                    param = self._merge_function_params(param, global_param)
+                # same order as the signature
+                param.sort(key=lambda v: self._code_gen_var(
+                    v, in_func_signature=True))
+                param = ", ".join([var.name for var in param])
+                w.line(f"if ({en.name}) {action_name}({param});")
+        w.line("}")
+        w.line()
+
+    def _code_gen_top(self, w: CodeWriter, param_list):
+        model_name = self._model.model_name
+        params = self.__get_interface_params(param_list)
+        inputs = [var for var in params if isinstance(var, Port) and
+                  var.port_type == PortType.In]
+        outputs = [var for var in params if isinstance(var, Port) and
+                   var.port_type != PortType.In]
+        input_names = {var.name for var in inputs}
+        # the other variables are kept in the top level function
+        channels = inputs + outputs
+        channels.sort(key=lambda v: self._code_gen_var(
+            v, in_func_signature=True))
+
+        # one channel per port, see the signature below
+        for var in channels:
+            name = f"{var.name}{self.CHANNEL_SUFFIX}"
+            module = "ccs_in_wait" if var.name in input_names else \
+                "ccs_out_wait"
+            w.line(f"#pragma hls_resource {name}_rsc variables=\"{name}\" "
+                   f"map_to_module=\"ccs_ioport.{module}\"")
+        # port assignment of the schedule
+        w.line("// schedule")
+        for state in self._schedule.states:
+            w.line(f"// {state}")
+        w.line("#pragma hls_design top")
+        w.line("#pragma hls_pipeline_init_interval "
+               f"{self.get_initiation_interval()}")
+        args = ", ".join([f"ac_channel<{self.__get_type(var)}> "
+                          f"&{var.name}{self.CHANNEL_SUFFIX}"
+                          for var in channels])
+        w.line(f"void {model_name}{self.TOP_SUFFIX}({args}) {{")
+        with w.indent():
+            # the state lives across the calls. the members are references
+            # that are bound to it
+            for var in self._members + params:
+                w.line(f"static {self.__get_type(var)} {var.name};")
+            members = ", ".join([var.name for var in self._members])
+            w.line(f"static {model_name}<{self.__get_template_args()}> "
+                   f"model = {{{members}}};")
+            w.line()
+            # one period of the schedule per call
+            num_iterations = self._schedule.num_iterations
+            w.line("#pragma hls_unroll yes")
+            w.line(f"for (unsigned int i = 0; i < {num_iterations}; i++) {{")
+            with w.indent():
+                for var in inputs:
+                    w.line(f"{var.name} = {var.name}{self.CHANNEL_SUFFIX}"
+                           f".read();")
+                args = ", ".join([var.name for var in params])
+                w.line(f"model.{self.INTERFACE_NAME}({args});")
+                for var in outputs:
+                    w.line(f"{var.name}{self.CHANNEL_SUFFIX}.write("
+                           f"{var.name});")
+            w.line("}")
+        w.write("}")
+
+    def __get_type(self, var: Variable) -> str:
+        decl = self._code_gen_var(var, use_reference=False,
+                                  in_func_signature=True)
+        return decl[:-len(var.name) - 1]
+
+    def __get_template_args(self) -> str:
+        # the memory holds the data of the ports, or words of them, the
+        # configurables take their configured values
+        data_width = max(1, self._scheduler.data_width) * self._num_lanes
+        args = [f"ac_int<{data_width}, false>"]
+        config_vars = self._model.get_config_vars()
+        for var_name, var in config_vars.items():
+            if var_name == self._model.MEMORY_SIZE:
+                continue
+            args.append(str(var.eval()))
+        return ", ".join(args)
 
     def _code_gen_template(self, template_class: str):
         # configs
@@ -89,14 +315,15 @@ class CatapultCodeGen(CppCodeGen):
         return var.name
 
     def _get_action_param(self):
-        action_stmts = self._model.produce_statements().copy()
+        # the ports the optimized statements still use
+        action_stmts = dict(self._stmts.actions)
+        live = self._stmts.live
         result = {}
-        if self._model.get_global_stmts():
-            action_stmts[self.GLOBAL_EVAL] = \
-                self._model.get_global_stmts()
+        if self._stmts.global_stmts:
+            action_stmts[self.GLOBAL_EVAL] = self._stmts.global_stmts
         for action_name, stmts in action_stmts.items():
             s = self._get_func_signature(stmts)
-            param = list(s)
+            param = [var for var in s if var.name in live]
             param.sort()
             result[action_name] = param
 
@@ -148,8 +375,8 @@ class CatapultCodeGen(CppCodeGen):
 
 
 class CatapultTester(CPPTester):
-    def __init__(self, codegen: CppCodeGen):
-        super().__init__(codegen)
+    def __init__(self, codegen: CppCodeGen, service: CompileService = None):
+        super().__init__(codegen, service)
         # download the ac_int and put it to the
         # I hope this file exists forever
         ac_int = "ac_int.h"
@@ -1,15 +1,61 @@
 from karst.stmt import *
 from karst.model import MemoryModel, Memory
+from typing import Set, TextIO
 import abc
+import contextlib
+import io
 import os
 
 
+class CodeWriter:
+    """writes the code fragments to a text sink, e.g. a file or an
+    io.StringIO, as they are generated. it keeps track of the indentation"""
+
+    def __init__(self, sink: TextIO, indent: str):
+        self._sink = sink
+        self._indent = indent
+        self.level = 0
+
+    def write(self, s: str):
+        self._sink.write(s)
+
+    def line(self, s: str = ""):
+        """write a line at the current indentation level. empty lines are
+        not indented"""
+        if s:
+            self._sink.write(self._indent * self.level)
+            self._sink.write(s)
+        self._sink.write(os.linesep)
+
+    @contextlib.contextmanager
+    def indent(self, num: int = 1):
+        self.level += num
+        try:
+            yield
+        finally:
+            self.level -= num
+
+
 class CodeGen:
     def __init__(self, model: MemoryModel):
         self._model = model
 
     def code_gen(self) -> str:
         """return the code as a str"""
+        stream = io.StringIO()
+        self.code_gen_to_stream(stream)
+        return stream.getvalue()
+
+    @abc.abstractmethod
+    def code_gen_to_stream(self, sink: TextIO):
+        """write the code to a text sink"""
+
+    def code_gen_to_file(self, filename: str):
+        with open(filename, "w+") as f:
+            self.code_gen_to_stream(f)
+
+    def _get_writer(self, sink: TextIO) -> CodeWriter:
+        return CodeWriter(sink, self._get_indent(1))
 
     def _code_gen_expr(self, expr: Union[Expression,
                                          Value,
@@ -49,6 +95,22 @@ class CodeGen:
     def _code_gen_mem_access(self, mem_access: Memory.MemoryAccess) -> str:
         """return memory access code"""
 
+    def _get_mem_index(self, mem_access: Memory.MemoryAccess) \
+            -> Union[int, Value]:
+        """memory index of the access, or the value that selects it"""
+        if isinstance(mem_access, Memory.MemoryBankAccess):
+            index = mem_access.index
+            if isinstance(index, Const):
+                return index.eval()
+            return index
+        return self._model._mem.index(mem_access.mem)
+
+    def _code_gen_mem_index(self, mem_access: Memory.MemoryAccess) -> str:
+        index = self._get_mem_index(mem_access)
+        if isinstance(index, Value):
+            return self._code_gen_expr(index)
+        return str(index)
+
     def _code_gen_assign(self, stmt: AssignStatement, eq: str = "="):
         left = self._code_gen_expr(stmt.left)
         right = self._code_gen_expr(stmt.right)
@@ -59,12 +121,11 @@ class CodeGen:
     def _get_indent(cls, indent_num) -> str:
         """return indentation"""
 
-    def _code_gen_variables(self, indent_num: int, use_ports: bool = True,
-                            include_rdy_en: bool = True):
-        indent = self._get_indent(indent_num)
-        endl = os.linesep
-        s = ""
-
+    def _code_gen_variables(self, w: CodeWriter, use_ports: bool = True,
+                            include_rdy_en: bool = True,
+                            live: Set[str] = None) -> List[Variable]:
+        """declare the variables and return them in order"""
+        result = []
         variables = self._model.get_variables().copy()
         if use_ports:
             variables.update(self._model.get_ports().copy())
@@ -83,8 +144,12 @@ class CodeGen:
             var = variables[var_name]
             if var.name in used_vars:
                 continue
+            elif live is not None and var.name not in live:
+                # nothing uses it
+                continue
             else:
                 used_vars.add(var.name)
             var_str = self._code_gen_var(var, in_func_signature=True)
-            s += f"{indent}{var_str};{endl}"
-        return s
+            w.line(f"{var_str};")
+            result.append(var)
+        return result
@@ -0,0 +1,162 @@
+from karst.instrument import timed
+from typing import List, NamedTuple, Sequence
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+COMPILER = "g++"
+
+
+class CompileJob(NamedTuple):
+    src: str
+    # compiler flags, e.g. ["-c"] for an object file
+    flags: Sequence[str] = ("-c",)
+    # headers the source includes, copied next to it
+    files: Sequence[str] = ()
+    suffix: str = ".o"
+
+
+def get_compile_cache_path() -> str:
+    # next to the analysis cache, which clears its own directory only
+    path = os.environ.get("KARST_CACHE_DIR",
+                          os.path.join(os.path.expanduser("~"), ".cache",
+                                       "karst"))
+    return os.path.join(path, "compile")
+
+
+@timed("compile")
+def compile_job(job: CompileJob, output: str):
+    """compile the job in a temporary directory into `output`"""
+    with tempfile.TemporaryDirectory() as dir_name:
+        for filename in job.files:
+            assert os.path.isfile(filename)
+            shutil.copy(filename, dir_name)
+        src_filename = os.path.join(dir_name, "src.cc")
+        with open(src_filename, "w") as f:
+            f.write(job.src)
+        subprocess.check_call([COMPILER] + list(job.flags) +
+                              ["-o", output, src_filename], cwd=dir_name)
+
+
+def check_job(job: CompileJob):
+    """compile the job and throw the output away"""
+    with tempfile.TemporaryDirectory() as dir_name:
+        compile_job(job, os.path.join(dir_name, "out" + job.suffix))
+
+
+def check_all(jobs: List[CompileJob], num_workers: int = None):
+    """compile the jobs concurrently without keeping the outputs"""
+    if num_workers == 1:
+        list(map(check_job, jobs))
+    else:
+        # the work is done by the g++ processes, threads are enough
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=num_workers) as pool:
+            list(pool.map(check_job, jobs))
+
+
+class CompileService:
+    """compiles C++ sources with g++ and keeps the outputs in its own cache
+    directory under the hash of the source, the flags and the included
+    files, so identical sources are only compiled once. the least recently
+    used outputs are removed once the directory grows over `max_size`
+    bytes"""
+
+    MAX_SIZE = 256 << 20
+
+    def __init__(self, path: str = None, max_size: int = MAX_SIZE,
+                 num_workers: int = None):
+        self.path = get_compile_cache_path() if path is None else path
+        self.max_size = max_size
+        # None uses all the cores
+        self.num_workers = num_workers
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_key(self, job: CompileJob) -> str:
+        h = hashlib.sha256()
+        h.update(COMPILER.encode())
+        for flag in job.flags:
+            h.update(b"\0" + flag.encode())
+        for filename in job.files:
+            h.update(b"\0" + os.path.basename(filename).encode() + b"\0")
+            with open(filename, "rb") as f:
+                h.update(f.read())
+        h.update(b"\0" + job.src.encode())
+        return h.hexdigest()
+
+    def get_filename(self, job: CompileJob) -> str:
+        return os.path.join(self.path, self.get_key(job) + job.suffix)
+
+    def compile(self, job: CompileJob) -> str:
+        """return the compiled output of the job, compiling it if it's not
+        in the cache"""
+        filename = self.get_filename(job)
+        if os.path.isfile(filename):
+            # mark it as recently used
+            os.utime(filename)
+            with self._lock:
+                self.hits += 1
+            return filename
+        os.makedirs(self.path, exist_ok=True)
+        # compile next to the cache and move it in place, so that
+        # concurrent runs never see a partial output
+        fd, temp_filename = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        os.close(fd)
+        try:
+            compile_job(job, temp_filename)
+            os.replace(temp_filename, filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        with self._lock:
+            self.misses += 1
+            self.trim(keep=filename)
+        return filename
+
+    def trim(self, keep: str = None):
+        """remove the least recently used outputs until the cache fits"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            if name.endswith(".tmp") or not os.path.isfile(filename):
+                continue
+            stat = os.stat(filename)
+            entries.append((stat.st_mtime, filename, stat.st_size))
+            total += stat.st_size
+        entries.sort()
+        for _, filename, size in entries:
+            if total <= self.max_size:
+                break
+            if filename == keep:
+                continue
+            os.remove(filename)
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+
+    def compile_all(self, jobs: List[CompileJob]) -> List[str]:
+        """compile the jobs concurrently. identical jobs are compiled once"""
+        unique_jobs = {}
+        for job in jobs:
+            unique_jobs.setdefault(self.get_key(job), job)
+        keys = list(unique_jobs.keys())
+        values = list(unique_jobs.values())
+        if self.num_workers == 1:
+            results = list(map(self.compile, values))
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.num_workers) as pool:
+                results = list(pool.map(self.compile, values))
+        outputs = dict(zip(keys, results))
+        return [outputs[self.get_key(job)] for job in jobs]
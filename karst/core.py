@@ -27,11 +27,60 @@ class MemoryInstruction:
         self.data_entries = data_entries
 
 
+class LatencyPipeline:
+    """fixed-size ring buffer of output records. each cycle a new record is
+    pushed in and the one from `latency` cycles ago comes out. records are
+    only moved around, never copied"""
+
+    def __init__(self, latency: int = 0):
+        assert latency >= 0, "latency cannot be negative"
+        self.latency = latency
+        self._records: List[Dict[str, int]] = []
+        self._index = 0
+        self.clear()
+
+    def clear(self):
+        # nothing comes out until the pipeline is filled
+        self._records = [{} for _ in range(self.latency)]
+        self._index = 0
+
+    def push(self, record: Dict[str, int]) -> Dict[str, int]:
+        if self.latency == 0:
+            return record
+        index = self._index
+        result = self._records[index]
+        self._records[index] = record
+        index += 1
+        self._index = 0 if index == self.latency else index
+        return result
+
+    def get_records(self) -> List[Dict[str, int]]:
+        """records in flight, oldest first"""
+        return self._records[self._index:] + self._records[:self._index]
+
+    def copy(self) -> "LatencyPipeline":
+        pipeline = LatencyPipeline(self.latency)
+        pipeline._records = self._records[:]
+        pipeline._index = self._index
+        return pipeline
+
+
 class MemoryCore:
     """functional model for memory core. we don't need to add configuration
     space as it's too low level"""
 
-    def __init__(self, memory_size):
+    # map the generic enable ports to the actions of each mode
+    ACTION_NAMES = {
+        MemoryMode.SRAM: {"wen": "write", "ren": "read"},
+        MemoryMode.FIFO: {"wen": "enqueue", "ren": "dequeue"},
+        MemoryMode.RowBuffer: {"wen": "enqueue"},
+        MemoryMode.DoubleBuffer: {"wen": "write", "ren": "read"}}
+
+    # read latency in cycles. modes not listed here have zero latency
+    DEFAULT_LATENCY = {MemoryMode.SRAM: 1}
+
+    def __init__(self, memory_size,
+                 latency: Dict[MemoryMode, int] = None):
         self._sram = define_sram()
         self._fifo = define_fifo()
         self._row_buffer = define_row_buffer()
@@ -46,10 +95,7 @@ class MemoryCore:
 
         self.memory_size = memory_size
 
-        self._action_names = {
-            MemoryMode.SRAM: {"wen": "write", "ren": "read"},
-            MemoryMode.FIFO: {"wen": "enqueue", "ren": "dequeue"},
-            MemoryMode.RowBuffer: {"wen": "enqueue"}}
+        self._action_names = self.ACTION_NAMES
 
         # get all the configurables
         self.config_vars: Dict[str, Configurable] = {}
@@ -59,8 +105,11 @@ class MemoryCore:
         self._mem: Union[MemoryModel, None] = None
         self._instr: Union[MemoryInstruction, None] = None
 
-        # depends on the latency, we may latch out the data for next cycle
-        self._last_values = {}
+        # depends on the latency, we may latch out the data for later cycles
+        self.latency = self.DEFAULT_LATENCY.copy()
+        if latency is not None:
+            self.latency.update(latency)
+        self._pipeline = LatencyPipeline()
 
         # compute the address space
         # notice that we need multiple feature spaces
@@ -106,37 +155,40 @@ class MemoryCore:
         self._mem.configure(**values)
         self.__get_vars(self._mem)
         self._instr = instr
+        self._pipeline = LatencyPipeline(self.latency.get(mode, 0))
         self._mem.produce_statements()
         # write to memory
         for addr, data in instr.data_entries:
             self._mem.write_to_mem(addr, data)
 
     def eval(self, **kargs):
+        action_map = self._action_names[self._instr.memory_mode]
         for name, value in kargs.items():
-            if name in self.ports \
-                    and self.ports[name].port_type == PortType.In:
-                self.ports[name](value).eval()
-        actions = set()
-        # figure out which action to trigger
+            if name in action_map:
+                name = f"EN_{action_map[name]}"
+            if self.__is_port(name, PortType.In):
+                # set the value directly to avoid creating statements
+                self.ports[name].value = value
+        actions = []
+        # figure out which action to trigger. we follow the port order so
+        # that actions fired in the same cycle are always evaluated in the
+        # same order
         for name, var in self.ports.items():
-            if name[:3] == "EN_":
-                var_name = var.name
-                if var.eval() == 1:
-                    action_map = self._action_names[self._instr.memory_mode]
-                    actions.add(action_map[var_name])
+            if name[:3] == "EN_" and var.eval() == 1:
+                actions.append(name[3:])
 
         for action_name in actions:
             self._mem[action_name]()
         result = {}
-        for name, var in self.ports.items():
-            if var.port_type == PortType.Out:
-                result[name] = var.eval()
-
-        if self._instr.memory_mode == MemoryMode.SRAM:
-            temp = self._last_values
-            self._last_values = result
-            return temp
-        return result
+        for name in self.ports:
+            if self.__is_port(name, PortType.Out):
+                result[name] = self.ports[name].eval()
+        return self._pipeline.push(result)
+
+    def __is_port(self, name: str, port_type: PortType):
+        # ready signals can be aliased to normal variables
+        var = self.ports.get(name, None)
+        return isinstance(var, Port) and var.port_type == port_type
 
     def get_bitstream(self, instr: MemoryInstruction):
         # the first register is always the mode
@@ -1,8 +1,13 @@
 from karst.stmt import *
 from karst.model import MemoryModel, Memory
-from karst.codegen import CodeGen
-import os
-from typing import Dict
+from karst.codegen import CodeGen, CodeWriter
+from karst.partition import BankMapping
+from karst.compiler import CompileService, CompileJob, check_job, \
+    check_all
+from karst.optimize import OptimizedStatements, Temporary, \
+    optimize_statements
+from typing import Dict, TextIO
+from karst.instrument import timed
 
 
 class CppCodeGen(CodeGen):
@@ -10,53 +15,71 @@ class CppCodeGen(CodeGen):
     MEMORY_NAME = "mem"
     GLOBAL_EVAL = "global_eval"
 
-    def __init__(self, model: MemoryModel):
+    def __init__(self, model: MemoryModel, mapping: BankMapping = None,
+                 optimize: bool = True):
         super().__init__(model)
-
-    def code_gen(self) -> str:
-        # return a string
-        s = ""
+        # memory banks are emitted as a 2D array
+        self._mapping = mapping
+        # common subexpressions and dead variables are removed
+        self._optimize = optimize
+        self._stmts: Union[OptimizedStatements, None] = None
+
+    def _get_statements(self) -> OptimizedStatements:
+        if self._optimize:
+            return optimize_statements(self._model)
+        names = set(self._model.get_ports().keys())
+        names |= set(self._model.get_variables().keys())
+        names |= {var.name for var in self._model.get_ports().values()}
+        return OptimizedStatements(self._model.produce_statements(),
+                                   self._model.get_global_stmts(), names)
+
+    @timed("code_gen")
+    def code_gen_to_stream(self, sink: TextIO):
+        w = self._get_writer(sink)
         template_class = "T"
-        endl = os.linesep
+        self._stmts = self._get_statements()
 
         # class header
-        s += f"template<class {template_class}>{endl}"
-        s += f"class {self._model.model_name} {{{endl}"
+        w.line(f"template<class {template_class}>")
+        w.line(f"class {self._model.model_name} {{")
 
         # declare everything as public
-        s += f"public:{endl}"
+        w.line("public:")
 
-        # output the variables
-        s += self._code_gen_variables(1)
-        # output memory
-        s += self._code_gen_memory(template_class, 1)
+        with w.indent():
+            # output the variables
+            self._code_gen_variables(w, live=self._stmts.live)
+            # output memory
+            self._code_gen_memory(w, template_class)
 
-        s += endl
+        w.line()
         # functions
-        use_global_eval = len(self._model.get_global_stmts()) > 0
-        s += self._code_gen_actions(1, use_global_eval)
-
-        s += "};"
+        use_global_eval = len(self._stmts.global_stmts) > 0
+        with w.indent():
+            self._code_gen_actions(w, use_global_eval)
 
-        return s
+        w.write("};")
 
-    def _code_gen_memory(self, t: str, indent_num: int):
+    def _code_gen_memory(self, w: CodeWriter, t: str):
         size = self._model.memory_size.eval()
-        indent = indent_num * self.CPP_INDENT
-        endl = os.linesep
-        return f"{indent}{t} {self.MEMORY_NAME}[{size}];{endl}"
-
-    def _code_gen_actions(self, indent_num: int,
-                          use_global_eval: bool = False,
-                          param_list: Dict[str, List[Variable]] = None) -> str:
-        indent = self._get_indent(indent_num)
-        endl = os.linesep
-        s = ""
+        if self._mapping is not None:
+            assert self._mapping.size == size
+            num_banks = self._mapping.num_banks
+            bank_size = self._mapping.bank_size
+            w.line(f"{t} {self.MEMORY_NAME}[{num_banks}][{bank_size}];")
+        elif self._model._num_memory > 1:
+            num_memory = self._model._num_memory
+            mem_size = size // num_memory
+            w.line(f"{t} {self.MEMORY_NAME}[{num_memory}][{mem_size}];")
+        else:
+            w.line(f"{t} {self.MEMORY_NAME}[{size}];")
 
+    def _code_gen_actions(self, w: CodeWriter, use_global_eval: bool = False,
+                          param_list: Dict[str, List[Variable]] = None):
         if param_list is None:
             param_list = {}
 
-        action_stmts = self._model.produce_statements()
+        action_stmts = self._stmts.actions
         global_param = [] if self.GLOBAL_EVAL not in param_list \
             else param_list[self.GLOBAL_EVAL]
         for action_name in action_stmts:
@@ -66,26 +89,28 @@ class CppCodeGen(CodeGen):
             if use_global_eval:
                 param = self._merge_function_params(param, global_param)
             param = self._get_function_params(param, True)
-            s += f"{indent}void {action_name}({param}) {{{endl}"
-            for stmt in stmts:
-                s += self._code_gen_stmts(stmt, indent_num + 1)
-            if use_global_eval:
-                indent_ = self._get_indent(indent_num + 1)
-                param = self._get_function_params(global_param, False)
-                s += f"{endl}{indent_}{self.GLOBAL_EVAL}({param});{endl}"
-            s += f"{indent}}}{endl}{endl}"
+            w.line(f"void {action_name}({param}) {{")
+            with w.indent():
+                for stmt in stmts:
+                    self._code_gen_stmts(w, stmt)
+                if use_global_eval:
+                    param = self._get_function_params(global_param, False)
+                    w.line()
+                    w.line(f"{self.GLOBAL_EVAL}({param});")
+            w.line("}")
+            w.line()
 
         if use_global_eval:
-            stmts = self._model.get_global_stmts()
+            stmts = self._stmts.global_stmts
             param = [] if self.GLOBAL_EVAL not in param_list else \
                 param_list[self.GLOBAL_EVAL]
             param = self._get_function_params(param, True)
-            s += f"{indent}void {self.GLOBAL_EVAL}({param}) {{{endl}"
-            for stmt in stmts:
-                s += self._code_gen_stmts(stmt, indent_num + 1)
-            s += f"{indent}}}{endl}{endl}"
-
-        return s
+            w.line(f"void {self.GLOBAL_EVAL}({param}) {{")
+            with w.indent():
+                for stmt in stmts:
+                    self._code_gen_stmts(w, stmt)
+            w.line("}")
+            w.line()
 
     def _get_function_params(self, param, in_signature: bool):
         param = [self._code_gen_var(var, in_func_signature=in_signature)
@@ -108,35 +133,34 @@ class CppCodeGen(CodeGen):
     def _get_indent(cls, indent_num):
         return indent_num * cls.CPP_INDENT
 
-    def _code_gen_stmts(self, stmt: Statement, indent_num: int) -> str:
-        indent = self._get_indent(indent_num)
-        endl = os.linesep
-        s = ""
+    def _code_gen_stmts(self, w: CodeWriter, stmt: Statement):
         if isinstance(stmt, If):
-            s += self._code_gen_if(endl, indent, indent_num, stmt)
+            self._code_gen_if(w, stmt)
         elif isinstance(stmt, ReturnStatement):
             # we don't return in C++ code as we can't return a list of stuff
             # easily. maybe tuple? need to double check with HLS
             pass
         elif isinstance(stmt, AssignStatement):
             content = self._code_gen_assign(stmt, eq="=")
-            s += f"{indent}{content};{endl}"
+            if isinstance(stmt.left, Temporary):
+                # same type as the expression it replaces
+                content = f"auto {content}"
+            w.line(f"{content};")
         else:
             raise NotImplemented(stmt)
-        return s
 
-    def _code_gen_if(self, endl, indent, indent_num, stmt):
-        s = ""
+    def _code_gen_if(self, w: CodeWriter, stmt: If):
         predicate = self._code_gen_expr(stmt.predicate)
-        s += f"{indent}if ({predicate}) {{{endl}"
-        for stmt_ in stmt.expressions:
-            s += self._code_gen_stmts(stmt_, indent_num + 1)
+        w.line(f"if ({predicate}) {{")
+        with w.indent():
+            for stmt_ in stmt.expressions:
+                self._code_gen_stmts(w, stmt_)
         if stmt.else_expressions:
-            s += f"{indent}}} else {{{endl}"
-            for stmt_ in stmt.else_expressions:
-                s += self._code_gen_stmts(stmt_, indent_num + 1)
-        s += f"{indent}}}{endl}"
-        return s
+            w.line("} else {")
+            with w.indent():
+                for stmt_ in stmt.else_expressions:
+                    self._code_gen_stmts(w, stmt_)
+        w.line("}")
 
     def _code_gen_var(self, var: Variable,
                       in_func_signature: bool = False) -> str:
@@ -148,29 +172,45 @@ class CppCodeGen(CodeGen):
             return f"unsigned int {var.name}"
 
     def _code_gen_mem_access(self, mem_access: Memory.MemoryAccess) -> str:
+        if self._mapping is not None:
+            bank = self._code_gen_expr(
+                self._mapping.get_bank_expr(mem_access.var))
+            offset = self._code_gen_expr(
+                self._mapping.get_offset_expr(mem_access.var))
+            return f"{self.MEMORY_NAME}[{bank}][{offset}]"
         var = self._code_gen_expr(mem_access.var)
+        if self._model._num_memory > 1:
+            index = self._code_gen_mem_index(mem_access)
+            return f"{self.MEMORY_NAME}[{index}][{var}]"
         return f"{self.MEMORY_NAME}[{var}]"
 
-    def code_gen_to_file(self, filename: str):
-        with open(filename, "w+") as f:
-            f.write(self.code_gen())
-
 
 class CPPTester:
-    def __init__(self, codegen: CppCodeGen):
+    def __init__(self, codegen: CppCodeGen, service: CompileService = None):
         self.codegen = codegen
         self._files_to_copy = []
-
-    def test(self):
-        import tempfile
-        import subprocess
-        import os
-        import shutil
-
-        with tempfile.TemporaryDirectory() as dir_name:
-            for filename in self._files_to_copy:
-                assert os.path.isfile(filename)
-                shutil.copy(filename, dir_name)
-            src_filename = os.path.join(dir_name, "src.cc")
-            self.codegen.code_gen_to_file(src_filename)
-            subprocess.check_call(["g++", "-c", src_filename], cwd=dir_name)
+        # compiled objects are cached by the service if there is one,
+        # otherwise they are thrown away
+        self.service = service
+
+    def get_job(self) -> CompileJob:
+        return CompileJob(self.codegen.code_gen(),
+                          files=tuple(self._files_to_copy))
+
+    def test(self) -> Union[str, None]:
+        """compile the code. returns the cached object if there is a
+        service"""
+        if self.service is None:
+            check_job(self.get_job())
+            return None
+        return self.service.compile(self.get_job())
+
+    @staticmethod
+    def test_all(testers: List["CPPTester"], service: CompileService = None,
+                 num_workers: int = None) -> Union[List[str], None]:
+        """compile the code of all the testers concurrently"""
+        jobs = [tester.get_job() for tester in testers]
+        if service is None:
+            check_all(jobs, num_workers)
+            return None
+        return service.compile_all(jobs)
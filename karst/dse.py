@@ -0,0 +1,170 @@
+from .macro import SRAMMacro
+from .scheduler import BasicScheduler
+from .cache import AnalysisCache
+from .model import MemoryModel
+from .instrument import pool_map
+from typing import Callable, Dict, List, NamedTuple, Tuple, Union
+import concurrent.futures
+import itertools
+import time
+
+
+# relative area of a bit cell for (num_ports, num_en_ports)
+PORT_AREA = {(1, 1): 1.0, (2, 1): 1.5, (2, 2): 2.0}
+
+
+class MacroConfig(NamedTuple):
+    size: int
+    port_size: int
+    num_ports: int = 1
+    num_en_ports: int = 1
+
+    def get_macro(self) -> SRAMMacro:
+        return SRAMMacro(self.size, self.port_size,
+                         num_ports=self.num_ports,
+                         num_en_ports=self.num_en_ports)
+
+    @property
+    def area(self) -> float:
+        """area proxy of the macro"""
+        return self.size * self.port_size * \
+            PORT_AREA[(self.num_ports, self.num_en_ports)]
+
+
+class DesignPoint(NamedTuple):
+    config: Tuple[Tuple[str, int], ...]
+    macro: MacroConfig
+    throughput: float = 0.0
+    num_cycles: int = 0
+    # number of memory elements in an SRAM word, not a port count
+    elements_per_word: int = 0
+    error: Union[str, None] = None
+
+    @property
+    def area(self) -> float:
+        return self.macro.area
+
+    def dominates(self, other: "DesignPoint"):
+        """higher throughput and smaller area, one of them strictly"""
+        return self.throughput >= other.throughput and \
+            self.area <= other.area and \
+            (self.throughput > other.throughput or self.area < other.area)
+
+
+def evaluate_config(model_factory: Callable[[], MemoryModel],
+                    config: Tuple[Tuple[str, int], ...],
+                    macros: List[MacroConfig],
+                    cache: AnalysisCache = None) -> List[DesignPoint]:
+    """evaluate a model configuration against all the macros. the model is
+    only defined and configured once"""
+    try:
+        model = model_factory()
+        model.configure(**dict(config))
+    except Exception as ex:
+        return [DesignPoint(config, macro, error=repr(ex)) for macro in macros]
+    memory_size = model.memory_size.eval()
+    result = []
+    for macro in macros:
+        try:
+            scheduler = BasicScheduler(model, macro.get_macro(), cache=cache)
+            # the macro has to hold the whole memory
+            if macro.size * macro.port_size < \
+                    memory_size * scheduler.data_width:
+                result.append(DesignPoint(config, macro,
+                                          error="not enough capacity"))
+                continue
+            schedule = scheduler.schedule()
+            result.append(DesignPoint(config, macro, schedule.throughput,
+                                      schedule.num_cycles,
+                                      scheduler.get_elements_per_word()))
+        except Exception as ex:
+            result.append(DesignPoint(config, macro, error=repr(ex)))
+    return result
+
+
+def get_pareto_frontier(points: List[DesignPoint]) -> List[DesignPoint]:
+    """points that are not dominated by any other point, sorted by area"""
+    points = [p for p in points if p.error is None]
+    result = [p for p in points if not any([q.dominates(p) for q in points])]
+    result.sort(key=lambda p: (p.area, -p.throughput))
+    return result
+
+
+class DSEReport:
+    def __init__(self, points: List[DesignPoint], wall_time: float):
+        self.points = points
+        self.wall_time = wall_time
+
+    @property
+    def failures(self) -> List[DesignPoint]:
+        return [p for p in self.points if p.error is not None]
+
+    @property
+    def frontier(self) -> List[DesignPoint]:
+        return get_pareto_frontier(self.points)
+
+    def get_frontier(self, **config) -> List[DesignPoint]:
+        """pareto frontier of the points that match the configuration"""
+        points = [p for p in self.points
+                  if all([dict(p.config).get(k) == v
+                          for k, v in config.items()])]
+        return get_pareto_frontier(points)
+
+    def __repr__(self):
+        lines = [f"{len(self.points)} points in {self.wall_time:.2f}s, "
+                 f"{len(self.failures)} failed"]
+        for p in self.frontier:
+            config = ", ".join([f"{k}={v}" for k, v in p.config])
+            m = p.macro
+            lines.append(f"{m.size}x{m.port_size} ports={m.num_ports}/"
+                         f"{m.num_en_ports} {config}: throughput="
+                         f"{p.throughput:.2f} area={p.area:.0f}")
+        return "\n".join(lines)
+
+
+class DesignSpaceExplorer:
+    """sweeps the SRAM macros and the model configurations on a process
+    pool. the model factory has to be a module-level function so that it
+    can be sent to the workers"""
+
+    def __init__(self, model_factory: Callable[[], MemoryModel],
+                 configs: Dict[str, List[int]],
+                 sizes: List[int], port_sizes: List[int],
+                 ports: List[Tuple[int, int]] = ((1, 1), (2, 1), (2, 2)),
+                 num_workers: int = None, cache: AnalysisCache = None):
+        self.model_factory = model_factory
+        self.configs = configs
+        self.sizes = sizes
+        self.port_sizes = port_sizes
+        self.ports = ports
+        # None uses all the cores
+        self.num_workers = num_workers
+        self.cache = cache
+
+    def get_configs(self) -> List[Tuple[Tuple[str, int], ...]]:
+        names = sorted(self.configs.keys())
+        values = [self.configs[name] for name in names]
+        return [tuple(zip(names, v)) for v in itertools.product(*values)]
+
+    def get_macros(self) -> List[MacroConfig]:
+        return [MacroConfig(size, port_size, num_ports, num_en_ports)
+                for size, port_size, (num_ports, num_en_ports) in
+                itertools.product(self.sizes, self.port_sizes, self.ports)]
+
+    def run(self) -> DSEReport:
+        start = time.time()
+        configs = self.get_configs()
+        macros = self.get_macros()
+        num_configs = len(configs)
+        args = ([self.model_factory] * num_configs, configs,
+                [macros] * num_configs, [self.cache] * num_configs)
+        if self.num_workers == 1:
+            results = list(map(evaluate_config, *args))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.num_workers) as pool:
+                results = pool_map(pool, evaluate_config, *args)
+        points = []
+        for r in results:
+            points += r
+        return DSEReport(points, time.time() - start)
@@ -0,0 +1,192 @@
+from typing import Dict, List, Tuple, Union
+import contextlib
+import functools
+import json
+import os
+import time
+
+
+class TimerNode:
+    def __init__(self, name: str):
+        self.name = name
+        self.elapsed = 0.0
+        self.calls = 0
+        self.counters: Dict[str, int] = {}
+        self.children: Dict[str, "TimerNode"] = {}
+
+    def get_child(self, name: str) -> "TimerNode":
+        if name not in self.children:
+            self.children[name] = TimerNode(name)
+        return self.children[name]
+
+    def get_counter(self, name: str) -> int:
+        """total count of the node and all its children"""
+        return self.counters.get(name, 0) + \
+            sum([c.get_counter(name) for c in self.children.values()])
+
+    def merge(self, other: "TimerNode"):
+        """add the timers and counters of another node"""
+        self.elapsed += other.elapsed
+        self.calls += other.calls
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, child in other.children.items():
+            self.get_child(name).merge(child)
+
+    def to_dict(self):
+        return {"name": self.name, "elapsed": self.elapsed,
+                "calls": self.calls, "counters": dict(self.counters),
+                "children": [c.to_dict() for c in self.children.values()]}
+
+
+class Profiler:
+    """hierarchical timers and counters. timers with the same name under the
+    same parent are merged"""
+
+    def __init__(self):
+        self.root = TimerNode("total")
+        self._stack: List[TimerNode] = [self.root]
+        # name, start and duration of every timer, used by the chrome trace
+        self._events: List[Tuple[str, float, float]] = []
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        node = self._stack[-1].get_child(name)
+        self._stack.append(node)
+        start = time.perf_counter()
+        try:
+            yield node
+        finally:
+            duration = time.perf_counter() - start
+            node.elapsed += duration
+            node.calls += 1
+            self._stack.pop()
+            self._events.append((name, start - self._start, duration))
+
+    def count(self, name: str, value: int = 1):
+        counters = self._stack[-1].counters
+        counters[name] = counters.get(name, 0) + value
+
+    def merge(self, root: TimerNode):
+        """add the profile of another process under the current timer"""
+        node = self._stack[-1]
+        for name, value in root.counters.items():
+            node.counters[name] = node.counters.get(name, 0) + value
+        for name, child in root.children.items():
+            node.get_child(name).merge(child)
+
+    def __update_total(self):
+        self.root.elapsed = sum([c.elapsed for c in
+                                 self.root.children.values()])
+
+    def to_json(self) -> str:
+        self.__update_total()
+        return json.dumps(self.root.to_dict(), indent=2)
+
+    def to_chrome_trace(self) -> str:
+        """trace in the chrome trace event format, which can be loaded in
+        chrome://tracing"""
+        pid = os.getpid()
+        # timestamps are in microseconds
+        events = [{"name": name, "ph": "X", "ts": start * 1e6,
+                   "dur": duration * 1e6, "pid": pid, "tid": 0}
+                  for name, start, duration in self._events]
+        return json.dumps({"traceEvents": events})
+
+    def __repr__(self):
+        self.__update_total()
+        lines = []
+
+        def __visit(node: TimerNode, level: int):
+            counters = " ".join([f"{k}={v}" for k, v in
+                                 sorted(node.counters.items())])
+            lines.append(f"{'  ' * level}{node.name}: "
+                         f"{node.elapsed * 1000:.2f}ms ({node.calls} calls) "
+                         f"{counters}".rstrip())
+            for child in node.children.values():
+                __visit(child, level + 1)
+        __visit(self.root, 0)
+        return "\n".join(lines)
+
+
+# None when the instrumentation is disabled
+_profiler: Union[Profiler, None] = None
+
+
+def enable() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> Union[Profiler, None]:
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    return profiler
+
+
+def get_profiler() -> Union[Profiler, None]:
+    return _profiler
+
+
+@contextlib.contextmanager
+def profile():
+    profiler = enable()
+    try:
+        yield profiler
+    finally:
+        disable()
+
+
+def timer(name: str):
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.timer(name)
+
+
+def timed(name: str):
+    """decorator that times every call of the function"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: int = 1):
+    """counters in memoized functions only count the cache misses, i.e. the
+    work that is actually done"""
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+
+class _ProfiledCall:
+    # profiles a call in a worker process and sends the profile back
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        profiler = enable()
+        try:
+            result = self.func(*args)
+        finally:
+            disable()
+        return result, profiler.root
+
+
+def pool_map(pool, func, *iterables) -> List:
+    """pool.map that merges the profiles of the workers into the current
+    timer when the instrumentation is enabled"""
+    if _profiler is None:
+        return list(pool.map(func, *iterables))
+    results = []
+    for result, root in pool.map(_ProfiledCall(func), *iterables):
+        _profiler.merge(root)
+        results.append(result)
+    return results
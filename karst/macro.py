@@ -32,8 +32,9 @@ class SRAMMacro:
         for idx in range(self.num_en_ports):
             results[f"data_out{idx}"] = self.port_size
         if self.partial_write:
+            # bit mask of the word
             for idx in range(self.num_en_ports):
-                results[f"wenb{idx}"] = 1
+                results[f"wenb{idx}"] = self.port_size
         # notice that cen signal will be generated from wen and ren
         # when lowering to verilog
         return results
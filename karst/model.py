@@ -2,9 +2,13 @@ import inspect
 from karst.stmt import *
 from typing import Callable, Dict
 from karst.pyast import *
-import astor
+from karst.util import LazyModule
+from karst.instrument import timed, timer
 import textwrap
 
+# astor is only needed when a memory is defined
+astor = LazyModule("astor")
+
 
 class Memory:
     def __init__(self, size: int, parent):
@@ -126,6 +130,10 @@ class MemoryModel:
         # config variables used to generate hardware
         self._loop_vars = set()
         self.model_name = ""
+        # values the variables and output ports are declared with, and the
+        # actions marked as async reset
+        self._init_values: Dict[str, int] = {}
+        self._reset_actions: List[str] = []
 
         self._initialized = True
 
@@ -147,6 +155,7 @@ class MemoryModel:
             return self._variables[name]
         var = Variable(name, bit_width, self, value)
         self._variables[var.name] = var
+        self._init_values[var.name] = value
         return var
 
     def define_port_in(self, name: str, bit_width: int) -> Port:
@@ -163,6 +172,7 @@ class MemoryModel:
         port = Port(name, bit_width, PortType.Out, self)
         port.value = value
         self._ports[name] = port
+        self._init_values[name] = value
         return port
 
     def define_const(self, name: str, value: Union[int, Variable]):
@@ -279,6 +289,8 @@ class MemoryModel:
         def __call__(self, f):
             self.name = f.__name__
             assert self.name != "" and self.name not in self.model._actions
+            if getattr(f, "async_reset", False):
+                self.model._reset_actions.append(self.name)
             en_port_name = self.en_port_name if self.en_port_name \
                 else f"EN_{self.name}"
             rdy_port_name = self.rdy_port_name if self.rdy_port_name else \
@@ -320,11 +332,38 @@ class MemoryModel:
     def get_action_names(self):
         return list(self._actions.keys())
 
+    def get_reset_actions(self) -> List[str]:
+        return self._reset_actions[:]
+
+    def get_reset_values(self) -> Dict[str, int]:
+        """values of the variables and output ports after an async reset,
+        i.e. the reset actions applied to the initial values. the current
+        state of the model is left untouched"""
+        statements = self.produce_statements()
+        values = list(self._variables.values()) + \
+            [port for port in self._ports.values() if isinstance(port, Port)]
+        saved = [(var, var.value) for var in values]
+        saved_mem = [mem._data[:] for mem in self._mem]
+        for var in values:
+            var.value = self._init_values.get(var.name, 0)
+        for action_name in self._reset_actions:
+            for stmt in statements[action_name] + self._global_stmts:
+                stmt.eval()
+        result = {var.name: var.eval() & ((1 << var.bit_width) - 1)
+                  for var in values if not isinstance(var, Port) or
+                  var.port_type == PortType.Out}
+        for var, value in saved:
+            var.value = value
+        for mem, data in zip(self._mem, saved_mem):
+            mem._data = data
+        return result
+
     def produce_statements(self):
         for name, action in self._actions.items():
             if name not in self._stmts:
                 # generate expressions
-                action()
+                with timer("produce_statements"):
+                    action()
         return self._stmts
 
     def __eval_stmts(self, action_name: str):
@@ -378,6 +417,7 @@ class MemoryModel:
         def wrapper(*args, **kwargs):
             func(*args, **kwargs)
         wrapper.__name__ = func.__name__
+        wrapper.async_reset = True
         return wrapper
 
     def get_loop_vars(self):
@@ -405,7 +445,10 @@ class MemoryModel:
 
 
 # decorator to wrap around the define function. this is need to allow
-# ast rewrite that respects to the scope
+# ast rewrite that respects to the scope. the rewrite is timed as
+# define_memory and the calls of the rewritten function, which define the
+# model, as define_memory.body
+@timed("define_memory")
 def define_memory(func: Callable[["MemoryModel"], None]):
     func_src = inspect.getsource(func)
     func_tree = ast.parse(textwrap.dedent(func_src))
@@ -468,4 +511,4 @@ def define_memory(func: Callable[["MemoryModel"], None]):
     code_obj = compile(new_src, "<ast>", "exec")
     exec(code_obj, globals(), locals())
     namespace = locals()
-    return namespace[func_name]
+    return timed("define_memory.body")(namespace[func_name])
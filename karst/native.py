@@ -0,0 +1,326 @@
+from karst.model import MemoryModel, Memory
+from karst.stmt import If
+from karst.values import AssignStatement, Expression, Value, Variable, \
+    Port, PortType
+from karst.cpp import CppCodeGen
+from karst.partition import BankMapping
+from karst.codegen import CodeWriter
+from karst.compiler import CompileService, CompileJob
+from karst.instrument import timed
+from karst.util import LazyModule
+from typing import Dict, List, TextIO, Union
+import array
+import ctypes
+import operator
+
+# numpy is only needed for the numpy buffers
+np = LazyModule("numpy")
+
+
+class NativeCodeGen(CppCodeGen):
+    """C++ model plus a C ABI wrapper. a step sets the input ports, fires
+    the actions whose EN_ and RDY_ ports are 1 in the port order, and then
+    reads the output ports, same as the python model. the ports are passed
+    as rows of uint32_t. RDY_ signals the model never assigns are always
+    high.
+
+    the python model computes with unbounded signed integers, e.g.
+    write_addr - read_addr goes negative once the addresses wrap, so the
+    state is kept in int64_t and % follows the python sign rule. memory
+    addresses are checked. an access out of range goes to a spare word
+    instead, and the first bad address of the step is kept for
+    karst_error"""
+
+    MODEL_TYPE = "karst_model"
+    VALUE_TYPE = "int64_t"
+    MOD_FUNC = "karst_mod"
+    INDEX_FUNC = "karst_index"
+
+    def _code_gen_var(self, var: Variable,
+                      in_func_signature: bool = False) -> str:
+        if not in_func_signature:
+            return var.name
+        return f"{self.VALUE_TYPE} {var.name}"
+
+    def _code_gen_expr(self, expr: Union[Expression, Value, int]) -> str:
+        if isinstance(expr, Expression) and expr.op == operator.mod:
+            left = self._code_gen_expr(expr.left)
+            right = self._code_gen_expr(expr.right)
+            return f"{self.MOD_FUNC}({left}, {right})"
+        return super()._code_gen_expr(expr)
+
+    def _code_gen_memory(self, w: CodeWriter, t: str):
+        size = self._model.memory_size.eval()
+        # one spare word to absorb the accesses out of range
+        if self._mapping is not None:
+            assert self._mapping.size == size
+            num_banks = self._mapping.num_banks
+            bank_size = self._mapping.bank_size
+            w.line(f"{t} {self.MEMORY_NAME}[{num_banks}][{bank_size + 1}];")
+        elif self._model._num_memory > 1:
+            num_memory = self._model._num_memory
+            mem_size = size // num_memory
+            w.line(f"{t} {self.MEMORY_NAME}[{num_memory}][{mem_size + 1}];")
+        else:
+            w.line(f"{t} {self.MEMORY_NAME}[{size + 1}];")
+        # value-initialized along with the rest of the state
+        w.line("bool karst_error;")
+        w.line(f"{t} karst_error_addr;")
+        w.line()
+        w.line(f"{t} {self.INDEX_FUNC}({t} addr, {t} size, {t} index, "
+               f"{t} spare) {{")
+        with w.indent():
+            w.line("if (addr >= 0 && addr < size) return index;")
+            w.line("if (!karst_error) {")
+            with w.indent():
+                w.line("karst_error = true;")
+                w.line("karst_error_addr = addr;")
+            w.line("}")
+            w.line("return spare;")
+        w.line("}")
+
+    def _code_gen_mem_access(self, mem_access: Memory.MemoryAccess) -> str:
+        addr = self._code_gen_expr(mem_access.var)
+        func = self.INDEX_FUNC
+        if self._mapping is not None:
+            bank = self._code_gen_expr(
+                self._mapping.get_bank_expr(mem_access.var))
+            offset = self._code_gen_expr(
+                self._mapping.get_offset_expr(mem_access.var))
+            spare = self._mapping.bank_size
+            size = self._mapping.size
+            return f"{self.MEMORY_NAME}[{func}({addr}, {size}, {bank}, 0)]" \
+                   f"[{func}({addr}, {size}, {offset}, {spare})]"
+        size = self._model.memory_size.eval()
+        num_memory = self._model._num_memory
+        if num_memory > 1:
+            # each memory holds its share of the words
+            index = self._code_gen_mem_index(mem_access)
+            size = size // num_memory
+            return f"{self.MEMORY_NAME}" \
+                   f"[{func}({index}, {num_memory}, {index}, 0)]" \
+                   f"[{func}({addr}, {size}, {addr}, {size})]"
+        return f"{self.MEMORY_NAME}[{func}({addr}, {size}, {addr}, {size})]"
+
+    def get_inputs(self) -> List[str]:
+        live = self._get_statements().live
+        result = []
+        for port in self._model.get_ports().values():
+            if isinstance(port, Port) and port.port_type == PortType.In and \
+                    port.name not in result and port.name in live:
+                result.append(port.name)
+        return result
+
+    def get_outputs(self) -> List[str]:
+        live = self._get_statements().live
+        result = []
+        for port in self._model.get_ports().values():
+            if isinstance(port, Port) and port.port_type == PortType.In:
+                continue
+            if port.name not in result and port.name in live:
+                result.append(port.name)
+        return result
+
+    def __get_assigned(self):
+        result = set()
+        stmts = self._model.get_global_stmts()[:]
+        for action_stmts in self._model.produce_statements().values():
+            stmts += action_stmts
+        while stmts:
+            stmt = stmts.pop()
+            if isinstance(stmt, If):
+                stmts += stmt.expressions + stmt.else_expressions
+            elif isinstance(stmt, AssignStatement) and \
+                    isinstance(stmt.left, Variable):
+                result.add(stmt.left.name)
+        return result
+
+    @timed("code_gen")
+    def code_gen_to_stream(self, sink: TextIO):
+        w = self._get_writer(sink)
+        w.line("#include <cstdint>")
+        w.line()
+        t = self.VALUE_TYPE
+        w.line(f"static inline {t} {self.MOD_FUNC}({t} a, {t} b) {{")
+        with w.indent():
+            w.line(f"{t} r = a % b;")
+            w.line("return (r != 0 && ((r < 0) != (b < 0))) ? r + b : r;")
+        w.line("}")
+        w.line()
+        super().code_gen_to_stream(sink)
+        w.line()
+        w.line()
+        w.line(f"typedef {self._model.model_name}<{self.VALUE_TYPE}> "
+               f"{self.MODEL_TYPE};")
+        w.line()
+        w.line('extern "C" {')
+        w.line()
+        self._code_gen_abi(w)
+        w.line('}')
+
+    def _code_gen_abi(self, w: CodeWriter):
+        t = self.MODEL_TYPE
+        inputs = self.get_inputs()
+        outputs = self.get_outputs()
+        w.line(f"uint32_t karst_num_inputs() {{ return {len(inputs)}; }}")
+        w.line(f"uint32_t karst_num_outputs() {{ return {len(outputs)}; }}")
+        w.line()
+        # value-initialized so that the state starts at 0
+        w.line("void *karst_create() {")
+        with w.indent():
+            w.line(f"{t} *model = new {t}();")
+            assigned = self.__get_assigned()
+            for action_name in self._model.get_action_names():
+                rdy = self._model[f"RDY_{action_name}"].name
+                if rdy not in assigned:
+                    w.line(f"model->{rdy} = 1;")
+            w.line("return model;")
+        w.line("}")
+        w.line()
+        w.line("void karst_destroy(void *model) {")
+        with w.indent():
+            w.line(f"delete static_cast<{t} *>(model);")
+        w.line("}")
+        w.line()
+        w.line("void karst_step(void *model_, const uint32_t *inputs, "
+               "uint32_t *outputs) {")
+        with w.indent():
+            w.line(f"{t} *model = static_cast<{t} *>(model_);")
+            w.line("model->karst_error = false;")
+            for idx, name in enumerate(inputs):
+                w.line(f"model->{name} = inputs[{idx}];")
+            for name, port in self._model.get_ports().items():
+                if not name.startswith("EN_"):
+                    continue
+                action_name = name[3:]
+                rdy = self._model[f"RDY_{action_name}"].name
+                w.line(f"if (model->{port.name} == 1 && model->{rdy} == 1) "
+                       f"model->{action_name}();")
+            for idx, name in enumerate(outputs):
+                w.line(f"outputs[{idx}] = "
+                       f"static_cast<uint32_t>(model->{name});")
+        w.line("}")
+        w.line()
+        # stops after the first cycle with a bad address and returns the
+        # number of cycles run
+        w.line("uint64_t karst_run_batch(void *model, const uint32_t *inputs, "
+               "uint32_t *outputs, uint64_t n) {")
+        with w.indent():
+            w.line("for (uint64_t i = 0; i < n; i++) {")
+            with w.indent():
+                w.line(f"karst_step(model, inputs + i * {len(inputs)}, "
+                       f"outputs + i * {len(outputs)});")
+                w.line(f"if (static_cast<{t} *>(model)->karst_error) "
+                       f"return i + 1;")
+            w.line("}")
+            w.line("return n;")
+        w.line("}")
+        w.line()
+        w.line("int karst_error(void *model) {")
+        with w.indent():
+            w.line(f"return static_cast<{t} *>(model)->karst_error;")
+        w.line("}")
+        w.line()
+        w.line("int64_t karst_error_addr(void *model) {")
+        with w.indent():
+            w.line(f"return static_cast<{t} *>(model)->karst_error_addr;")
+        w.line("}")
+        w.line()
+
+
+class NativeSimulator:
+    """runs the model compiled to native code. every step is a cycle that
+    takes one value per input port and produces one value per output port,
+    in the order of `inputs` and `outputs`. a memory address out of range
+    raises an IndexError like the python model does"""
+
+    FLAGS = ("-O2", "-std=c++11", "-shared", "-fPIC")
+
+    def __init__(self, model: MemoryModel, mapping: BankMapping = None,
+                 service: CompileService = None, optimize: bool = True):
+        codegen = NativeCodeGen(model, mapping, optimize)
+        self.inputs = codegen.get_inputs()
+        self.outputs = codegen.get_outputs()
+        if service is None:
+            service = CompileService()
+        # the library is reused as long as the code doesn't change
+        self.library = service.compile(CompileJob(codegen.code_gen(),
+                                                  self.FLAGS, suffix=".so"))
+
+        lib = ctypes.CDLL(self.library)
+        buffer = ctypes.POINTER(ctypes.c_uint32)
+        lib.karst_create.restype = ctypes.c_void_p
+        lib.karst_destroy.argtypes = [ctypes.c_void_p]
+        lib.karst_step.argtypes = [ctypes.c_void_p, buffer, buffer]
+        lib.karst_run_batch.argtypes = [ctypes.c_void_p, buffer, buffer,
+                                        ctypes.c_uint64]
+        lib.karst_run_batch.restype = ctypes.c_uint64
+        lib.karst_error.argtypes = [ctypes.c_void_p]
+        lib.karst_error_addr.argtypes = [ctypes.c_void_p]
+        lib.karst_error_addr.restype = ctypes.c_int64
+        assert lib.karst_num_inputs() == len(self.inputs)
+        assert lib.karst_num_outputs() == len(self.outputs)
+        self._lib = lib
+        self._model = lib.karst_create()
+
+    def __del__(self):
+        if getattr(self, "_model", None):
+            self._lib.karst_destroy(self._model)
+            self._model = None
+
+    def reset(self):
+        """start over from the zero state"""
+        self._lib.karst_destroy(self._model)
+        self._model = self._lib.karst_create()
+
+    def step(self, inputs: Dict[str, int]) -> Dict[str, int]:
+        """one cycle. missing inputs are 0"""
+        values = (ctypes.c_uint32 * len(self.inputs))(
+            *[inputs.get(name, 0) for name in self.inputs])
+        outputs = (ctypes.c_uint32 * len(self.outputs))()
+        self._lib.karst_step(self._model, values, outputs)
+        self.__check_error()
+        return dict(zip(self.outputs, outputs))
+
+    def __check_error(self, row: int = None):
+        if self._lib.karst_error(self._model):
+            addr = self._lib.karst_error_addr(self._model)
+            where = "" if row is None else f" at row {row}"
+            raise IndexError(f"memory address {addr} out of range{where}")
+
+    def run_batch(self, inputs, outputs=None):
+        """run one cycle per row of `inputs`, a C contiguous uint32 buffer
+        with len(self.inputs) columns, e.g. a numpy array or an
+        array.array("I"). the outputs are written to `outputs` if given,
+        otherwise to a new buffer of the same kind"""
+        num_inputs = len(self.inputs)
+        num_outputs = len(self.outputs)
+        buffer = ctypes.POINTER(ctypes.c_uint32)
+        if type(inputs).__module__ == "numpy":
+            inputs = np.ascontiguousarray(inputs, dtype=np.uint32)
+            size = inputs.size
+            n = size // num_inputs
+            assert inputs.ndim == 1 or inputs.shape[-1] == num_inputs
+            if outputs is None:
+                outputs = np.empty((n, num_outputs), dtype=np.uint32)
+            assert outputs.dtype == np.uint32 and \
+                outputs.flags["C_CONTIGUOUS"]
+            assert outputs.ndim == 1 or outputs.shape[-1] == num_outputs
+            assert outputs.size >= n * num_outputs
+            input_ptr = inputs.ctypes.data_as(buffer)
+            output_ptr = outputs.ctypes.data_as(buffer)
+        else:
+            view = memoryview(inputs).cast("B").cast("I")
+            size = len(view)
+            n = size // num_inputs
+            if outputs is None:
+                outputs = array.array("I", bytes(4 * n * num_outputs))
+            assert memoryview(outputs).nbytes >= 4 * n * num_outputs
+            input_ptr = (ctypes.c_uint32 * size).from_buffer_copy(view)
+            output_ptr = (ctypes.c_uint32 * (n * num_outputs)).from_buffer(
+                outputs)
+        assert n * num_inputs == size
+        cycles = self._lib.karst_run_batch(self._model, input_ptr,
+                                           output_ptr, n)
+        self.__check_error(cycles - 1)
+        return outputs
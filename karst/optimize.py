@@ -0,0 +1,317 @@
+from karst.stmt import *
+from karst.model import MemoryModel, Memory
+from typing import Dict, List, NamedTuple, Set, Tuple
+import functools
+import itertools
+
+
+class Temporary(Variable):
+    """local holding a hoisted subexpression. its type is inferred by the
+    code generator"""
+
+    def __init__(self, name: str, parent):
+        super().__init__(name, 0, parent)
+
+
+class _Block:
+    # parent of the rewritten statements
+    def __init__(self):
+        self.context = []
+
+
+class OptimizedStatements(NamedTuple):
+    actions: Dict[str, List[Statement]]
+    global_stmts: List[Statement]
+    # names of the variables and ports that are still used
+    live: Set[str]
+
+
+def _get_key(expr: Union[Value, int]):
+    # structural key of a pure expression, None if it reads the memory,
+    # whose content can change between two reads
+    if isinstance(expr, Memory.MemoryAccess):
+        return None
+    elif isinstance(expr, Const):
+        return expr.value
+    elif isinstance(expr, Variable):
+        return expr.name
+    elif isinstance(expr, int):
+        return expr
+    assert isinstance(expr, Expression)
+    left = _get_key(expr.left)
+    right = _get_key(expr.right)
+    if left is None or right is None:
+        return None
+    return expr.op, left, right
+
+
+@functools.lru_cache(maxsize=None)
+def _get_key_names(key) -> Tuple[str, ...]:
+    if isinstance(key, str):
+        return key,
+    elif isinstance(key, tuple):
+        return tuple(sorted(set(_get_key_names(key[1]) +
+                                _get_key_names(key[2]))))
+    return ()
+
+
+def _get_assigned(stmts: List[Statement]) -> Set[str]:
+    result = set()
+    for stmt in stmts:
+        if isinstance(stmt, If):
+            result |= _get_assigned(stmt.expressions + stmt.else_expressions)
+        elif isinstance(stmt, AssignStatement) and \
+                isinstance(stmt.left, Variable):
+            result.add(stmt.left.name)
+    return result
+
+
+def _visit_values(value: Union[Value, int], names: Set[str]):
+    if isinstance(value, Memory.MemoryBankAccess):
+        _visit_values(value.var, names)
+        _visit_values(value.index, names)
+    elif isinstance(value, Memory.MemoryAccess):
+        _visit_values(value.var, names)
+    elif isinstance(value, Expression):
+        _visit_values(value.left, names)
+        _visit_values(value.right, names)
+    elif isinstance(value, Variable):
+        names.add(value.name)
+
+
+def get_read_names(stmts: List[Statement]) -> Set[str]:
+    """names of the variables the statements read"""
+    result = set()
+    for stmt in stmts:
+        if isinstance(stmt, If):
+            _visit_values(stmt.predicate, result)
+            result |= get_read_names(stmt.expressions + stmt.else_expressions)
+        elif isinstance(stmt, ReturnStatement):
+            for value in stmt.values:
+                _visit_values(value, result)
+        else:
+            assert isinstance(stmt, AssignStatement)
+            _visit_values(stmt.right, result)
+            if isinstance(stmt.left, Memory.MemoryAccess):
+                _visit_values(stmt.left, result)
+    return result
+
+
+def remove_dead_assignments(stmts: List[Statement],
+                            dead: Set[str]) -> List[Statement]:
+    """drop the assignments to the dead variables, and the ifs left empty"""
+    result = []
+    for stmt in stmts:
+        if isinstance(stmt, If):
+            expressions = remove_dead_assignments(stmt.expressions, dead)
+            else_expressions = remove_dead_assignments(stmt.else_expressions,
+                                                       dead)
+            if not expressions and not else_expressions:
+                continue
+            if len(expressions) != len(stmt.expressions) or \
+                    len(else_expressions) != len(stmt.else_expressions):
+                stmt = _copy_if(stmt.predicate, expressions,
+                                else_expressions)
+        elif isinstance(stmt, AssignStatement) and \
+                isinstance(stmt.left, Variable) and stmt.left.name in dead:
+            continue
+        result.append(stmt)
+    return result
+
+
+def _copy_if(predicate: Expression, expressions: List[Statement],
+             else_expressions: List[Statement]) -> If:
+    result = If(_Block())
+    result.predicate = predicate
+    result.expressions = expressions
+    result.else_expressions = else_expressions
+    return result
+
+
+class _CSE:
+    """hoists the subexpressions used more than once in a block into
+    temporaries. an expression is identified by its structure and the
+    versions of the variables it reads, which change at every assignment,
+    so a temporary is only reused while its value is the same"""
+
+    PREFIX = "cse_"
+
+    def __init__(self, names: Set[str], constants: Set[str]):
+        # names that are taken already
+        self._names = names
+        # configurables, which are folded by the compiler
+        self._constants = constants
+        self._counter = itertools.count()
+        self._version = itertools.count(1)
+        self._block = _Block()
+
+    def __get_vkey(self, key, versions: Dict[str, int]):
+        names = _get_key_names(key)
+        if self._constants.issuperset(names):
+            return None
+        return key, tuple([versions.get(name, 0) for name in names])
+
+    def __new_temp(self) -> Temporary:
+        while True:
+            name = f"{self.PREFIX}{next(self._counter)}"
+            if name not in self._names:
+                return Temporary(name, self._block)
+
+    def __bump(self, names: Set[str], versions: Dict[str, int]):
+        for name in names:
+            versions[name] = next(self._version)
+
+    def __count(self, value: Union[Value, int], versions: Dict[str, int],
+                counts: Dict, nested: bool = False):
+        # uses in the nested blocks only count for the expressions the
+        # block computes first, whose temporaries are visible in there
+        if isinstance(value, Memory.MemoryBankAccess):
+            self.__count(value.var, versions, counts, nested)
+            self.__count(value.index, versions, counts, nested)
+        elif isinstance(value, Memory.MemoryAccess):
+            self.__count(value.var, versions, counts, nested)
+        elif isinstance(value, Expression):
+            key = _get_key(value)
+            vkey = None if key is None else self.__get_vkey(key, versions)
+            if vkey is not None and (not nested or vkey in counts):
+                counts[vkey] = counts.get(vkey, 0) + 1
+                if counts[vkey] > 1:
+                    # the subexpressions are shared with the first one
+                    return
+            self.__count(value.left, versions, counts, nested)
+            self.__count(value.right, versions, counts, nested)
+
+    def __count_stmts(self, stmts: List[Statement], versions: Dict[str, int],
+                      counts: Dict, nested: bool = False):
+        # returns the versions before every statement
+        result = []
+        for stmt in stmts:
+            result.append(versions.copy())
+            if isinstance(stmt, If):
+                self.__count(stmt.predicate, versions, counts, nested)
+                for block in (stmt.expressions, stmt.else_expressions):
+                    self.__count_stmts(block, versions.copy(), counts, True)
+                self.__bump(_get_assigned([stmt]), versions)
+            elif isinstance(stmt, AssignStatement):
+                self.__count(stmt.right, versions, counts, nested)
+                self.__count(stmt.left, versions, counts, nested)
+                if isinstance(stmt.left, Variable):
+                    self.__bump({stmt.left.name}, versions)
+        return result
+
+    def __rewrite(self, value: Union[Value, int], versions: Dict[str, int],
+                  counts: Dict, temps: Dict, defs: List[Statement]):
+        if isinstance(value, Memory.MemoryBankAccess):
+            var = self.__rewrite(value.var, versions, counts, temps, defs)
+            index = self.__rewrite(value.index, versions, counts, temps, defs)
+            if var is value.var and index is value.index:
+                return value
+            return Memory.MemoryBankAccess(value._mems, index, var,
+                                           value.parent)
+        elif isinstance(value, Memory.MemoryAccess):
+            var = self.__rewrite(value.var, versions, counts, temps, defs)
+            if var is value.var:
+                return value
+            return Memory.MemoryAccess(value.mem, var, value.parent)
+        elif not isinstance(value, Expression):
+            return value
+        key = _get_key(value)
+        vkey = None if key is None else self.__get_vkey(key, versions)
+        if vkey is not None:
+            if vkey in temps:
+                return temps[vkey]
+        left = self.__rewrite(value.left, versions, counts, temps, defs)
+        right = self.__rewrite(value.right, versions, counts, temps, defs)
+        if left is not value.left or right is not value.right:
+            value = Expression(left, right, value.op)
+        if vkey is not None and counts.get(vkey, 0) > 1:
+            temp = self.__new_temp()
+            defs.append(AssignStatement(temp, value, self._block))
+            temps[vkey] = temp
+            return temp
+        return value
+
+    def run(self, stmts: List[Statement], versions: Dict[str, int] = None,
+            temps: Dict = None) -> List[Statement]:
+        versions = {} if versions is None else versions.copy()
+        # temporaries defined in the outer blocks
+        temps = {} if temps is None else temps.copy()
+
+        counts = {}
+        # versions before every statement, shared by both passes
+        block_versions = self.__count_stmts(stmts, versions, counts)
+
+        result = []
+        for stmt, versions in zip(stmts, block_versions):
+            defs = []
+            if isinstance(stmt, If):
+                predicate = self.__rewrite(stmt.predicate, versions, counts,
+                                           temps, defs)
+                expressions = self.run(stmt.expressions, versions, temps)
+                else_expressions = self.run(stmt.else_expressions, versions,
+                                            temps)
+                stmt = _copy_if(predicate, expressions, else_expressions)
+            elif isinstance(stmt, AssignStatement):
+                right = self.__rewrite(stmt.right, versions, counts, temps,
+                                       defs)
+                left = self.__rewrite(stmt.left, versions, counts, temps,
+                                      defs)
+                if left is not stmt.left or right is not stmt.right:
+                    stmt = AssignStatement(left, right, self._block)
+            result += defs
+            result.append(stmt)
+        return result
+
+
+def eliminate_common_subexpressions(stmts: List[Statement], names: Set[str],
+                                    constants: Set[str] = None
+                                    ) -> List[Statement]:
+    """return the statements with the shared subexpressions hoisted into
+    temporaries, which don't collide with `names`. expressions of
+    `constants` only are left alone"""
+    constants = set() if constants is None else constants
+    return _CSE(names, constants).run(stmts)
+
+
+def get_handshake_names(model: MemoryModel) -> Set[str]:
+    result = set()
+    for action_name in model.get_action_names():
+        result.add(model[f"EN_{action_name}"].name)
+        result.add(model[f"RDY_{action_name}"].name)
+    return result
+
+
+def optimize_statements(model: MemoryModel) -> OptimizedStatements:
+    """remove the assignments to the variables nobody reads and hoist the
+    common subexpressions of every action. ports are never removed if they
+    are used, neither are the EN_ and RDY_ handshakes"""
+    actions = dict(model.produce_statements())
+    global_stmts = model.get_global_stmts()
+    keep = get_handshake_names(model)
+    keep |= {port.name for port in model.get_ports().values()}
+    variables = {var.name for var in model.get_variables().values()}
+    # removing an assignment can make more variables dead
+    while True:
+        stmts = global_stmts[:]
+        for action_stmts in actions.values():
+            stmts += action_stmts
+        dead = variables - get_read_names(stmts) - keep
+        dead &= _get_assigned(stmts)
+        if not dead:
+            break
+        variables -= dead
+        actions = {name: remove_dead_assignments(action_stmts, dead)
+                   for name, action_stmts in actions.items()}
+        global_stmts = remove_dead_assignments(global_stmts, dead)
+
+    live = get_read_names(stmts) | _get_assigned(stmts) | \
+        get_handshake_names(model)
+    constants = set(model.get_config_vars().keys())
+    names = set(model.get_ports().keys()) | set(model.get_variables().keys())
+    names |= {var.name for var in model.get_ports().values()} | constants
+    actions = {name: eliminate_common_subexpressions(action_stmts, names,
+                                                     constants)
+               for name, action_stmts in actions.items()}
+    global_stmts = eliminate_common_subexpressions(global_stmts, names,
+                                                   constants)
+    return OptimizedStatements(actions, global_stmts, live)
@@ -0,0 +1,172 @@
+from .model import MemoryModel
+from .values import Value, Const
+from .backend import get_memory_access, get_affine_form, remove_mod_op
+from typing import Dict, List, NamedTuple, Tuple, Union
+import enum
+import math
+
+
+@enum.unique
+class PartitionScheme(enum.Enum):
+    Block = enum.auto()
+    Cyclic = enum.auto()
+    Hybrid = enum.auto()
+
+
+def _log2(value: int) -> int:
+    assert value != 0 and ((value & (value - 1)) == 0), \
+        f"{value} has to be 2's power"
+    return value.bit_length() - 1
+
+
+class BankMapping(NamedTuple):
+    """addresses are dealt to the banks round-robin, in blocks of
+    `block_size` consecutive elements. a block size of 1 is a cyclic
+    partition, a block size of `bank_size` a block partition"""
+    num_banks: int
+    bank_size: int
+    block_size: int
+
+    @property
+    def size(self) -> int:
+        return self.num_banks * self.bank_size
+
+    @property
+    def scheme(self) -> PartitionScheme:
+        if self.block_size == self.bank_size:
+            return PartitionScheme.Block
+        elif self.block_size == 1:
+            return PartitionScheme.Cyclic
+        return PartitionScheme.Hybrid
+
+    def get_bank(self, addr: int) -> int:
+        return (addr // self.block_size) % self.num_banks
+
+    def get_offset(self, addr: int) -> int:
+        return addr // (self.block_size * self.num_banks) * self.block_size \
+            + addr % self.block_size
+
+    def get_address(self, bank: int, offset: int) -> int:
+        block, index = divmod(offset, self.block_size)
+        return (block * self.num_banks + bank) * self.block_size + index
+
+    def is_disjoint(self, distance: int) -> bool:
+        """whether two addresses `distance` apart never share a bank. the
+        mapping repeats every num_banks blocks, and within a block the
+        distance only spans two consecutive blocks"""
+        distance %= self.block_size * self.num_banks
+        low = distance // self.block_size
+        high = (distance + self.block_size - 1) // self.block_size
+        return low % self.num_banks != 0 and high % self.num_banks != 0
+
+    def get_bank_expr(self, addr: Value) -> Value:
+        """bank selection in hardware. all the sizes are 2's power so that
+        it's only shifts and masks"""
+        if self.num_banks == 1:
+            return Const(0)
+        shift = _log2(self.block_size)
+        bank = addr >> shift if shift else addr
+        return bank & (self.num_banks - 1)
+
+    def get_offset_expr(self, addr: Value) -> Value:
+        if self.num_banks == 1:
+            return addr
+        shift = _log2(self.block_size)
+        if self.scheme == PartitionScheme.Block:
+            return addr & (self.bank_size - 1)
+        block = addr >> (shift + _log2(self.num_banks))
+        if self.scheme == PartitionScheme.Cyclic:
+            return block
+        return (block << shift) | (addr & (self.block_size - 1))
+
+
+def get_parallel_accesses(model: MemoryModel) -> Dict[str, List[List[int]]]:
+    """memory accesses issued by the same action, grouped by their base
+    address. accesses in a group only differ by a constant offset, which is
+    returned. the distance between groups is unknown, so they are assumed
+    to be independent"""
+    assert model._num_memory == 1, \
+        "memory is already partitioned into explicit banks"
+    result = {}
+    for action_name, accesses in get_memory_access(model).items():
+        groups: Dict[Tuple[Tuple[str, int], ...], List[int]] = {}
+        random_accesses = []
+        for access, _ in accesses:
+            form = get_affine_form(remove_mod_op(access.var))
+            if form is None:
+                random_accesses.append([0])
+                continue
+            coefficients, offset = form
+            base = tuple(sorted(coefficients.items()))
+            if base not in groups:
+                groups[base] = []
+            groups[base].append(offset)
+        result[action_name] = list(groups.values()) + random_accesses
+    return result
+
+
+def get_bank_conflicts(mapping: BankMapping,
+                       accesses: Dict[str, List[List[int]]]) -> float:
+    """average number of extra cycles per iteration spent on bank conflicts,
+    with each bank serving one access per cycle. every base address is
+    equally likely"""
+    block_size = mapping.block_size
+    result = 0
+    for groups in accesses.values():
+        for offsets in groups:
+            if len(offsets) == 1:
+                continue
+            # moving the base by a block only rotates the banks, so only the
+            # position of the base in a block matters. the banks change
+            # where an access crosses into the next block
+            points = sorted({0} | {-offset % block_size
+                                   for offset in offsets})
+            total = 0
+            for start, end in zip(points, points[1:] + [block_size]):
+                banks = {}
+                for offset in offsets:
+                    bank = mapping.get_bank(start + offset)
+                    banks[bank] = banks.get(bank, 0) + 1
+                total += (max(banks.values()) - 1) * (end - start)
+            result += total / block_size
+    return result
+
+
+def get_mappings(size: int, num_banks: int,
+                 scheme: PartitionScheme = None) -> List[BankMapping]:
+    """candidate mappings, block partition first and then increasingly
+    coarse interleaving"""
+    assert size % num_banks == 0, "can't divide the memory evenly"
+    bank_size = size // num_banks
+    _log2(num_banks)
+    _log2(bank_size)
+    block_sizes = [bank_size]
+    if num_banks > 1:
+        block_sizes += [1 << i for i in range(_log2(bank_size))]
+    mappings = [BankMapping(num_banks, bank_size, block_size)
+                for block_size in block_sizes]
+    if scheme is not None:
+        mappings = [m for m in mappings if m.scheme == scheme]
+    return mappings
+
+
+def select_partition(model: MemoryModel, num_banks: int = None,
+                     scheme: PartitionScheme = None) -> BankMapping:
+    """choose the bank mapping with the fewest bank conflicts. by default
+    there are as many banks as parallel accesses. ties go to the block
+    partition, which is the cheapest to decode"""
+    size = model.memory_size.eval()
+    accesses = get_parallel_accesses(model)
+    if num_banks is None:
+        num_parallel = max([len(offsets) for groups in accesses.values()
+                            for offsets in groups], default=1)
+        num_banks = min(1 << math.ceil(math.log2(num_parallel)), size)
+    result: Union[BankMapping, None] = None
+    min_conflicts = 0
+    for mapping in get_mappings(size, num_banks, scheme):
+        conflicts = get_bank_conflicts(mapping, accesses)
+        if result is None or conflicts < min_conflicts:
+            result = mapping
+            min_conflicts = conflicts
+    assert result is not None, f"no {scheme} partition with {num_banks} banks"
+    return result
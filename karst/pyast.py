@@ -1,5 +1,7 @@
 import ast
-import astor
+from karst.util import LazyModule
+
+astor = LazyModule("astor")
 
 
 class HasModelVariable(ast.NodeVisitor):
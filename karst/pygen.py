@@ -0,0 +1,223 @@
+from karst.stmt import *
+from karst.model import MemoryModel, Memory
+from karst.codegen import CodeGen, CodeWriter
+from karst.backend import get_model_fingerprint
+from karst.cache import AnalysisCache
+from karst.instrument import timed
+from typing import Dict, List, TextIO
+import hashlib
+import importlib.util
+import os
+import tempfile
+
+
+class PythonCodeGen(CodeGen):
+    """standalone python module with one class per configured model. the
+    state lives in __slots__, the configurables are folded into the code and
+    every action is a method with the same semantics as the model action.
+    the module only needs the python standard library.
+
+    the state starts at 0, same as the hardware registers"""
+
+    PY_INDENT = 4 * " "
+    MEMORY_NAME = "mem"
+
+    def __init__(self, model: MemoryModel):
+        super().__init__(model)
+        # attribute name -> variable
+        self._state: Dict[str, Variable] = {}
+
+    @classmethod
+    def _get_indent(cls, indent_num):
+        return indent_num * cls.PY_INDENT
+
+    def _code_gen_var(self, var: Variable,
+                      in_func_signature: bool = False) -> str:
+        return f"self.{var.name}"
+
+    def _code_gen_var_name(self, var: Value) -> str:
+        if isinstance(var, (Const, Configurable)):
+            return var.eval()
+        return f"self.{var.name}"
+
+    def _code_gen_mem_access(self, mem_access: Memory.MemoryAccess) -> str:
+        var = self._code_gen_expr(mem_access.var)
+        if isinstance(mem_access, Memory.MemoryBankAccess):
+            index = mem_access.index
+            index = self._code_gen_expr(index) if isinstance(index, Value) \
+                else index
+            return f"self.{self.MEMORY_NAME}[{index}][{var}]"
+        index = self._model._mem.index(mem_access.mem)
+        return f"{self.MEMORY_NAME}_{index}[{var}]"
+
+    def __collect_state(self):
+        self._state.clear()
+        for var in list(self._model.get_ports().values()) + \
+                list(self._model.get_variables().values()):
+            self._state[var.name] = var
+
+    @timed("code_gen")
+    def code_gen_to_stream(self, sink: TextIO):
+        self.__collect_state()
+        w = self._get_writer(sink)
+        model_name = self._model.model_name
+        w.line(f'"""generated by karst from {model_name}. do not edit"""')
+        w.line()
+        w.line()
+        w.line(f"class {model_name}:")
+        with w.indent():
+            slots = list(self._state.keys()) + [self.MEMORY_NAME]
+            w.line(f"__slots__ = {tuple(slots)}")
+            # port names of the model, including the aliases
+            ports = {name: port.name for name, port in
+                     self._model.get_ports().items()}
+            w.line(f"PORTS = {ports}")
+            w.line()
+            w.line("def __init__(self):")
+            with w.indent():
+                for name in self._state:
+                    w.line(f"self.{name} = 0")
+                size = self._model.memory_size.eval()
+                num_memory = self._model._num_memory
+                bank_size = size // num_memory
+                w.line(f"self.{self.MEMORY_NAME} = "
+                       f"[[0] * {bank_size} for _ in range({num_memory})]")
+            global_stmts = self._model.get_global_stmts()
+            for action_name, stmts in \
+                    self._model.produce_statements().items():
+                w.line()
+                self._code_gen_action(w, action_name, stmts + global_stmts)
+
+    def _code_gen_action(self, w: CodeWriter, action_name: str,
+                         stmts: List[Statement]):
+        # same as the action wrapper in the model: only the first top level
+        # return counts, and its values are latched if the action is not
+        # ready
+        returns = [s for s in stmts if isinstance(s, ReturnStatement)]
+        result = self.__code_gen_return(returns[0]) if returns else "None"
+        rdy = self._code_gen_var_name(self._model[f"RDY_{action_name}"])
+        w.line(f"def {action_name}(self):")
+        with w.indent():
+            w.line(f"if {rdy} != 1:")
+            with w.indent():
+                w.line(f"return {result}")
+            for index in self.__get_memories(stmts):
+                w.line(f"{self.MEMORY_NAME}_{index} = "
+                       f"self.{self.MEMORY_NAME}[{index}]")
+            has_result = False
+            for stmt in stmts:
+                if isinstance(stmt, ReturnStatement):
+                    if not has_result:
+                        w.line(f"result = {result}")
+                        has_result = True
+                else:
+                    self._code_gen_stmts(w, stmt)
+            if has_result:
+                w.line("return result")
+
+    def __code_gen_return(self, stmt: ReturnStatement) -> str:
+        values = [self._code_gen_expr(v) for v in stmt.values]
+        if len(values) == 1:
+            return values[0]
+        return f"[{', '.join(values)}]"
+
+    def __get_memories(self, stmts: List[Statement]) -> List[int]:
+        # memories accessed directly, which get a local alias
+        result = set()
+
+        def __visit(value: Union[Value, int]):
+            if isinstance(value, Memory.MemoryBankAccess):
+                __visit(value.var)
+                __visit(value.index)
+            elif isinstance(value, Memory.MemoryAccess):
+                result.add(self._model._mem.index(value.mem))
+                __visit(value.var)
+            elif isinstance(value, Expression):
+                __visit(value.left)
+                __visit(value.right)
+
+        stmts = stmts[:]
+        while stmts:
+            stmt = stmts.pop()
+            if isinstance(stmt, If):
+                __visit(stmt.predicate)
+                stmts += stmt.expressions + stmt.else_expressions
+            elif isinstance(stmt, AssignStatement):
+                __visit(stmt.left)
+                __visit(stmt.right)
+        return sorted(result)
+
+    def _code_gen_stmts(self, w: CodeWriter, stmt: Statement):
+        if isinstance(stmt, If):
+            predicate = self._code_gen_expr(stmt.predicate)
+            w.line(f"if {predicate}:")
+            with w.indent():
+                self.__code_gen_block(w, stmt.expressions)
+            if stmt.else_expressions:
+                w.line("else:")
+                with w.indent():
+                    self.__code_gen_block(w, stmt.else_expressions)
+        elif isinstance(stmt, ReturnStatement):
+            # only the top level returns are used by the model
+            pass
+        else:
+            assert isinstance(stmt, AssignStatement)
+            w.line(self._code_gen_assign(stmt, eq="="))
+
+    def __code_gen_block(self, w: CodeWriter, stmts: List[Statement]):
+        stmts = [s for s in stmts if not isinstance(s, ReturnStatement)]
+        if not stmts:
+            w.line("pass")
+        for stmt in stmts:
+            self._code_gen_stmts(w, stmt)
+
+
+def load_module(filename: str):
+    """import a generated module without adding it to sys.modules"""
+    name = os.path.splitext(os.path.basename(filename))[0]
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_module_key(model: MemoryModel) -> str:
+    """hash of everything the generated module depends on: the statements,
+    the ports and the variables with their widths, the configuration and
+    the memory sizes"""
+    ports = tuple(sorted([(name, port.name, port.bit_width,
+                           str(getattr(port, "port_type", None)))
+                          for name, port in model.get_ports().items()]))
+    variables = tuple(sorted([(name, var.name, var.bit_width)
+                              for name, var in
+                              model.get_variables().items()]))
+    config = tuple(sorted([(name, var.eval()) for name, var in
+                           model.get_config_vars().items()]))
+    memories = tuple([len(mem._data) for mem in model._mem])
+    value = (get_model_fingerprint(model), ports, variables, config,
+             memories)
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+
+def compile_model(model: MemoryModel, cache: AnalysisCache = None):
+    """return the generated class of the configured model. the module is
+    stored in the cache directory under the key of the module, so workers
+    can import it without karst"""
+    if cache is None:
+        cache = AnalysisCache()
+    fingerprint = get_module_key(model)
+    filename = os.path.join(cache.path,
+                            f"{model.model_name}_{fingerprint}.py")
+    if not os.path.isfile(filename):
+        os.makedirs(cache.path, exist_ok=True)
+        # write to a temporary file first so that concurrent runs never see
+        # a partial module
+        fd, temp_filename = tempfile.mkstemp(dir=cache.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            PythonCodeGen(model).code_gen_to_stream(f)
+        os.replace(temp_filename, filename)
+        cache.misses += 1
+    else:
+        cache.hits += 1
+    module = load_module(filename)
+    return getattr(module, model.model_name)
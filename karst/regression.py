@@ -0,0 +1,236 @@
+from .core import MemoryInstruction, MemoryMode
+from .tlm import DifferentialCore, Mismatch
+from .instrument import pool_map
+from typing import Dict, List, Tuple, Union, NamedTuple
+import concurrent.futures
+import random
+import time
+
+
+class StimulusGenerator:
+    """constrained-random stimulus for a memory mode. the configuration is
+    randomized as well, so a shard is fully described by its mode and seed"""
+
+    def __init__(self, mode: MemoryMode, seed: int, memory_size: int):
+        self.mode = mode
+        self.memory_size = memory_size
+        self._rnd = random.Random(seed)
+        # some modes can't take unlimited reads and writes without running
+        # out of the memory range
+        self._max_reads: Union[int, None] = None
+        self._max_writes: Union[int, None] = None
+        self._num_reads = 0
+        self._num_writes = 0
+        self.instr = self.__get_instr()
+
+    def __get_instr(self) -> MemoryInstruction:
+        rnd = self._rnd
+        memory_size = self.memory_size
+        if self.mode == MemoryMode.SRAM:
+            data_entries = [(rnd.randrange(memory_size),
+                             rnd.randrange(1 << 16)) for _ in range(16)]
+            return MemoryInstruction(self.mode, data_entries=data_entries)
+        elif self.mode == MemoryMode.FIFO:
+            capacity = rnd.randint(1, memory_size)
+            almost_t = rnd.randint(0, capacity // 4)
+            return MemoryInstruction(self.mode, {"capacity": capacity,
+                                                 "almost_t": almost_t})
+        elif self.mode == MemoryMode.RowBuffer:
+            depth = rnd.randint(1, memory_size - 1)
+            return MemoryInstruction(self.mode, {"depth": depth})
+        else:
+            assert self.mode == MemoryMode.DoubleBuffer
+            return self.__get_double_buffer_instr()
+
+    def __get_double_buffer_instr(self):
+        rnd = self._rnd
+        bank_size = self.memory_size // 2
+        ext_chin = rnd.randint(1, 4)
+        off_x = rnd.randint(1, 3)
+        off_y = rnd.randint(1, 3)
+        ext_chout = rnd.randint(1, 4)
+        ext_x = rnd.randint(1, 8)
+        bound_ch = ext_chin
+        bound_x = ext_x + off_x
+        values = {"threshold": rnd.randint(1, bank_size),
+                  "ext_chin": ext_chin, "off_x": off_x, "off_y": off_y,
+                  "ext_chout": ext_chout, "ext_x": ext_x,
+                  "bound_ch": bound_ch, "bound_x": bound_x, "stride": 1}
+        # the read address keeps growing with y_iter, so we compute how far
+        # y_iter can go before it runs out of the bank
+        max_x_addr = ext_chin - 1 + (ext_x + off_x - 2) * bound_ch
+        max_y_iter = (bank_size - 1 - max_x_addr) // (bound_ch * bound_x) \
+            - (off_y - 1)
+        reads_per_y = ext_chin * off_x * off_y * ext_chout * ext_x
+        self._max_reads = max(max_y_iter + 1, 0) * reads_per_y
+        self._max_writes = bank_size
+        return MemoryInstruction(self.mode, values)
+
+    def __call__(self) -> Dict[str, int]:
+        rnd = self._rnd
+        wen = rnd.randint(0, 1)
+        ren = rnd.randint(0, 1)
+        if self._max_writes is not None and self._num_writes >= \
+                self._max_writes:
+            wen = 0
+        if self._max_reads is not None and self._num_reads >= \
+                self._max_reads:
+            ren = 0
+        self._num_writes += wen
+        self._num_reads += ren
+        stimulus = {"wen": wen, "ren": ren,
+                    "data_in": rnd.randrange(1 << 16)}
+        if self.mode == MemoryMode.SRAM:
+            stimulus["addr"] = rnd.randrange(self.memory_size)
+        return stimulus
+
+
+class ShardResult(NamedTuple):
+    mode: MemoryMode
+    seed: int
+    num_cycles: int
+    mismatch: Union[Mismatch, None] = None
+    # cycle window [start, end) that reproduces the mismatch, reduced by
+    # bisecting both ends
+    window: Union[Tuple[int, int], None] = None
+    error: Union[str, None] = None
+
+    @property
+    def passed(self):
+        return self.mismatch is None and self.error is None
+
+
+def replay_shard(mode: MemoryMode, seed: int, num_cycles: int,
+                 memory_size: int, start: int = 0) -> Union[Mismatch, None]:
+    """replay a shard and return the first mismatch. cycles before `start`
+    only run on the TLM, the statement-level core is synchronized to it
+    afterwards"""
+    generator = StimulusGenerator(mode, seed, memory_size)
+    core = DifferentialCore(memory_size, period=0)
+    core.configure(generator.instr)
+    for cycle in range(num_cycles):
+        if cycle == start:
+            core.start_window(num_cycles - start)
+        core.eval(**generator())
+        if core.mismatches:
+            return core.mismatches[0]
+    return None
+
+
+def _is_same_mismatch(mismatch: Mismatch, num_cycles: int,
+                      other: Union[Mismatch, None], end: int) -> bool:
+    # a bisection step only counts if it reproduces the same failure. a
+    # divergence of the state is reported at the end of the window, so it
+    # moves with the end. anything else stays at the same cycle
+    if other is None or other.port != mismatch.port:
+        return False
+    if mismatch.cycle == num_cycles - 1:
+        return other.cycle == end - 1
+    return other.cycle == mismatch.cycle
+
+
+def run_shard(mode: MemoryMode, seed: int, num_cycles: int,
+              memory_size: int) -> ShardResult:
+    try:
+        mismatch = replay_shard(mode, seed, num_cycles, memory_size)
+    except Exception as ex:
+        return ShardResult(mode, seed, num_cycles, error=repr(ex))
+    if mismatch is None:
+        return ShardResult(mode, seed, num_cycles)
+    # bisect the end first, then the start. since the statement-level core
+    # is synchronized at the window start, any earlier divergence is not
+    # needed to reproduce it
+    low, high = 1, num_cycles
+    while low < high:
+        end = (low + high) // 2
+        if _is_same_mismatch(mismatch, num_cycles,
+                             replay_shard(mode, seed, end, memory_size),
+                             end):
+            high = end
+        else:
+            low = end + 1
+    end = high
+    # the failure at the reduced end, which the start has to reproduce
+    if end != num_cycles:
+        mismatch = replay_shard(mode, seed, end, memory_size)
+    low, high = 0, end - 1
+    while low < high:
+        start = (low + high + 1) // 2
+        if replay_shard(mode, seed, end, memory_size, start) == mismatch:
+            low = start
+        else:
+            high = start - 1
+    window = (low, end)
+    return ShardResult(mode, seed, num_cycles, mismatch, window)
+
+
+class RegressionReport:
+    def __init__(self, results: List[ShardResult], wall_time: float):
+        self.results = results
+        self.wall_time = wall_time
+
+    @property
+    def num_cycles(self):
+        return sum([r.num_cycles for r in self.results])
+
+    @property
+    def failures(self) -> List[ShardResult]:
+        return [r for r in self.results if not r.passed]
+
+    @property
+    def passed(self):
+        return len(self.failures) == 0
+
+    def __repr__(self):
+        lines = [f"{len(self.results)} shards, {self.num_cycles} cycles in "
+                 f"{self.wall_time:.2f}s"]
+        for r in self.failures:
+            if r.error is not None:
+                lines.append(f"{r.mode.name} seed={r.seed}: {r.error}")
+            else:
+                m = r.mismatch
+                lines.append(f"{r.mode.name} seed={r.seed} "
+                             f"window={r.window}: {m.port} expected "
+                             f"{m.expected}, got {m.actual}")
+        return "\n".join(lines)
+
+
+class RegressionRunner:
+    """runs constrained-random regression shards of every memory mode on a
+    process pool. each shard checks the statement-level MemoryCore against
+    the transaction-level reference cycle by cycle"""
+
+    def __init__(self, modes: List[MemoryMode] = None, num_shards: int = 4,
+                 num_cycles: int = 10000, memory_size: int = 256,
+                 seed: int = 0, num_workers: int = None):
+        self.modes = list(MemoryMode) if modes is None else modes
+        self.num_shards = num_shards
+        self.num_cycles = num_cycles
+        self.memory_size = memory_size
+        self.seed = seed
+        # None uses all the cores
+        self.num_workers = num_workers
+
+    def get_shards(self) -> List[Tuple[MemoryMode, int]]:
+        rnd = random.Random(self.seed)
+        shards = []
+        for mode in self.modes:
+            for _ in range(self.num_shards):
+                shards.append((mode, rnd.getrandbits(32)))
+        return shards
+
+    def run(self) -> RegressionReport:
+        start = time.time()
+        shards = self.get_shards()
+        modes = [mode for mode, _ in shards]
+        seeds = [seed for _, seed in shards]
+        num_shards = len(shards)
+        args = (modes, seeds, [self.num_cycles] * num_shards,
+                [self.memory_size] * num_shards)
+        if self.num_workers == 1:
+            results = list(map(run_shard, *args))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.num_workers) as pool:
+                results = pool_map(pool, run_shard, *args)
+        return RegressionReport(results, time.time() - start)
@@ -1,63 +1,155 @@
-from typing import Dict
+from typing import Dict, List, NamedTuple, Set, Tuple
 from karst.model import MemoryModel, Memory
 from karst.backend import get_updated_variables, get_state_updates, \
     get_memory_access, get_var_memory_access, get_mem_access_temporal_spacing,\
-    get_linear_spacing
-from karst.values import Expression, Variable
+    get_linear_spacing, get_loop_counters, get_definitions, \
+    get_access_pattern, AffineAccessPattern, dump_statements, \
+    load_statements, get_model_fingerprint, ExclusivityAnalysis, \
+    get_affine_form, remove_mod_op
+from karst.cache import AnalysisCache
+from karst.instrument import timed, pool_map
+from karst.values import Expression, Variable, Statement, Const, \
+    AssignStatement
+from karst.stmt import If
 from karst.macro import SRAMMacro
+from karst.partition import BankMapping
 import abc
+import concurrent.futures
 import math
 from typing import Union
 
 
+class ActionAnalysis(NamedTuple):
+    # keyed by the name of the address variable
+    update_spacing: Dict[str, Union[int, None]]
+    access_spacing: Dict[str, Union[int, None]]
+    access_patterns: Dict[str, AffineAccessPattern]
+
+
+@timed("analyze_action")
+def analyze_action(stmts: List[Statement], global_stmts: List[Statement],
+                   access) -> ActionAnalysis:
+    """compute the spacing of every address variable used by an action"""
+    updates = get_state_updates(stmts)
+    variable_update = get_updated_variables(updates)
+    access_vars = get_var_memory_access(access)
+    counters = get_loop_counters(stmts)
+    definitions = get_definitions(stmts + global_stmts)
+    temp_spacing = \
+        get_mem_access_temporal_spacing(variable_update,
+                                        list(access_vars.keys()),
+                                        counters, definitions)
+    update_spacing = {var.name: spacing for var, spacing in
+                      temp_spacing.items()}
+    access_spacing = {}
+    access_patterns = {}
+    for var, patterns in access_vars.items():
+        variables = [ac_var for ac_var, _ in patterns]
+        # compute the spacing
+        spaced, spacing = get_linear_spacing(*variables)
+        pattern = get_access_pattern(var, counters, definitions)
+        if pattern is not None:
+            access_patterns[var.name] = pattern
+            if len(variables) == 1:
+                # a single access is spaced by the loop counters
+                spacing = pattern.spacing
+        if spaced and spacing > 0:
+            access_spacing[var.name] = spacing
+        else:
+            # no pattern, we assume it's random access
+            access_spacing[var.name] = None
+    return ActionAnalysis(update_spacing, access_spacing, access_patterns)
+
+
+def _analyze_serialized_action(data: bytes) -> ActionAnalysis:
+    return analyze_action(*load_statements(data))
+
+
 class Scheduler:
-    def __init__(self, model: MemoryModel, sram_macro: SRAMMacro):
+    @timed("scheduler")
+    def __init__(self, model: MemoryModel, sram_macro: SRAMMacro,
+                 num_workers: Union[int, None] = 1,
+                 cache: AnalysisCache = None):
         self._model = model
         self._sram_macro = sram_macro
         self._num_ports = sram_macro.num_ports
+        # number of processes used to analyze the actions. None uses all the
+        # cores
+        self._num_workers = num_workers
+        # the analysis results are reused for models with the same
+        # fingerprint
+        self._cache = cache
 
         # the only thing we care about
         self.update_spacing = {}
         self.access_spacing = {}
         self.read_var: Dict[Expression, Variable] = {}
         self.write_var: Dict[Expression, Variable] = {}
+        # name of the action that performs the access
+        self.read_action: Dict[Expression, str] = {}
+        self.write_action: Dict[Expression, str] = {}
+        # multi-dimensional access patterns derived from the loop counters
+        self.access_patterns: Dict[Variable, AffineAccessPattern] = {}
 
         # compute the memory access
         accesses = get_memory_access(model)
         statements = model.produce_statements()
-        for action_name, stmts in statements.items():
-            updates = get_state_updates(stmts)
-            variable_update = get_updated_variables(updates)
-            if action_name not in accesses:
-                # e.g. clear
-                continue
-            access = accesses[action_name]
-            access_vars = get_var_memory_access(access)
-            temp_spacing = \
-                get_mem_access_temporal_spacing(variable_update,
-                                                list(access_vars.keys()))
-            for var, spacing in temp_spacing.items():
+        global_stmts = model.get_global_stmts()
+        # actions without memory access, e.g. clear, are skipped
+        action_names = [name for name in statements if name in accesses]
+        results = self.__analyze_actions(action_names, statements,
+                                         global_stmts, accesses)
+        for action_name, result in zip(action_names, results):
+            access_vars = get_var_memory_access(accesses[action_name])
+            for var, patterns in access_vars.items():
+                spacing = result.update_spacing[var.name]
                 if var in self.update_spacing:
                     assert self.update_spacing[var] == spacing
                 self.update_spacing[var] = spacing
-            # compute the access spacing
-            for var, patterns in access_vars.items():
-                variables = []
                 for ac_var, t in patterns:
                     if t == Memory.MemoryAccessType.Read:
                         self.read_var[ac_var] = var
+                        self.read_action[ac_var] = action_name
                     else:
                         self.write_var[ac_var] = var
-                    variables.append(ac_var)
-                # compute the spacing
-                spaced, spacing = get_linear_spacing(*variables)
-                if spaced and spacing > 0:
-                    self.access_spacing[var] = spacing
-                else:
-                    # no pattern, we assume it's random access
-                    self.access_spacing[var] = None
+                        self.write_action[ac_var] = action_name
+                self.access_spacing[var] = result.access_spacing[var.name]
+                if var.name in result.access_patterns:
+                    self.access_patterns[var] = \
+                        result.access_patterns[var.name]
 
         self._mem_width = self.__get_memory_width()
+        self._data_width = self.__get_data_width(
+            [stmt for name in action_names for stmt in statements[name]])
+
+    def __analyze_actions(self, action_names: List[str],
+                          statements: Dict[str, List[Statement]],
+                          global_stmts: List[Statement],
+                          accesses) -> List[ActionAnalysis]:
+        key = ""
+        if self._cache is not None:
+            key = "scheduler-" + get_model_fingerprint(self._model)
+            cached = self._cache.get(key)
+            if cached is not None:
+                return [cached[name] for name in action_names]
+        num_workers = self._num_workers
+        if num_workers == 1 or len(action_names) <= 1:
+            results = [analyze_action(statements[name], global_stmts,
+                                      accesses[name])
+                       for name in action_names]
+        else:
+            # the actions are independent. the statements are detached from
+            # the model before they are sent to the workers
+            data = [dump_statements(self._model, (statements[name],
+                                                  global_stmts,
+                                                  accesses[name]))
+                    for name in action_names]
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=num_workers) as pool:
+                results = pool_map(pool, _analyze_serialized_action, data)
+        if self._cache is not None:
+            self._cache.set(key, dict(zip(action_names, results)))
+        return results
 
     def __get_memory_width(self):
         width = 0
@@ -69,11 +161,50 @@ class Scheduler:
                     f"{width} doesn't match with {var} ({var.bit_width})"
         return width
 
+    @property
+    def data_width(self) -> int:
+        """bit width of the values stored in the memory"""
+        return self._data_width
+
+    @property
+    def sram_macro(self) -> SRAMMacro:
+        return self._sram_macro
+
+    @staticmethod
+    def __get_data_width(stmts: List[Statement]):
+        # width of the values stored in the memory
+        width = 0
+        for stmt in stmts:
+            if isinstance(stmt, If):
+                width = max(width, Scheduler.__get_data_width(
+                    stmt.expressions + stmt.else_expressions))
+            elif isinstance(stmt, AssignStatement):
+                if isinstance(stmt.left, Memory.MemoryAccess) and \
+                        isinstance(stmt.right, Variable):
+                    width = max(width, stmt.right.bit_width)
+                elif isinstance(stmt.right, Memory.MemoryAccess) and \
+                        isinstance(stmt.left, Variable):
+                    width = max(width, stmt.left.bit_width)
+        return width
+
     @abc.abstractmethod
     def schedule(self):
         """schedule for the memory resource"""
 
 
+class ScheduledAccess(NamedTuple):
+    # port of the SRAM. with a bank mapping, the port of every bank the
+    # access may go to
+    port: int
+    # address expression and its root variable
+    access: Expression
+    var: Variable
+    access_type: Memory.MemoryAccessType
+    # first iteration of the period served by the word
+    iteration: int
+    action: str
+
+
 class State:
     def __init__(self, state_value: int,
                  state_transition: Dict[Expression,
@@ -81,57 +212,105 @@ class State:
         self.state_value = state_value
         state_transition = {} if state_transition is None else state_transition
         self.state_transition = state_transition
-        self.access_var: Expression
+        # SRAM accesses issued in this state. accesses of mutually exclusive
+        # actions may share a port
+        self.accesses: List[ScheduledAccess] = []
+
+    def add_transition(self, predicate: Expression, state: "State"):
+        self.state_transition[predicate] = state
 
     def __hash__(self):
         return hash(self.state_value)
 
+    def __repr__(self):
+        accesses = ", ".join([f"{a.access_type.name}[{a.port}]: {a.access}"
+                              for a in self.accesses])
+        return f"S{self.state_value}({accesses})"
+
+
+class Schedule:
+    """a cyclic state graph that performs `num_iterations` iterations of all
+    the actions. reads are prefetched and writes are buffered for one period,
+    so an access can be placed anywhere in the period"""
+
+    def __init__(self, states: List[State], num_iterations: int):
+        self.states = states
+        self.num_iterations = num_iterations
+
+    @property
+    def num_cycles(self) -> int:
+        return len(self.states)
+
+    @property
+    def throughput(self) -> float:
+        """number of iterations per cycle"""
+        return self.num_iterations / self.num_cycles
+
+    @property
+    def accesses(self) -> List[ScheduledAccess]:
+        result = []
+        for state in self.states:
+            result += state.accesses
+        return result
+
+    def __repr__(self):
+        return " -> ".join([repr(state) for state in self.states])
+
+
+class _Access(NamedTuple):
+    iteration: int
+    # number of iterations served by the word
+    span: int
+    access: Expression
+    var: Variable
+    access_type: Memory.MemoryAccessType
+    action: str
+
 
 class BasicScheduler(Scheduler):
-    def __init__(self, model: MemoryModel, sram_macro: SRAMMacro):
-        super().__init__(model, sram_macro)
-        assert self._sram_macro.num_en_ports == 1,\
-            "true dual-port not supported"
+    def __init__(self, model: MemoryModel, sram_macro: SRAMMacro,
+                 num_workers: Union[int, None] = 1,
+                 cache: AnalysisCache = None,
+                 constraints: List[Expression] = None,
+                 mapping: BankMapping = None):
+        super().__init__(model, sram_macro, num_workers, cache)
+        # constraints on the inputs, e.g. enables that are never asserted
+        # together. they are used to find the exclusive actions
+        self._constraints = constraints
+        self._exclusive: Union[Dict[Tuple[str, str], bool], None] = None
+        # with a bank mapping every bank is an SRAM macro of its own.
+        # accesses that never hit the same bank share the port slot
+        if mapping is not None:
+            assert mapping.size == model.memory_size.eval()
+        self.mapping = mapping
 
     def get_minimum_cycle(self):
         """Get the minimum number of cycles needed to perform all the actions
         """
-        r_result, w_result = self.__get_read_write_access()
+        # accesses of exclusive actions are packed the same way as the
+        # schedule does
+        accesses = self.__get_accesses(1)
+        groups = self.__group(accesses, self.__get_port_types())
+        groups = self.__merge_banks(groups, self.__get_port_types())
+        num_read = 0
+        num_write = 0
+        for group in groups:
+            types = {a.access_type for a in group}
+            if types == {Memory.MemoryAccessType.Read}:
+                num_read += 1
+            elif types == {Memory.MemoryAccessType.Write}:
+                num_write += 1
+            else:
+                # the group takes a read-write port
+                num_read += 1
+                num_write += 1
         if self._num_ports == 1:
-            return r_result + w_result
+            return len(groups)
+        elif self._sram_macro.num_en_ports == 1:
+            return max(num_read, num_write)
         else:
-            return max(r_result, w_result)
-
-    def __get_read_write_access(self):
-        num_read = {}
-        num_write = {}
-        for ac_var, root_var in self.read_var.items():
-            assert root_var in self.access_spacing
-            if self.access_spacing[root_var] is None:
-                # random access
-                num_read[root_var] = 1
-            else:
-                if root_var not in num_read:
-                    num_read[root_var] = 0
-                num_read[root_var] += 1
-        for ac_var, root_var in self.write_var.items():
-            assert root_var in self.access_spacing
-            if self.access_spacing[root_var] is None:
-                # random access
-                num_write[root_var] = 1
-            else:
-                if root_var not in num_write:
-                    num_write[root_var] = 0
-                num_write[root_var] += 1
-        # compute the cycle based on if the root variable access is random
-        # access or not
-        r_result = 0
-        w_result = 0
-        for _, v in num_read.items():
-            r_result += v
-        for _, v in num_write.items():
-            w_result += v
-        return r_result, w_result
+            # true dual-port
+            return int(math.ceil(len(groups) / 2))
 
     def get_port_size(self, throughput_cycle: int, total_cycle: int):
         # we need to compute the how many read and write throughput
@@ -174,45 +353,200 @@ class BasicScheduler(Scheduler):
             read_throughput += var_throughput
         return read_throughput
 
+    def get_elements_per_word(self) -> int:
+        """number of memory elements aggregated into one SRAM word"""
+        if self._data_width == 0:
+            return 1
+        return max(1, self._sram_macro.port_size // self._data_width)
+
+    def __get_word_iterations(self, root_var: Variable,
+                              num_iterations: int) -> List[int]:
+        # first iteration of every SRAM word touched by an access within a
+        # period. the addresses are assumed to be aligned to the word
+        spacing = self.update_spacing[root_var]
+        if spacing is None:
+            # random access
+            return list(range(num_iterations))
+        pattern = self.access_patterns.get(root_var, None)
+        if pattern is not None and pattern.dims:
+            # nested counters may jump in the middle of the period
+            words = {}
+            addresses = pattern.get_addresses(num_iterations)
+            for iteration, addr in enumerate(addresses):
+                words.setdefault(addr // num_iterations, iteration)
+            return list(words.values())
+        span = abs(spacing) * (num_iterations - 1) + 1
+        num_words = min(num_iterations,
+                        int(math.ceil(span / num_iterations)))
+        return [i * num_iterations // num_words for i in range(num_words)]
+
+    def __get_accesses(self, num_iterations: int) -> List[_Access]:
+        result = []
+        for var_access, actions, access_type in \
+                ((self.read_var, self.read_action,
+                  Memory.MemoryAccessType.Read),
+                 (self.write_var, self.write_action,
+                  Memory.MemoryAccessType.Write)):
+            for ac_var, root_var in var_access.items():
+                iterations = self.__get_word_iterations(root_var,
+                                                        num_iterations)
+                for idx, iteration in enumerate(iterations):
+                    end = iterations[idx + 1] if idx + 1 < len(iterations) \
+                        else num_iterations
+                    result.append(_Access(iteration, end - iteration, ac_var,
+                                          root_var, access_type,
+                                          actions[ac_var]))
+        # accesses serving earlier iterations go first, reads before writes
+        # so that the data is ready
+        result.sort(key=lambda x: (x.iteration, x.access_type.value))
+        return result
+
+    def __get_port_types(self) -> List[Set[Memory.MemoryAccessType]]:
+        read_write = {Memory.MemoryAccessType.Read,
+                      Memory.MemoryAccessType.Write}
+        if self._num_ports == 1:
+            return [read_write]
+        elif self._sram_macro.num_en_ports == 1:
+            # one read port and one write port
+            return [{Memory.MemoryAccessType.Read},
+                    {Memory.MemoryAccessType.Write}]
+        else:
+            return [read_write, read_write]
+
+    def __is_exclusive(self, action1: str, action2: str):
+        if action1 == action2:
+            return False
+        if self._exclusive is None:
+            analysis = ExclusivityAnalysis(self._model, self._constraints,
+                                           self._cache)
+            self._exclusive = analysis.get_matrix()
+        return self._exclusive[(action1, action2)]
+
+    def __can_share(self, group: List[_Access], access: _Access,
+                    port_types: List[Set[Memory.MemoryAccessType]]):
+        # exclusive actions never fire in the same iteration, so their
+        # accesses for that iteration can use the same port slot
+        types = {a.access_type for a in group} | {access.access_type}
+        if not any([types <= t for t in port_types]):
+            return False
+        for a in group:
+            if a.span != 1 or access.span != 1 or \
+                    a.iteration != access.iteration:
+                return False
+            if not self.__is_exclusive(a.action, access.action):
+                return False
+        return True
+
+    def __group(self, accesses: List[_Access],
+                port_types: List[Set[Memory.MemoryAccessType]]) \
+            -> List[List[_Access]]:
+        # accesses in a group are issued together on one port slot
+        groups: List[List[_Access]] = []
+        for access in accesses:
+            for group in groups:
+                if self.__can_share(group, access, port_types):
+                    group.append(access)
+                    break
+            else:
+                groups.append([access])
+        return groups
+
+    def __is_bank_disjoint(self, a: _Access, b: _Access):
+        # the addresses of the same iteration are a constant apart, and
+        # the mapping keeps them in different banks for any base address.
+        # a word must not straddle two banks
+        if a.iteration != b.iteration or a.span != b.span or \
+                self.mapping.block_size % self.get_elements_per_word() != 0:
+            return False
+        form_a = get_affine_form(remove_mod_op(a.access))
+        form_b = get_affine_form(remove_mod_op(b.access))
+        if form_a is None or form_b is None or form_a[0] != form_b[0]:
+            return False
+        return self.mapping.is_disjoint(form_b[1] - form_a[1])
+
+    def __merge_banks(self, groups: List[List[_Access]],
+                      port_types: List[Set[Memory.MemoryAccessType]]) \
+            -> List[List[_Access]]:
+        # groups that never hit the same bank are issued together, each one
+        # on the port of its own bank
+        if self.mapping is None or self.mapping.num_banks == 1:
+            return groups
+        result: List[List[_Access]] = []
+        for group in groups:
+            for merged in result:
+                types = {a.access_type for a in merged + group}
+                if any([types <= t for t in port_types]) and \
+                        all([self.__is_bank_disjoint(a, b)
+                             for a in merged for b in group]):
+                    merged += group
+                    break
+            else:
+                result.append(group[:])
+        return result
+
+    def __is_conflict(self, cycle: List[Tuple[int, List[_Access]]],
+                      group: List[_Access]):
+        # two writes to the same address variable can't be issued on
+        # different ports in the same cycle. reading and writing the same
+        # address returns the old value, which matches the action order
+        for _, other in cycle:
+            for a in other:
+                for b in group:
+                    if a.var.name == b.var.name and \
+                            a.access_type == b.access_type == \
+                            Memory.MemoryAccessType.Write and \
+                            not self.__is_exclusive(a.action, b.action):
+                        return True
+        return False
+
+    def __pack(self) -> List[List[Tuple[int, List[_Access]]]]:
+        num_iterations = self.get_elements_per_word()
+        accesses = self.__get_accesses(num_iterations)
+        if num_iterations > 1 and \
+                any([a.span == 1 and a.access_type ==
+                     Memory.MemoryAccessType.Write for a in accesses]):
+            assert self._sram_macro.partial_write, \
+                "only supports sram with partial writes"
+        port_types = self.__get_port_types()
+        groups = self.__group(accesses, port_types)
+        groups = self.__merge_banks(groups, port_types)
+        # greedy list scheduling. every cycle fills the ports with the
+        # earliest groups that fit
+        cycles = []
+        while groups:
+            cycle = []
+            for port, types in enumerate(port_types):
+                for group in groups:
+                    if {a.access_type for a in group} <= types and \
+                            not self.__is_conflict(cycle, group):
+                        cycle.append((port, group))
+                        groups.remove(group)
+                        break
+            cycles.append(cycle)
+        # one iteration per cycle at most
+        while len(cycles) < num_iterations:
+            cycles.append([])
+        return cycles
+
     def get_total_cycle(self):
         # return the number of cycles needed to perform all the actions
         # this is based on the memory macro we have
-        r_result, w_result = self.__get_read_write_access()
-        macro = self._sram_macro
-        assert macro.partial_write, "only supports sram with partial writes"
+        return len(self.__pack())
 
-    def schedule(self):
+    def schedule(self) -> Schedule:
         """The basic scheduler tries its best to schedule for minimum cycle
-        delay"""
-        cycle = self.get_minimum_cycle()
-        port_size = self.get_port_size(cycle, cycle)
-        total_num_state = len(self.read_var) + len(self.write_var)
-        # state 0 is always do nothing
-        states = [State(0, None)]
-        for state_id in range(1, total_num_state + 1):
-            states.append(State(state_id, None))
-        # for now we can only do one read and one write
-        assert len(self.update_spacing) <= 2
-        (read_var, num_read_vars), (write_var, num_write_vars)\
-            = self.__get_read_write_var()
-        assert read_var is not None and write_var is not None
-        # should we prefetch the read?
-        if self.update_spacing[read_var] is not None:
-            # we need to prefetch them, starting
-            pass
-
-    def __get_read_write_var(self):
-        # get the read variable name
-        read_var: Union[Variable, None] = None
-        write_var: Union[Variable, None] = None
-        num_read_vars = 0
-        num_write_vars = 0
-        for _, root in self.read_var.items():
-            assert read_var is None or read_var.eq(root)
-            read_var = root
-            num_read_vars += 1
-        for _, root in self.write_var.items():
-            assert write_var is None or write_var.eq(root)
-            write_var = root
-            num_write_vars += 1
-        return (read_var, num_read_vars), (write_var, num_write_vars)
+        delay. a period covers as many iterations as there are elements in
+        a word, so that sequential accesses are aggregated"""
+        num_iterations = self.get_elements_per_word()
+        cycles = self.__pack()
+        states = [State(state_id) for state_id in range(len(cycles))]
+        for state, cycle in zip(states, cycles):
+            for port, group in cycle:
+                for a in group:
+                    state.accesses.append(
+                        ScheduledAccess(port, a.access, a.var, a.access_type,
+                                        a.iteration, a.action))
+        # the states form a loop
+        for idx, state in enumerate(states):
+            state.add_transition(Const(1), states[(idx + 1) % len(states)])
+        return Schedule(states, num_iterations)
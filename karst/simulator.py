@@ -0,0 +1,291 @@
+from .model import MemoryModel, Memory
+from .values import Port, PortType
+from .backend import get_memory_access
+from .scheduler import BasicScheduler
+from .aggregate import WideWordMemory, SRAMAccess
+from .partition import BankMapping
+from .tlm import Mismatch
+from typing import Dict, List, Tuple
+import collections
+
+
+class _TracedData:
+    # stands in for the memory content of a single memory access, and logs
+    # every element that goes through it
+    def __init__(self, data: List[int], stream: str,
+                 access_type: Memory.MemoryAccessType,
+                 log: List[Tuple[Memory.MemoryAccessType, str, int, int]]):
+        self._data = data
+        self._stream = stream
+        self._access_type = access_type
+        self._log = log
+
+    def __getitem__(self, index: int):
+        value = self._data[index]
+        self._log.append((self._access_type, self._stream, index, value))
+        return value
+
+    def __setitem__(self, index: int, value: int):
+        self._data[index] = value
+        self._log.append((self._access_type, self._stream, index, value))
+
+
+class _TracedMemory:
+    def __init__(self, data: _TracedData):
+        self._data = data
+
+
+class SimulationReport:
+    def __init__(self, num_iterations: int, num_cycles: int, num_stalls: int,
+                 num_conflicts: int, num_words: int,
+                 expected_throughput: float, mismatches: List[Mismatch]):
+        self.num_iterations = num_iterations
+        self.num_cycles = num_cycles
+        self.num_stalls = num_stalls
+        # number of times an SRAM access was held back because the state
+        # gave its port to another access of the same bank
+        self.num_conflicts = num_conflicts
+        # number of SRAM words transferred
+        self.num_words = num_words
+        # throughput promised by the schedule when every action fires every
+        # iteration
+        self.expected_throughput = expected_throughput
+        self.mismatches = mismatches
+
+    @property
+    def throughput(self) -> float:
+        """iterations per cycle"""
+        return self.num_iterations / self.num_cycles if self.num_cycles else 0
+
+    @property
+    def words_per_cycle(self) -> float:
+        return self.num_words / self.num_cycles if self.num_cycles else 0
+
+    def __repr__(self):
+        return f"{self.num_iterations} iterations in {self.num_cycles} " \
+               f"cycles ({self.num_stalls} stalls, {self.num_conflicts} " \
+               f"bank conflicts): throughput " \
+               f"{self.throughput:.2f}, expected " \
+               f"{self.expected_throughput:.2f}, " \
+               f"{self.words_per_cycle:.2f} words/cycle, " \
+               f"{len(self.mismatches)} mismatches"
+
+
+class ScheduleSimulator:
+    """cycle-accurate simulation of a scheduled memory. the functional
+    model is the reference: every memory access it makes is replayed on a
+    wide-word memory, and the resulting SRAM accesses are served in order,
+    each one once the state machine reaches a state that assigns its stream
+    to a free port. a read only gets its data when its SRAM access is
+    granted, and is checked against the SRAM content of that cycle, or
+    against the buffered word it was served from. a new iteration is only
+    accepted while the backlog of SRAM accesses fits in the buffers,
+    otherwise the pipeline stalls.
+
+    with a bank mapping, every bank is an SRAM of its own that runs the same
+    schedule. the mapping of the scheduler is used by default. the model can
+    only have a single memory"""
+
+    def __init__(self, model: MemoryModel, scheduler: BasicScheduler,
+                 max_backlog: int = None, mapping: BankMapping = None):
+        self._model = model
+        self.schedule = scheduler.schedule()
+        size = model.memory_size.eval()
+        if mapping is None:
+            mapping = scheduler.mapping
+        if mapping is None:
+            mapping = BankMapping(1, size, size)
+        assert mapping.size == size
+        self.mapping = mapping
+        self._mems = [WideWordMemory.from_scheduler(scheduler,
+                                                    mapping.bank_size)
+                      for _ in range(mapping.num_banks)]
+        # one period worth of buffering by default
+        if max_backlog is None:
+            max_backlog = max(1, len(self.schedule.accesses))
+        self.max_backlog = max_backlog
+
+        self._ports: Dict[str, Port] = {}
+        for name, port in model.get_ports().items():
+            if isinstance(port, Port) and port.port_type == PortType.In:
+                self._ports[name] = port
+        self._accesses = []
+        for accesses in get_memory_access(model).values():
+            for access, access_type in accesses:
+                assert not isinstance(access, Memory.MemoryBankAccess), \
+                    "memory banks not supported"
+                self._accesses.append((access, access_type))
+        assert len({id(access.mem) for access, _ in self._accesses}) <= 1, \
+            "only a single memory is supported"
+        # every stream has to be served by some state
+        scheduled = {(str(access.access), access.access_type)
+                     for access in self.schedule.accesses}
+        mem = self._mems[0]
+        for streams in (mem.read_streams, mem.write_streams):
+            for stream in streams.values():
+                assert (stream.name, stream.access_type) in scheduled, \
+                    f"{stream.name} is not scheduled"
+
+    def run(self, stimuli: List[Dict[str, int]]) -> SimulationReport:
+        """each stimulus sets the input ports of one iteration, including
+        the EN_ ports of the actions"""
+        log = []
+        # route the memory accesses of the model through the trace
+        memories = []
+        for access, access_type in self._accesses:
+            memories.append(access.mem)
+            data = _TracedData(access.mem._data, str(access.var), access_type,
+                               log)
+            access.mem = _TracedMemory(data)
+        # SRAM words of every bank
+        srams = []
+        if memories:
+            data = memories[0]._data
+            for bank, mem in enumerate(self._mems):
+                values = [data[self.mapping.get_address(bank, offset)]
+                          for offset in range(self.mapping.bank_size)]
+                mem.load(values)
+                srams.append([values[i:i + mem.word_size]
+                              for i in range(0, len(values), mem.word_size)])
+        try:
+            return self.__run(stimuli, log, srams)
+        finally:
+            for (access, _), mem in zip(self._accesses, memories):
+                access.mem = mem
+
+    def __run(self, stimuli: List[Dict[str, int]], log,
+              srams: List[List[List[int]]]) -> SimulationReport:
+        queues = [collections.deque() for _ in self._mems]
+        state = self.schedule.states[0]
+        num_cycles = 0
+        num_stalls = 0
+        num_conflicts = 0
+        num_words = 0
+        mismatches = []
+        # (bank, tag) of the queued SRAM accesses -> the reads that wait for
+        # them, as (source, offset, iteration, stream, expected value)
+        checks: Dict[Tuple[int, int], List] = {}
+        # (bank, word address) -> tag of the last queued write
+        last_writes: Dict[Tuple[int, int], int] = {}
+        # (bank, tag) of the SRAM reads -> the buffered word, once granted
+        copies: Dict[Tuple[int, int], Tuple[int, List[int]]] = {}
+
+        def __check(source, offset, iteration, stream, value):
+            actual = copies[source][1][offset]
+            if actual != value:
+                mismatches.append(Mismatch(iteration, stream, value, actual))
+
+        def __issue(bank: int, access: SRAMAccess):
+            queues[bank].append(access)
+            checks[(bank, access.tag)] = []
+            if access.access_type == Memory.MemoryAccessType.Write:
+                last_writes[(bank, access.word_addr)] = access.tag
+            else:
+                copies[(bank, access.tag)] = (access.word_addr, None)
+
+        def __grant(bank: int, access: SRAMAccess):
+            nonlocal num_words
+            word = srams[bank][access.word_addr]
+            key = (bank, access.tag)
+            if access.access_type == Memory.MemoryAccessType.Write:
+                for offset, value in access.data:
+                    word[offset] = value
+                # the buffered copies are kept coherent
+                for (copy_bank, _), (word_addr, copy) in copies.items():
+                    if copy_bank == bank and word_addr == access.word_addr \
+                            and copy is not None:
+                        for offset, value in access.data:
+                            copy[offset] = value
+                if last_writes[(bank, access.word_addr)] == access.tag:
+                    last_writes.pop((bank, access.word_addr))
+            else:
+                copies[key] = (access.word_addr, word[:])
+            for check in checks.pop(key):
+                __check(*check)
+            num_words += 1
+
+        def __cycle():
+            # the accesses are served in order. the oldest one waits until
+            # the state assigns its stream to a free port
+            nonlocal state, num_cycles, num_conflicts
+            for bank, queue in enumerate(queues):
+                # port -> stream it served in this cycle
+                used_ports = {}
+                while queue:
+                    access = queue[0]
+                    ports = [scheduled.port for scheduled in state.accesses
+                             if str(scheduled.access) == access.stream and
+                             scheduled.access_type == access.access_type]
+                    free = [port for port in ports if port not in used_ports]
+                    if not free:
+                        # a later iteration of the same stream waits for
+                        # the next period, which is not a conflict
+                        if any([used_ports[port] != access.stream
+                                for port in ports]):
+                            num_conflicts += 1
+                        break
+                    queue.popleft()
+                    __grant(bank, access)
+                    used_ports[free[0]] = access.stream
+            state = list(state.state_transition.values())[0]
+            num_cycles += 1
+
+        for iteration, stimulus in enumerate(stimuli):
+            while max([len(q) for q in queues]) > self.max_backlog:
+                __cycle()
+                num_stalls += 1
+            log.clear()
+            self.__eval(stimulus)
+            for access_type, stream, addr, value in log:
+                bank = self.mapping.get_bank(addr)
+                mem = self._mems[bank]
+                offset = self.mapping.get_offset(addr)
+                if access_type == Memory.MemoryAccessType.Write:
+                    mem.write(stream, offset, value)
+                    continue
+                actual = mem.read(stream, offset)
+                for access in mem.pop_accesses():
+                    __issue(bank, access)
+                source = mem.last_source
+                if source is None:
+                    # forwarded from an aggregation buffer
+                    if actual != value:
+                        mismatches.append(Mismatch(iteration, stream, value,
+                                                   actual))
+                    continue
+                # the data is there once the word is read and the older
+                # writes to it are done
+                check = ((bank, source.tag), offset % mem.word_size,
+                         iteration, stream, value)
+                last_write = last_writes.get((bank, source.word_addr), 0)
+                wait = [tag for tag in (source.tag, last_write)
+                        if (bank, tag) in checks]
+                if wait:
+                    checks[(bank, max(wait))].append(check)
+                else:
+                    __check(*check)
+            for bank, mem in enumerate(self._mems):
+                for access in mem.pop_accesses():
+                    __issue(bank, access)
+                # only the buffered words can be read again
+                live = {(bank, access.tag) for access in mem.get_sources()}
+                for waiting in checks.values():
+                    live |= {check[0] for check in waiting}
+                for key in [key for key in copies if key[0] == bank and
+                            key not in live]:
+                    copies.pop(key)
+            __cycle()
+        # drain the buffers
+        while any(queues):
+            __cycle()
+        return SimulationReport(len(stimuli), num_cycles, num_stalls,
+                                num_conflicts, num_words,
+                                self.schedule.throughput, mismatches)
+
+    def __eval(self, stimulus: Dict[str, int]):
+        for name, value in stimulus.items():
+            self._ports[name].value = value
+        # same order as the ports, see MemoryCore.eval
+        for name, port in self._ports.items():
+            if name[:3] == "EN_" and port.eval() == 1:
+                self._model[name[3:]]()
@@ -0,0 +1,442 @@
+from .core import MemoryCore, MemoryInstruction, MemoryMode, \
+    LatencyPipeline
+from .model import MemoryModel
+from typing import Dict, List, Tuple, Union, NamedTuple
+import abc
+import random
+
+
+class TransactionModel:
+    """transaction-level model (TLM) of a memory mode. it implements the
+    same cycle behavior as the statement-level model, but directly on top of
+    python containers so that bulk simulation runs at native speed"""
+    NUM_MEMORY = 1
+    # configurables and their default values
+    CONFIGS: Dict[str, int] = {}
+    # state variables and ports that are exchanged with the statement model
+    STATES: Tuple[str, ...] = ()
+    # input port name (including the aliases) -> state name
+    INPUTS: Dict[str, str] = {}
+    # enable state name -> action, follows the port order of the model
+    ENABLES: Tuple[Tuple[str, str], ...] = ()
+    OUTPUTS: Tuple[str, ...] = ()
+
+    def __init__(self, memory_size: int = 1):
+        self.memory_size = memory_size
+        for name in self.STATES:
+            setattr(self, name, 0)
+        for name, value in self.CONFIGS.items():
+            setattr(self, name, value)
+        self.mem: List[List[int]] = []
+        self.__resize(memory_size)
+
+    def __resize(self, memory_size: int):
+        assert memory_size % self.NUM_MEMORY == 0
+        mem_size = memory_size // self.NUM_MEMORY
+        self.mem = [[0 for _ in range(mem_size)]
+                    for _ in range(self.NUM_MEMORY)]
+
+    def configure(self, **kwargs):
+        for key, value in kwargs.items():
+            if key == MemoryModel.MEMORY_SIZE:
+                self.memory_size = value
+                self.__resize(value)
+            else:
+                assert key in self.CONFIGS, f"unknown configurable {key}"
+                setattr(self, key, value)
+        self.init_state()
+
+    @abc.abstractmethod
+    def init_state(self):
+        """put the model in the state after configuration"""
+
+    def eval(self, **kargs) -> Dict[str, int]:
+        inputs = self.INPUTS
+        for name, value in kargs.items():
+            if name in inputs:
+                setattr(self, inputs[name], value)
+        actions = [action for en, action in self.ENABLES
+                   if getattr(self, en) == 1]
+        for action in actions:
+            getattr(self, action)()
+        return {name: getattr(self, name) for name in self.OUTPUTS}
+
+    def load(self, model: MemoryModel):
+        """copy the state of a statement-level model into the TLM"""
+        for name, var in model.get_config_vars().items():
+            if name == MemoryModel.MEMORY_SIZE:
+                self.memory_size = var.value
+            elif name in self.CONFIGS:
+                setattr(self, name, var.value)
+        for name in self.STATES:
+            setattr(self, name, model[name].eval())
+        self.mem = [mem._data[:] for mem in model._mem]
+
+    def store(self, model: MemoryModel):
+        """copy the state of the TLM into a statement-level model. notice that
+        configurables are not touched"""
+        for name in self.STATES:
+            model[name].value = getattr(self, name)
+        for mem, data in zip(model._mem, self.mem):
+            mem._data[:] = data
+
+    def compare(self, model: MemoryModel) -> List[Tuple[str, int, int]]:
+        """(name, expected, actual) of the states and memory entries that
+        differ from the statement-level model"""
+        result = []
+        for name in self.STATES:
+            expected = model[name].eval()
+            actual = getattr(self, name)
+            if expected != actual:
+                result.append((name, expected, actual))
+        for idx, (mem, data) in enumerate(zip(model._mem, self.mem)):
+            for addr, (expected, actual) in enumerate(zip(mem._data, data)):
+                if expected != actual:
+                    result.append((f"mem{idx}[{addr}]", expected, actual))
+        return result
+
+    def write_to_mem(self, index: int, value: int, mem_index: int = 0):
+        self.mem[mem_index][index] = value
+
+    def read_from_mem(self, index: int, mem_index: int = 0):
+        return self.mem[mem_index][index]
+
+
+class SRAMTransactionModel(TransactionModel):
+    STATES = ("ren", "addr", "wen", "data_in", "data_out", "RDY_read",
+              "RDY_write", "EN_reset", "RDY_reset")
+    INPUTS = {"ren": "ren", "EN_read": "ren", "addr": "addr", "wen": "wen",
+              "EN_write": "wen", "data_in": "data_in", "EN_reset": "EN_reset"}
+    ENABLES = (("ren", "read"), ("wen", "write"), ("EN_reset", "reset"))
+    OUTPUTS = ("data_out", "RDY_read", "RDY_write", "RDY_reset")
+
+    def read(self):
+        if self.RDY_read == 1:
+            self.data_out = self.mem[0][self.addr]
+
+    def write(self):
+        if self.RDY_write == 1:
+            self.mem[0][self.addr] = self.data_in
+
+    def reset(self):
+        if self.RDY_reset == 1:
+            self.init_state()
+
+    def init_state(self):
+        self.RDY_read = 1
+        self.RDY_write = 1
+
+
+class FIFOTransactionModel(TransactionModel):
+    CONFIGS = {"almost_t": 0, "capacity": 0}
+    STATES = ("data_out", "data_in", "almost_empty", "almost_full",
+              "read_addr", "write_addr", "EN_enqueue", "RDY_enqueue",
+              "EN_dequeue", "RDY_dequeue", "EN_reset", "RDY_reset")
+    INPUTS = {"data_in": "data_in", "EN_enqueue": "EN_enqueue",
+              "EN_dequeue": "EN_dequeue", "EN_reset": "EN_reset"}
+    ENABLES = (("EN_enqueue", "enqueue"), ("EN_dequeue", "dequeue"),
+               ("EN_reset", "reset"))
+    OUTPUTS = ("data_out", "almost_empty", "almost_full", "RDY_reset")
+
+    def enqueue(self):
+        if self.RDY_enqueue != 1:
+            return
+        self.mem[0][self.write_addr] = self.data_in
+        self.write_addr = (self.write_addr + 1) % self.memory_size
+        self.__update_state()
+
+    def dequeue(self):
+        if self.RDY_dequeue != 1:
+            return
+        self.data_out = self.mem[0][self.read_addr]
+        self.read_addr = (self.read_addr + 1) % self.memory_size
+        self.__update_state()
+
+    def reset(self):
+        if self.RDY_reset == 1:
+            self.init_state()
+
+    def init_state(self):
+        self.read_addr = 0
+        self.write_addr = 0
+        self.RDY_dequeue = 0
+        self.RDY_enqueue = 1
+        self.__global_eval()
+
+    def __update_state(self):
+        self.RDY_dequeue = (self.write_addr - self.read_addr) > self.almost_t
+        self.RDY_enqueue = (self.write_addr - self.read_addr) < \
+            (self.capacity - self.almost_t)
+        self.__global_eval()
+
+    def __global_eval(self):
+        self.almost_full = self.RDY_enqueue ^ 1
+        self.almost_empty = self.RDY_dequeue ^ 1
+
+
+class RowBufferTransactionModel(TransactionModel):
+    CONFIGS = {"depth": 0}
+    STATES = ("data_in", "data_out", "valid", "wen", "read_addr",
+              "write_addr", "RDY_enqueue", "EN_reset", "RDY_reset")
+    INPUTS = {"data_in": "data_in", "wen": "wen", "EN_enqueue": "wen",
+              "EN_reset": "EN_reset"}
+    ENABLES = (("wen", "enqueue"), ("EN_reset", "reset"))
+    OUTPUTS = ("data_out", "valid", "RDY_enqueue", "RDY_reset")
+
+    def enqueue(self):
+        if self.RDY_enqueue != 1:
+            return
+        memory_size = self.memory_size
+        mem = self.mem[0]
+        mem[self.write_addr] = self.data_in
+        self.write_addr = (self.write_addr + 1) % memory_size
+        self.valid = (((self.write_addr - self.read_addr + memory_size)
+                       % memory_size) > self.depth) & self.wen
+        if self.write_addr - self.read_addr > self.depth:
+            self.data_out = mem[self.read_addr]
+            self.read_addr = (self.read_addr + 1) % memory_size
+        else:
+            self.data_out = 0
+
+    def reset(self):
+        if self.RDY_reset == 1:
+            self.init_state()
+
+    def init_state(self):
+        self.read_addr = 0
+        self.write_addr = 0
+        self.RDY_enqueue = 1
+
+
+class DoubleBufferTransactionModel(TransactionModel):
+    NUM_MEMORY = 2
+    CONFIGS = {"threshold": 0, "ext_chin": 0, "off_x": 0, "off_y": 0,
+               "ext_chout": 0, "ext_x": 0, "bound_ch": 0, "bound_x": 0,
+               "stride": 1}
+    STATES = ("data_in", "data_out", "ren", "wen", "read_addr", "write_addr",
+              "cin_off", "x_iter", "y_iter", "x_off", "y_off", "cout_off",
+              "select", "RDY_read", "RDY_write", "EN_reset", "RDY_reset")
+    INPUTS = {"data_in": "data_in", "ren": "ren", "EN_read": "ren",
+              "wen": "wen", "EN_write": "wen", "EN_reset": "EN_reset"}
+    ENABLES = (("ren", "read"), ("wen", "write"), ("EN_reset", "reset"))
+    OUTPUTS = ("data_out", "RDY_read", "RDY_write", "RDY_reset")
+
+    def read(self):
+        if self.RDY_read != 1:
+            return
+        self.data_out = self.mem[self.select][self.read_addr]
+        self.cin_off += 1
+        if self.cin_off == self.ext_chin:
+            self.cin_off = 0
+            self.x_off += 1
+            if self.x_off == self.off_x:
+                self.x_off = 0
+                self.y_off += 1
+                if self.y_off == self.off_y:
+                    self.y_off = 0
+                    self.cout_off += 1
+                    if self.cout_off == self.ext_chout:
+                        self.cout_off = 0
+                        self.x_iter += self.stride
+                        if self.x_iter == self.ext_x:
+                            self.x_iter = 0
+                            self.y_iter += self.stride
+        self.__switch()
+        self.__global_eval()
+
+    def write(self):
+        if self.RDY_write != 1:
+            return
+        self.mem[0][self.write_addr] = self.data_in
+        self.write_addr = (self.write_addr + 1) % self.memory_size
+        self.__switch()
+        self.__global_eval()
+
+    def reset(self):
+        if self.RDY_reset == 1:
+            self.init_state()
+
+    def init_state(self):
+        self.write_addr = 0
+        self.RDY_write = 1
+        self.RDY_read = 1
+        self.ren = 1
+        self.cin_off = 0
+        self.x_iter = 0
+        self.y_iter = 0
+        self.x_off = 0
+        self.y_off = 0
+        self.cout_off = 0
+        self.__global_eval()
+
+    def __switch(self):
+        threshold = self.threshold
+        if (self.write_addr >= threshold - 1) & \
+                (self.y_iter >= threshold - 1):
+            self.select = self.select ^ 1
+
+    def __global_eval(self):
+        bound_ch = self.bound_ch
+        self.read_addr = self.cin_off + (self.x_iter + self.x_off) * bound_ch\
+            + (self.y_iter + self.y_off) * bound_ch * self.bound_x
+
+
+TRANSACTION_MODELS = {
+    MemoryMode.SRAM: SRAMTransactionModel,
+    MemoryMode.FIFO: FIFOTransactionModel,
+    MemoryMode.RowBuffer: RowBufferTransactionModel,
+    MemoryMode.DoubleBuffer: DoubleBufferTransactionModel
+}
+
+
+class TransactionCore:
+    """drop-in replacement of MemoryCore that uses the transaction-level
+    models"""
+
+    def __init__(self, memory_size,
+                 latency: Dict[MemoryMode, int] = None):
+        self.memory_size = memory_size
+        self.latency = MemoryCore.DEFAULT_LATENCY.copy()
+        if latency is not None:
+            self.latency.update(latency)
+        self._models: Dict[MemoryMode, TransactionModel] = \
+            {mode: cls(memory_size) for mode, cls in
+             TRANSACTION_MODELS.items()}
+        self._mem: Union[TransactionModel, None] = None
+        self._instr: Union[MemoryInstruction, None] = None
+        self._pipeline = LatencyPipeline()
+
+    def configure(self, instr: MemoryInstruction):
+        self._mem = self._models[instr.memory_mode]
+        values = instr.values.copy()
+        values[MemoryModel.MEMORY_SIZE] = self.memory_size
+        self._mem.configure(**values)
+        self._instr = instr
+        self._pipeline = LatencyPipeline(
+            self.latency.get(instr.memory_mode, 0))
+        for addr, data in instr.data_entries:
+            self._mem.write_to_mem(addr, data)
+
+    def eval(self, **kargs):
+        action_map = MemoryCore.ACTION_NAMES[self._instr.memory_mode]
+        inputs = {}
+        for name, value in kargs.items():
+            if name in action_map:
+                name = f"EN_{action_map[name]}"
+            inputs[name] = value
+        return self._pipeline.push(self._mem.eval(**inputs))
+
+    def load(self, core: MemoryCore):
+        """synchronize from the statement-level core"""
+        self._instr = core._instr
+        self._mem = self._models[core._instr.memory_mode]
+        self._mem.load(core._mem)
+        self._pipeline = core._pipeline.copy()
+
+    def compare(self, core: MemoryCore) -> List[Tuple[str, int, int]]:
+        """(name, expected, actual) of the states, memory entries and
+        outputs in flight that differ from the statement-level core"""
+        assert core._instr.memory_mode == self._instr.memory_mode
+        result = self._mem.compare(core._mem)
+        records = zip(core._pipeline.get_records(),
+                      self._pipeline.get_records())
+        for idx, (expected, actual) in enumerate(records):
+            for name in sorted(expected.keys() | actual.keys()):
+                if expected.get(name) != actual.get(name):
+                    result.append((f"pipeline{idx}.{name}",
+                                   expected.get(name), actual.get(name)))
+        return result
+
+    def store(self, core: MemoryCore):
+        """synchronize the statement-level core to the TLM"""
+        assert core._instr.memory_mode == self._instr.memory_mode
+        self._mem.store(core._mem)
+        core._pipeline = self._pipeline.copy()
+
+
+class Mismatch(NamedTuple):
+    cycle: int
+    port: str
+    expected: int
+    actual: int
+
+
+class DifferentialCore:
+    """runs the TLM at every cycle and cross-checks it against the
+    statement-level MemoryCore on windows of cycles. a window is started
+    every `period` cycles, or randomly with probability `rate`. the
+    statement-level core doesn't run between the windows, so it is
+    synchronized to the TLM at the beginning of a window that follows
+    unchecked cycles. at the end of every window the whole state, memory
+    and outputs in flight included, is compared as well, so divergences
+    that don't reach the outputs within the window are reported. the
+    state mismatches are reported under the state name, e.g. "read_addr"
+    or "mem0[4]" """
+
+    def __init__(self, memory_size, period: int = 1, window: int = 1,
+                 rate: float = 0.0, seed: int = 0,
+                 latency: Dict[MemoryMode, int] = None):
+        assert window > 0
+        self.core = MemoryCore(memory_size, latency)
+        self.tlm = TransactionCore(memory_size, latency)
+        self.period = period
+        self.window = window
+        self.rate = rate
+        self._rnd = random.Random(seed)
+
+        self.cycle = 0
+        self.num_checked = 0
+        self.mismatches: List[Mismatch] = []
+        # number of cycles left in the current window
+        self._window_left = 0
+        # whether the statement-level core is in sync with the TLM
+        self._in_sync = False
+
+    def configure(self, instr: MemoryInstruction):
+        self.core.configure(instr)
+        # the statement model has side effects during configuration, so we
+        # use it as the golden initial state
+        self.tlm.load(self.core)
+        self._in_sync = True
+        self._window_left = 0
+
+    def start_window(self, window: int):
+        """force a checked window of `window` cycles, starting from the next
+        cycle"""
+        assert window > 0
+        self._window_left = window
+
+    def __start_window(self):
+        if self.period > 0 and self.cycle % self.period == 0:
+            return True
+        return self.rate > 0 and self._rnd.random() < self.rate
+
+    def eval(self, **kargs):
+        if self._window_left == 0 and self.__start_window():
+            self._window_left = self.window
+        if self._window_left == 0:
+            self._in_sync = False
+            self.cycle += 1
+            return self.tlm.eval(**kargs)
+
+        if not self._in_sync:
+            self.tlm.store(self.core)
+            self._in_sync = True
+        expected = self.core.eval(**kargs)
+        result = self.tlm.eval(**kargs)
+        for name in expected.keys() | result.keys():
+            value = expected.get(name, None)
+            actual = result.get(name, None)
+            if value != actual:
+                self.mismatches.append(Mismatch(self.cycle, name, value,
+                                                actual))
+        self._window_left -= 1
+        if self._window_left == 0:
+            for name, value, actual in self.tlm.compare(self.core):
+                self.mismatches.append(Mismatch(self.cycle, name, value,
+                                                actual))
+                # start over from the TLM state at the next window
+                self._in_sync = False
+        self.num_checked += 1
+        self.cycle += 1
+        return result
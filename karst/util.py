@@ -0,0 +1,20 @@
+import importlib
+
+
+class LazyModule:
+    """proxy of a module that is only imported when one of its attributes is
+    used. it keeps heavy dependencies such as z3 out of the simulation path"""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, item):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return getattr(module, item)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
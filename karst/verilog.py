@@ -0,0 +1,717 @@
+from karst.stmt import *
+from karst.model import MemoryModel, Memory
+from karst.codegen import CodeGen, CodeWriter
+from karst.scheduler import BasicScheduler
+from karst.aggregate import Aggregation
+from karst.macro import SRAMMacro
+from karst.backend import get_expr_key, visit_mem_access
+from karst.instrument import timed
+from typing import Dict, List, Set, TextIO, Tuple
+import math
+
+
+class SystemVerilogCodeGen(CodeGen):
+    """synthesizable SystemVerilog. variables and outputs are registers, and
+    the actions are evaluated in order in one always_comb block. an action
+    fires when its EN_ and RDY_ signals are high, and its outputs show up in
+    the next cycle. RDY_ signals the model never assigns are always high.
+    on rst_n the registers take the values of the async reset actions.
+
+    without a scheduler the memory is a register file. with one, every
+    memory, or every bank of the scheduler mapping, is an SRAM macro driven
+    by the schedule state machine: an action fires once per period, in the
+    state of its first memory access, or with the action before it if it
+    has none. the accesses scheduled in later states are latched and issued
+    in their states. a register that takes the SRAM read data can't be read
+    by the action that issues the read.
+
+    if an SRAM word holds several elements, the model is rewritten by
+    aggregate_model and the elements are slices of the SRAM words. the word
+    accesses that serve an access of the model take its state in the
+    schedule of one element per word, so the period stays the same and the
+    SRAM sees fewer accesses"""
+
+    SV_INDENT = 4 * " "
+    MEMORY_NAME = "mem"
+    MACRO_PREFIX = "sram_"
+    STATE_NAME = "state"
+
+    def __init__(self, model: MemoryModel, scheduler: BasicScheduler = None):
+        self._macro = None if scheduler is None else scheduler.sram_macro
+        # elements per SRAM word and their bit width
+        self._num_lanes = 1
+        self._lane_width = 0
+        # (action, access type, address key) of the SRAM accesses of the
+        # rewritten model -> the access of the schedule
+        self._access_keys: Dict[Tuple[str, Memory.MemoryAccessType, object],
+                                Tuple[str, Memory.MemoryAccessType,
+                                      object]] = {}
+        if scheduler is not None and scheduler.get_elements_per_word() > 1:
+            model, scheduler = self.__aggregate(model, scheduler)
+        super().__init__(model)
+        self._scheduler = scheduler
+
+        self._inputs: Dict[str, Variable] = {}
+        self._outputs: Dict[str, Variable] = {}
+        self._registers: Dict[str, Variable] = {}
+        # action -> (EN_ signal, RDY_ register or None)
+        self._handshakes: Dict[str, Tuple[str, Union[str, None]]] = {}
+        # outputs that take the SRAM read data
+        self._mem_outputs: Set[str] = set()
+        # (action, access type, address key) -> SRAM port
+        self._macro_ports: Dict[Tuple[str, Memory.MemoryAccessType, object],
+                                int] = {}
+        # action -> state where it fires
+        self._action_states: Dict[str, int] = {}
+        # id of the statement -> (latch name, (action, access type, address
+        # key), statement, state) of the accesses issued after the action
+        # fires
+        self._deferred: Dict[int, Tuple[str, Tuple[str,
+                                                   Memory.MemoryAccessType,
+                                                   object],
+                                        AssignStatement, int]] = {}
+        # register -> latches of the deferred reads that it takes
+        self._deferred_reads: Dict[str, List[str]] = {}
+        # registers that take the SRAM read data of the action being
+        # generated
+        self._pending_reads: Set[str] = set()
+        # latched registers of the deferred accesses -> bit width
+        self._latches: Dict[str, int] = {}
+        # read -> the earlier writes of the action, which are forwarded to
+        # the read through the wires of the write
+        self._forwards: Dict[Tuple[str, Memory.MemoryAccessType, object],
+                             List[Tuple[str, Memory.MemoryAccessType,
+                                        object]]] = {}
+        self._forward_names: Dict[Tuple[str, Memory.MemoryAccessType,
+                                        object], str] = {}
+        # combinational signals -> bit width
+        self._wires: Dict[str, int] = {}
+        self._num_states = 0
+        # bit width of the values stored in the memory
+        self._data_width = 0
+
+    def __aggregate(self, model: MemoryModel, scheduler: BasicScheduler) \
+            -> Tuple[MemoryModel, BasicScheduler]:
+        """the model with the aggregation buffers, and the schedule of its
+        word accesses"""
+        assert scheduler.mapping is None, \
+            "banked memories with wide SRAM words are not supported"
+        assert self._macro.partial_write, \
+            "wide SRAM words need partial writes"
+        aggregation = Aggregation(model, scheduler)
+        result = aggregation.run()
+        self._access_keys = aggregation.accesses
+        self._num_lanes = scheduler.get_elements_per_word()
+        self._lane_width = max(1, scheduler.data_width)
+        macro = SRAMMacro(self._macro.size * self._num_lanes,
+                          self._lane_width, self._macro.partial_write,
+                          self._macro.num_ports, self._macro.num_en_ports)
+        return result, BasicScheduler(model, macro,
+                                      constraints=scheduler._constraints)
+
+    def get_num_cycles(self) -> int:
+        """cycles of a period of the schedule, where every action fires
+        once"""
+        if self._scheduler is None:
+            return 1
+        return len(self._scheduler.schedule().states)
+
+    @classmethod
+    def _get_indent(cls, indent_num):
+        return indent_num * cls.SV_INDENT
+
+    @classmethod
+    def _get_type(cls, bit_width: int):
+        return "logic" if bit_width == 1 else f"logic [{bit_width - 1}:0]"
+
+    def _code_gen_var(self, var: Variable,
+                      in_func_signature: bool = False) -> str:
+        if not in_func_signature:
+            return var.name
+        return f"{self._get_type(var.bit_width)} {var.name}"
+
+    def _code_gen_var_name(self, var: Value) -> str:
+        if isinstance(var, (Const, Configurable)):
+            return var.eval()
+        assert var.name not in self._pending_reads, \
+            f"{var.name} is read before the SRAM returns the data"
+        if var.name in self._registers:
+            # the actions see the updates of the earlier statements
+            return f"{var.name}_d"
+        return var.name
+
+    def _code_gen_mem_access(self, mem_access: Memory.MemoryAccess) -> str:
+        assert self._scheduler is None, \
+            "SRAM reads have to be assigned to a register"
+        var = self._code_gen_expr(mem_access.var)
+        if self._model._num_memory > 1:
+            index = self._code_gen_mem_index(mem_access)
+            return f"{self.MEMORY_NAME}_d[{index}][{var}]"
+        return f"{self.MEMORY_NAME}_d[{var}]"
+
+    def __collect_signals(self):
+        self._inputs.clear()
+        self._outputs.clear()
+        self._registers.clear()
+        self._handshakes.clear()
+        self._mem_outputs.clear()
+        for port in self._model.get_ports().values():
+            if not isinstance(port, Port):
+                # internal variable used as a port alias
+                continue
+            if port.port_type == PortType.In:
+                self._inputs[port.name] = port
+            else:
+                self._outputs[port.name] = port
+                self._registers[port.name] = port
+        for var in self._model.get_variables().values():
+            self._registers[var.name] = var
+
+        statements = self._model.produce_statements()
+        assigned = set()
+        self._data_width = 0
+        stmts = self._model.get_global_stmts()[:]
+        for action_stmts in statements.values():
+            stmts += action_stmts
+        while stmts:
+            stmt = stmts.pop()
+            if isinstance(stmt, If):
+                stmts += stmt.expressions + stmt.else_expressions
+            elif isinstance(stmt, AssignStatement):
+                if isinstance(stmt.left, Memory.MemoryAccess):
+                    if isinstance(stmt.right, Variable):
+                        self._data_width = max(self._data_width,
+                                               stmt.right.bit_width)
+                    continue
+                assigned.add(stmt.left.name)
+                if isinstance(stmt.right, Memory.MemoryAccess):
+                    self._data_width = max(self._data_width,
+                                           stmt.left.bit_width)
+                    if self._scheduler is not None:
+                        self._mem_outputs.add(stmt.left.name)
+
+        for action_name in statements:
+            en = self._model[f"EN_{action_name}"]
+            rdy = self._model[f"RDY_{action_name}"]
+            # the handshake drives the RDY_ output instead
+            self._outputs.pop(f"RDY_{action_name}", None)
+            rdy_name = rdy.name if rdy.name in assigned else None
+            if rdy_name is None:
+                self._registers.pop(rdy.name, None)
+            self._handshakes[action_name] = (en.name, rdy_name)
+
+    def __collect_schedule(self):
+        self._macro_ports.clear()
+        self._action_states.clear()
+        self._deferred.clear()
+        self._deferred_reads.clear()
+        self._latches.clear()
+        self._forwards.clear()
+        self._forward_names.clear()
+        self._wires.clear()
+        if self._scheduler is None:
+            self._num_states = 0
+            return
+        mapping = self._scheduler.mapping
+        assert mapping is None or self._model._num_memory == 1, \
+            "a bank mapping needs a single memory"
+        bank_size = self._model.memory_size.eval() // \
+            (self._model._num_memory * self.__get_num_banks())
+        assert bank_size <= self._macro.size, \
+            f"{bank_size} words don't fit in the SRAM macro"
+        schedule = self._scheduler.schedule()
+        self._num_states = len(schedule.states)
+        # the first state of every access
+        states = {}
+        for state in schedule.states:
+            for a in state.accesses:
+                key = (a.action, a.access_type, get_expr_key(a.access))
+                if key not in states:
+                    states[key] = state.state_value
+                    self._macro_ports[key] = a.port
+        for action_name, stmts in self._model.produce_statements().items():
+            # accesses in statement order
+            accesses = []
+            for stmt in self.__flatten(stmts):
+                for access, access_type in visit_mem_access(stmt):
+                    key = self.__get_key(action_name, access_type, access)
+                    assert key in states, \
+                        f"{access} of {action_name} is not scheduled"
+                    accesses.append((key, access, stmt))
+            if not accesses:
+                # fire once per period, after the actions before it
+                self._action_states[action_name] = max(
+                    list(self._action_states.values()) + [0])
+                continue
+            fire_state = min([states[key] for key, _, _ in accesses])
+            self._action_states[action_name] = fire_state
+            writes = []
+            for key, access, stmt in accesses:
+                if key[1] == Memory.MemoryAccessType.Write:
+                    writes.append(key)
+                elif writes:
+                    # the SRAM can't see the earlier writes of the action
+                    self._forwards[key] = writes[:]
+                    for write in writes:
+                        self.__forward(write)
+                if states[key] != fire_state:
+                    self.__defer(key, access, stmt, states[key])
+            for idx, (key, _, _) in enumerate(accesses):
+                if key[1] == Memory.MemoryAccessType.Read:
+                    for write, _, _ in accesses[idx + 1:]:
+                        assert states[write] >= states[key], \
+                            f"{action_name} writes the memory before it " \
+                            f"reads it"
+
+    def __get_key(self, action_name: str,
+                  access_type: Memory.MemoryAccessType,
+                  access: Memory.MemoryAccess):
+        key = (action_name, access_type, get_expr_key(access.var))
+        # the word accesses take the slots of the accesses they serve
+        return self._access_keys.get(key, key)
+
+    @classmethod
+    def __flatten(cls, stmts: List[Statement]) -> List[Statement]:
+        result = []
+        for stmt in stmts:
+            if isinstance(stmt, If):
+                result += cls.__flatten(stmt.expressions +
+                                        stmt.else_expressions)
+            else:
+                result.append(stmt)
+        return result
+
+    def __forward(self, key):
+        if key in self._forward_names:
+            return
+        # the aggregation buffers forward the writes to the reads
+        assert self._num_lanes == 1, \
+            "forwarding of the SRAM words is not supported"
+        name = f"{key[0]}_forward{len(self._forward_names)}"
+        self._forward_names[key] = name
+        self._wires[f"{name}_en"] = 1
+        self._wires[f"{name}_addr"] = self.__get_addr_width()
+        self._wires[f"{name}_data"] = max(1, self._data_width)
+        if self._model._num_memory > 1:
+            self._wires[f"{name}_mem"] = self.__get_mem_width()
+
+    def __get_addr_width(self):
+        return max(1, math.ceil(math.log2(self._model.memory_size.eval())))
+
+    def __get_mem_width(self):
+        return max(1, math.ceil(math.log2(self._model._num_memory)))
+
+    def __defer(self, key, access: Memory.MemoryAccess,
+                stmt: AssignStatement, state: int):
+        action_name, access_type, _ = key
+        is_read = access_type == Memory.MemoryAccessType.Read
+        name = f"{action_name}_{'read' if is_read else 'write'}" \
+               f"{len(self._deferred)}"
+        self._deferred[id(stmt)] = (name, key, stmt, state)
+        if is_read:
+            self._deferred_reads.setdefault(stmt.left.name, []).append(name)
+        self._latches[f"{name}_valid"] = 1
+        self._latches[f"{name}_addr"] = self.__get_addr_width()
+        if not is_read:
+            self._latches[f"{name}_data"] = max(1, self._data_width)
+        if isinstance(self._get_mem_index(access), Value):
+            self._latches[f"{name}_mem"] = self.__get_mem_width()
+
+    def __get_num_banks(self) -> int:
+        mapping = self._scheduler.mapping
+        return 1 if mapping is None else mapping.num_banks
+
+    def __get_num_memories(self) -> int:
+        # the lanes of a word are the memories of the rewritten model
+        return self._model._num_memory // self._num_lanes
+
+    def __get_num_macros(self) -> int:
+        return self.__get_num_memories() * self.__get_num_banks()
+
+    def __get_prefix(self, macro_index: int) -> str:
+        if self.__get_num_macros() == 1:
+            return self.MACRO_PREFIX
+        return f"{self.MACRO_PREFIX[:-1]}{macro_index}_"
+
+    def __get_macro_signals(self, port: int) -> Tuple[int, int]:
+        """enable/data index and address index of an SRAM port. a macro with
+        one enable has a read port and a write port that share it"""
+        return min(port, self._macro.num_en_ports - 1), port
+
+    @timed("code_gen")
+    def code_gen_to_stream(self, sink: TextIO):
+        self.__collect_signals()
+        self.__collect_schedule()
+        w = self._get_writer(sink)
+
+        w.line(f"module {self._model.model_name} (")
+        ports = ["input logic clk", "input logic rst_n"]
+        ports += [f"input {self._code_gen_var(var, True)}"
+                  for var in self._inputs.values()]
+        ports += [f"output {self._code_gen_var(var, True)}"
+                  for var in self._outputs.values()]
+        ports += [f"output logic RDY_{action_name}"
+                  for action_name in self._handshakes]
+        with w.indent():
+            for idx, port in enumerate(ports):
+                w.line(port + ("," if idx != len(ports) - 1 else ""))
+        w.line(");")
+        w.line()
+
+        with w.indent():
+            self._code_gen_declarations(w)
+            w.line()
+            self._code_gen_assigns(w)
+            w.line()
+            self._code_gen_comb(w)
+            w.line()
+            self._code_gen_ff(w)
+        w.line("endmodule")
+
+    def _code_gen_declarations(self, w: CodeWriter):
+        for name, var in self._registers.items():
+            w.line(f"{self._get_type(var.bit_width)} {name}_q, {name}_d;")
+        for name in self._mem_outputs:
+            w.line(f"{self._get_type(self.__get_src_width())} {name}_src_q, "
+                   f"{name}_src_d;")
+        for var in self.__get_mem_variables():
+            # the value seen by the actions, same as the outputs
+            w.line(f"{self._get_type(var.bit_width)} {var.name};")
+        for name, width in self._latches.items():
+            w.line(f"{self._get_type(width)} {name}_q, {name}_d;")
+        for name, width in self._wires.items():
+            w.line(f"{self._get_type(width)} {name};")
+        if self._scheduler is None:
+            self._code_gen_memory(w)
+        else:
+            self._code_gen_macro(w)
+
+    def __get_mem_variables(self) -> List[Variable]:
+        """variables that take the SRAM read data"""
+        return [var for name, var in self._registers.items()
+                if name in self._mem_outputs and name not in self._outputs]
+
+    def __get_src_width(self):
+        # 0 for the register, (m * num_en_ports + i) * num_lanes + l + 1 for
+        # the element l of the data out of port i of macro m
+        num_en_ports = self._macro.num_en_ports
+        return max(1, math.ceil(math.log2(
+            self.__get_num_macros() * num_en_ports * self._num_lanes + 1)))
+
+    def __get_state_width(self):
+        return max(1, math.ceil(math.log2(self._num_states)))
+
+    def _code_gen_memory(self, w: CodeWriter):
+        size = self._model.memory_size.eval()
+        t = self._get_type(max(1, self._data_width))
+        num_memory = self._model._num_memory
+        if num_memory > 1:
+            bank_size = size // num_memory
+            w.line(f"{t} {self.MEMORY_NAME}_q [{num_memory}][{bank_size}], "
+                   f"{self.MEMORY_NAME}_d [{num_memory}][{bank_size}];")
+        else:
+            w.line(f"{t} {self.MEMORY_NAME}_q [{size}], "
+                   f"{self.MEMORY_NAME}_d [{size}];")
+
+    def _get_macro_name(self):
+        macro = self._macro
+        return f"sram_{macro.num_ports}p_{macro.size}x{macro.port_size}"
+
+    def _code_gen_macro(self, w: CodeWriter):
+        macro_ports = self._macro.get_ports()
+        for macro_index in range(self.__get_num_macros()):
+            p = self.__get_prefix(macro_index)
+            for name, width in macro_ports.items():
+                w.line(f"{self._get_type(width)} {p}{name};")
+        w.line(f"{self._get_type(self.__get_state_width())} "
+               f"{self.STATE_NAME}_q, {self.STATE_NAME}_d;")
+        for macro_index in range(self.__get_num_macros()):
+            p = self.__get_prefix(macro_index)
+            w.line()
+            w.line(f"{self._get_macro_name()} {p}macro (")
+            with w.indent():
+                connections = [".clk(clk)"] + \
+                    [f".{name}({p}{name})" for name in macro_ports]
+                for idx, connection in enumerate(connections):
+                    w.line(connection + ("," if idx != len(connections) - 1
+                                         else ""))
+            w.line(");")
+
+    def __get_ready(self, action_name: str, suffix: str) -> List[str]:
+        _, rdy = self._handshakes[action_name]
+        ready = [f"{rdy}_{suffix}"] if rdy is not None else []
+        if action_name in self._action_states:
+            state = self._action_states[action_name]
+            ready.append(f"({self.STATE_NAME}_q == {state})")
+        return ready
+
+    def __code_gen_read_data(self, name: str) -> str:
+        """the SRAM read data the register takes, or the register"""
+        value = f"{name}_q"
+        num_en_ports = self._macro.num_en_ports
+        for macro_index in reversed(range(self.__get_num_macros())):
+            p = self.__get_prefix(macro_index)
+            for idx in reversed(range(num_en_ports)):
+                for lane in reversed(range(self._num_lanes)):
+                    src = (macro_index * num_en_ports + idx) * \
+                        self._num_lanes + lane + 1
+                    data = f"{p}data_out{idx}{self.__get_slice(lane)}"
+                    value = f"({name}_src_q == {src}) ? {data} : {value}"
+        return value
+
+    def __get_slice(self, lane: Union[int, Value]) -> str:
+        """bits of the element in the SRAM word"""
+        if self._num_lanes == 1:
+            return ""
+        if isinstance(lane, Value):
+            lsb = f"{self.__code_gen_operand(lane)} * {self._lane_width}"
+        else:
+            lsb = str(lane * self._lane_width)
+        return f"[{lsb} +: {self._lane_width}]"
+
+    def _code_gen_assigns(self, w: CodeWriter):
+        for name in self._outputs:
+            if name in self._mem_outputs:
+                w.line(f"assign {name} = {self.__code_gen_read_data(name)};")
+            else:
+                w.line(f"assign {name} = {name}_q;")
+        for var in self.__get_mem_variables():
+            w.line(f"assign {var.name} = "
+                   f"{self.__code_gen_read_data(var.name)};")
+        for action_name in self._handshakes:
+            ready = " && ".join(self.__get_ready(action_name, "q")) or "1'b1"
+            w.line(f"assign RDY_{action_name} = {ready};")
+
+    def _code_gen_comb(self, w: CodeWriter):
+        w.line("always_comb begin")
+        with w.indent():
+            for name in self._registers:
+                # outputs that hold the SRAM read data keep it
+                current = name if name in self._mem_outputs else f"{name}_q"
+                w.line(f"{name}_d = {current};")
+            for name in self._mem_outputs:
+                w.line(f"{name}_src_d = 0;")
+            for name in self._latches:
+                w.line(f"{name}_d = {name}_q;")
+            for name in self._wires:
+                w.line(f"{name} = 0;")
+            if self._scheduler is None:
+                w.line(f"{self.MEMORY_NAME}_d = {self.MEMORY_NAME}_q;")
+            else:
+                for macro_index in range(self.__get_num_macros()):
+                    p = self.__get_prefix(macro_index)
+                    for name in self._macro.get_ports():
+                        if not name.startswith("data_out"):
+                            w.line(f"{p}{name} = 0;")
+                last_state = self._num_states - 1
+                w.line(f"{self.STATE_NAME}_d = ({self.STATE_NAME}_q == "
+                       f"{last_state}) ? 0 : {self.STATE_NAME}_q + 1;")
+                self._code_gen_deferred(w)
+            global_stmts = self._model.get_global_stmts()
+            for action_name, stmts in \
+                    self._model.produce_statements().items():
+                en, _ = self._handshakes[action_name]
+                fire = " && ".join([en] + self.__get_ready(action_name, "d"))
+                w.line(f"if ({fire}) begin")
+                self._pending_reads.clear()
+                with w.indent():
+                    for stmt in stmts + global_stmts:
+                        self._code_gen_stmts(w, stmt, action_name)
+                self._pending_reads.clear()
+                w.line("end")
+        w.line("end")
+
+    def _code_gen_stmts(self, w: CodeWriter, stmt: Statement,
+                        action_name: str):
+        if isinstance(stmt, If):
+            predicate = self._code_gen_expr(stmt.predicate)
+            w.line(f"if ({predicate}) begin")
+            with w.indent():
+                for stmt_ in stmt.expressions:
+                    self._code_gen_stmts(w, stmt_, action_name)
+            if stmt.else_expressions:
+                w.line("end else begin")
+                with w.indent():
+                    for stmt_ in stmt.else_expressions:
+                        self._code_gen_stmts(w, stmt_, action_name)
+            w.line("end")
+        elif isinstance(stmt, ReturnStatement):
+            # the values are already on the output ports
+            pass
+        else:
+            assert isinstance(stmt, AssignStatement)
+            if isinstance(stmt.left, Port) and \
+                    stmt.left.port_type == PortType.In:
+                # inputs are driven from outside the module
+                return
+            if self._scheduler is not None:
+                self._code_gen_macro_assign(w, stmt, action_name)
+            else:
+                content = self._code_gen_assign(stmt, eq="=")
+                w.line(f"{content};")
+
+    def _code_gen_macro_assign(self, w: CodeWriter, stmt: AssignStatement,
+                               action_name: str):
+        if isinstance(stmt.left, Memory.MemoryAccess):
+            access, access_type = stmt.left, Memory.MemoryAccessType.Write
+        elif isinstance(stmt.right, Memory.MemoryAccess):
+            access, access_type = stmt.right, Memory.MemoryAccessType.Read
+        else:
+            name = stmt.left.name
+            w.line(f"{name}_d = {self._code_gen_expr(stmt.right)};")
+            if name in self._mem_outputs:
+                w.line(f"{name}_src_d = 0;")
+            # the value is newer than the data of the latched reads
+            for latch in self._deferred_reads.get(name, []):
+                w.line(f"{latch}_valid_d = 0;")
+            return
+        key = self.__get_key(action_name, access_type, access)
+        index = self._get_mem_index(access)
+        if key in self._forward_names:
+            name = self._forward_names[key]
+            w.line(f"{name}_en = 1;")
+            w.line(f"{name}_addr = {self._code_gen_expr(access.var)};")
+            w.line(f"{name}_data = {self._code_gen_expr(stmt.right)};")
+            if self._model._num_memory > 1:
+                w.line(f"{name}_mem = {self.__code_gen_index(index)};")
+        deferred = self._deferred.get(id(stmt), None)
+        if deferred is None:
+            self.__code_gen_macro_access(w, stmt, self._macro_ports[key],
+                                         index, access.var, stmt.right)
+        else:
+            # latch the access for its own state
+            name = deferred[0]
+            w.line(f"{name}_valid_d = 1;")
+            w.line(f"{name}_addr_d = {self._code_gen_expr(access.var)};")
+            if access_type == Memory.MemoryAccessType.Write:
+                w.line(f"{name}_data_d = {self._code_gen_expr(stmt.right)};")
+            if isinstance(index, Value):
+                w.line(f"{name}_mem_d = {self._code_gen_expr(index)};")
+        for write in self._forwards.get(key, []):
+            # the latest write to the same address wins
+            name = self._forward_names[write]
+            addr = self.__code_gen_operand(access.var)
+            conditions = [f"{name}_en", f"({name}_addr == {addr})"]
+            if self._model._num_memory > 1:
+                conditions.append(f"({name}_mem == "
+                                  f"{self.__code_gen_index(index)})")
+            w.line(f"if ({' && '.join(conditions)}) begin")
+            with w.indent():
+                w.line(f"{stmt.left.name}_d = {name}_data;")
+                w.line(f"{stmt.left.name}_src_d = 0;")
+                if deferred is not None:
+                    w.line(f"{deferred[0]}_valid_d = 0;")
+            w.line("end")
+        if access_type == Memory.MemoryAccessType.Read:
+            self._pending_reads.add(stmt.left.name)
+
+    def __code_gen_index(self, index: Union[int, Value]) -> str:
+        return self.__code_gen_operand(index) if isinstance(index, Value) \
+            else str(index)
+
+    def __code_gen_operand(self, value: Value) -> str:
+        # the comparisons bind tighter than the bitwise operators
+        result = self._code_gen_expr(value)
+        return f"({result})" if isinstance(value, Expression) else result
+
+    def _code_gen_deferred(self, w: CodeWriter):
+        for name, key, stmt, state in self._deferred.values():
+            _, access_type, _ = key
+            access = stmt.left if access_type == \
+                Memory.MemoryAccessType.Write else stmt.right
+            w.line(f"if ({name}_valid_q && ({self.STATE_NAME}_q == "
+                   f"{state})) begin")
+            with w.indent():
+                index = self._get_mem_index(access)
+                if isinstance(index, Value):
+                    index = self.__get_latch(f"{name}_mem")
+                addr = self.__get_latch(f"{name}_addr")
+                data = self.__get_latch(f"{name}_data") if \
+                    access_type == Memory.MemoryAccessType.Write else None
+                self.__code_gen_macro_access(w, stmt, self._macro_ports[key],
+                                             index, addr, data)
+                w.line(f"{name}_valid_d = 0;")
+            w.line("end")
+
+    def __get_latch(self, name: str) -> Variable:
+        # only used to generate the name of the latched value
+        return Variable(f"{name}_q", self._latches[name], None)
+
+    def __code_gen_macro_access(self, w: CodeWriter, stmt: AssignStatement,
+                                port: int, index: Union[int, Value],
+                                addr: Value, data: Value):
+        """drive the SRAM port of the macro that holds the address"""
+        en, addr_port = self.__get_macro_signals(port)
+        is_write = isinstance(stmt.left, Memory.MemoryAccess)
+        mapping = self._scheduler.mapping
+        num_banks = self.__get_num_banks()
+        offset = addr if num_banks == 1 else mapping.get_offset_expr(addr)
+        # the memories of the rewritten model are the elements of the word
+        lane = index if self._num_lanes > 1 else 0
+        index = 0 if self._num_lanes > 1 else index
+        for mem_index in range(self.__get_num_memories()):
+            if not isinstance(index, Value) and index != mem_index:
+                continue
+            for bank in range(num_banks):
+                macro_index = mem_index * num_banks + bank
+                p = self.__get_prefix(macro_index)
+                conditions = []
+                if isinstance(index, Value):
+                    conditions.append(f"({self.__code_gen_operand(index)} "
+                                      f"== {mem_index})")
+                if num_banks > 1:
+                    bank_expr = mapping.get_bank_expr(addr)
+                    conditions.append(f"({self.__code_gen_operand(bank_expr)}"
+                                      f" == {bank})")
+                if conditions:
+                    w.line(f"if ({' && '.join(conditions)}) begin")
+                    w.level += 1
+                w.line(f"{p}addr{addr_port} = "
+                       f"{self._code_gen_expr(offset)};")
+                element = self.__get_slice(lane)
+                if is_write:
+                    w.line(f"{p}wen{en} = 1;")
+                    if self._macro.partial_write:
+                        # the whole word, or the bits of the element
+                        w.line(f"{p}wenb{en}{element} = '1;")
+                    w.line(f"{p}data_in{en}{element} = "
+                           f"{self._code_gen_expr(data)};")
+                else:
+                    src = (macro_index * self._macro.num_en_ports + en) * \
+                        self._num_lanes + 1
+                    if isinstance(lane, Value):
+                        src = f"{src} + {self.__code_gen_operand(lane)}"
+                    else:
+                        src += lane
+                    w.line(f"{p}ren{en} = 1;")
+                    w.line(f"{stmt.left.name}_src_d = {src};")
+                if conditions:
+                    w.level -= 1
+                    w.line("end")
+
+    def _code_gen_ff(self, w: CodeWriter):
+        registers = list(self._registers.keys()) + \
+                    [f"{name}_src" for name in self._mem_outputs] + \
+                    list(self._latches.keys())
+        if self._scheduler is not None:
+            registers.append(self.STATE_NAME)
+        values = self._model.get_reset_values()
+        w.line("always_ff @(posedge clk, negedge rst_n) begin")
+        with w.indent():
+            w.line("if (!rst_n) begin")
+            with w.indent():
+                for name in registers:
+                    w.line(f"{name}_q <= {values.get(name, 0)};")
+            w.line("end else begin")
+            with w.indent():
+                for name in registers:
+                    w.line(f"{name}_q <= {name}_d;")
+            w.line("end")
+        w.line("end")
+        if self._scheduler is None:
+            # the register file is not reset
+            w.line()
+            w.line("always_ff @(posedge clk) begin")
+            with w.indent():
+                w.line(f"{self.MEMORY_NAME}_q <= {self.MEMORY_NAME}_d;")
+            w.line("end")
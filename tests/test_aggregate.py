@@ -0,0 +1,173 @@
+from karst.aggregate import *
+from karst.scheduler import BasicScheduler
+from karst.macro import SRAMMacro
+from karst.basic import define_fifo
+import random
+import pytest
+
+
+READ = Memory.MemoryAccessType.Read
+WRITE = Memory.MemoryAccessType.Write
+
+
+def test_wide_word_fifo():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    # four 16-bit elements per word
+    scheduler = BasicScheduler(fifo, SRAMMacro(1 << 4, 64))
+    mem = WideWordMemory.from_scheduler(scheduler, 64)
+    assert mem.word_size == 4
+    assert mem.read_streams["read_addr"].spacing == 1
+
+    rnd = random.Random(0)
+    ref = []
+    read_addr = 0
+    write_addr = 0
+    num_cycles = 1000
+    num_accesses = 0
+    for _ in range(num_cycles):
+        if rnd.randint(0, 1) and write_addr - read_addr < 32:
+            value = rnd.randrange(1 << 16)
+            mem.write("write_addr", write_addr, value)
+            ref.append(value)
+            write_addr += 1
+        if rnd.randint(0, 1) and read_addr < write_addr:
+            assert mem.read("read_addr", read_addr) == ref[read_addr]
+            read_addr += 1
+        accesses = mem.pop_accesses()
+        num_accesses += len(accesses)
+    # the wide single-port macro keeps up with one read and one write
+    # every cycle
+    assert num_accesses < num_cycles
+    assert num_accesses < (read_addr + write_addr) // 2
+
+
+def test_wide_word_coherence():
+    streams = [StreamConfig("seq_write", WRITE, 1),
+               StreamConfig("seq_read", READ, 1),
+               StreamConfig("rand_write", WRITE, None),
+               StreamConfig("rand_read", READ, None)]
+    mem = WideWordMemory(32, 4, streams)
+    ref = [0 for _ in range(32)]
+    rnd = random.Random(42)
+    seq_write = 0
+    seq_read = 0
+    for _ in range(2000):
+        op = rnd.randrange(4)
+        if op == 0:
+            value = rnd.randrange(100)
+            mem.write("seq_write", seq_write, value)
+            ref[seq_write % 32] = value
+            seq_write += 1
+        elif op == 1:
+            assert mem.read("seq_read", seq_read) == ref[seq_read % 32]
+            seq_read += 1
+        elif op == 2:
+            addr = rnd.randrange(32)
+            value = rnd.randrange(100)
+            mem.write("rand_write", addr, value)
+            ref[addr] = value
+        else:
+            addr = rnd.randrange(32)
+            assert mem.read("rand_read", addr) == ref[addr]
+    mem.flush()
+    for addr in range(32):
+        assert mem.read("rand_read", addr) == ref[addr]
+
+
+def pop_accesses(mem: WideWordMemory):
+    # the stream, the data and the tag are checked by the simulator
+    return [access._replace(stream="", data=(), tag=0)
+            for access in mem.pop_accesses()]
+
+
+def test_wide_word_accesses():
+    mem = WideWordMemory(16, 4, [StreamConfig("w", WRITE, 1),
+                                 StreamConfig("r", READ, 1)])
+    for i in range(4):
+        mem.write("w", i, i)
+    # one full word write
+    assert pop_accesses(mem) == [SRAMAccess(WRITE, 0)]
+    mem.write("w", 4, 4)
+    mem.flush()
+    assert pop_accesses(mem) == [SRAMAccess(WRITE, 1, (0,))]
+    assert mem.read("r", 0) == 0
+    # the demand fetch and the prefetch of the next word
+    assert pop_accesses(mem) == [SRAMAccess(READ, 0),
+                                 SRAMAccess(READ, 1, prefetch=True)]
+    for i in range(1, 5):
+        assert mem.read("r", i) == i
+    assert pop_accesses(mem) == [SRAMAccess(READ, 2, prefetch=True)]
+
+
+@pytest.mark.parametrize("prefetch_depth", [1, 2, 3])
+def test_wide_word_prefetch_depth(prefetch_depth):
+    mem = WideWordMemory(16, 4, [StreamConfig("r", READ, 1)],
+                         prefetch_depth)
+    mem.load(list(range(16)))
+    for i in range(32):
+        assert mem.read("r", i) == i % 16
+    accesses = pop_accesses(mem)
+    # every word is read once per pass, the word in use is never evicted
+    assert [access.word_addr for access in accesses] == \
+        [i % 4 for i in range(len(accesses))]
+    if prefetch_depth == 1:
+        assert len(accesses) == 8
+        assert not any([access.prefetch for access in accesses])
+    else:
+        # plus the prefetch of the word after the last one
+        assert len(accesses) == 9
+
+
+def get_aggregate_stimuli(name, rnd):
+    if name == "sram":
+        actions = rnd.sample(["read", "write"], rnd.randint(0, 2))
+        return [(action, {"addr": rnd.randrange(64),
+                          "data_in": rnd.randrange(1 << 16)})
+                for action in actions]
+    elif name == "fifo":
+        actions = rnd.sample(["enqueue", "dequeue"], rnd.randint(0, 2))
+    else:
+        actions = ["enqueue"] if rnd.randint(0, 3) else []
+    return [(action, {"data_in": rnd.randrange(1 << 16)})
+            for action in actions]
+
+
+@pytest.mark.parametrize("name, config", [
+    ("sram", {}),
+    ("fifo", {"capacity": 32}),
+    ("line_buffer", {"depth": 8, "num_rows": 3})])
+@pytest.mark.parametrize("port_size", [32, 64, 128])
+def test_aggregate_model(name, config, port_size):
+    from karst import basic
+    define = getattr(basic, f"define_{name}")
+    ref = define()
+    model = define()
+    for m in (ref, model):
+        m.configure(memory_size=64, **config)
+    scheduler = BasicScheduler(model, SRAMMacro(16, port_size))
+    result = aggregate_model(model, scheduler)
+    num_lanes = port_size // 16
+    assert len(result._mem) == num_lanes
+    assert result.memory_size.eval() == 64
+    if name != "sram":
+        # linear streams are buffered
+        assert "agg0_mask" in result
+        assert "tb0_valid" in result and "pf0_valid" in result
+    else:
+        assert "agg0_mask" not in result and "tb0_valid" not in result
+
+    rnd = random.Random(port_size)
+    ref.reset()
+    result.reset()
+    for _ in range(2000):
+        stimuli = get_aggregate_stimuli(name, rnd)
+        outputs = []
+        for m in (ref, result):
+            values = []
+            for action, ports in stimuli:
+                for port_name, value in ports.items():
+                    setattr(m, port_name, value)
+                values.append(m[action]())
+            outputs.append(values)
+        assert outputs[0] == outputs[1]
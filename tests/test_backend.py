@@ -1,7 +1,10 @@
 from karst.backend import *
+from karst.backend import _get_canonical_key
+from karst.model import define_memory
 import pytest
 
-from karst.basic import define_sram, define_fifo, define_line_buffer
+from karst.basic import define_sram, define_fifo, define_line_buffer, \
+    define_double_buffer
 
 
 def test_exclusive_expression():
@@ -170,3 +173,208 @@ def test_lb_update_states():
     updates = get_state_updates(stmts)
     variable_update = get_updated_variables(updates)
     assert len(variable_update) == 2
+
+
+def test_sym_expr_cache():
+    clear_cache()
+    parent = MemoryModel()
+    a = parent.Variable("a", 16)
+    c = parent.Configurable("c", 16, 4)
+    symbol_table = {}
+    exp1 = construct_sym_expr_tree((a + 1) * c, symbol_table)
+    assert list(symbol_table.keys()) == ["a"]
+    # structurally the same expression shares the same term
+    exp2 = construct_sym_expr_tree((a + 1) * c, {})
+    assert exp1 is exp2
+    # configurables are folded into the key
+    c(5)
+    exp3 = construct_sym_expr_tree((a + 1) * c, {})
+    assert exp3 is not exp1
+
+    assert get_linear_spacing(a + 4, a + 1, a + 7) == (True, 3)
+    assert get_linear_spacing(a + 4, a + 1, a + 7) == (True, 3)
+    info = cache_info()["_get_linear_spacing"]
+    assert info.hits == 1 and info.misses == 1
+    clear_cache()
+    assert cache_info()["_get_linear_spacing"].currsize == 0
+    # the caches don't grow without bound
+    for info in cache_info().values():
+        assert info.maxsize == CACHE_SIZE
+
+
+def test_affine_form():
+    parent = MemoryModel()
+    a = parent.Variable("a", 16)
+    b = parent.Variable("b", 16)
+    c = parent.Configurable("c", 16, 4)
+
+    assert get_affine_form(a) == ({"a": 1}, 0)
+    assert get_affine_form(Const(3)) == ({}, 3)
+    assert get_affine_form((a + 1) * c - (b << 1) + 2) == \
+        ({"a": 4, "b": -2}, 6)
+    # cancelled variables are removed
+    assert get_affine_form(a - a + 1) == ({}, 1)
+    # non-affine expressions
+    assert get_affine_form(a * b) is None
+    assert get_affine_form(a % c) is None
+    assert get_affine_form(Const(1) << a) is None
+
+
+def test_linear_spacing_non_affine():
+    parent = MemoryModel()
+    a = parent.Variable("a", 16)
+    # z3 is used to simplify these
+    assert get_linear_spacing(a * a, a * a + 2, a * a + 4) == (True, 2)
+    assert not get_linear_spacing(a * a, a * 2)[0]
+
+
+def test_loop_counters():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    statements = fifo.produce_statements()
+    counters = get_loop_counters(statements["enqueue"])
+    assert counters == [LoopCounter("write_addr", 1, 64)]
+    assert counters[0].extent == 64
+    assert not get_loop_counters(statements["reset"])
+
+
+def test_multi_variable_access_pattern():
+    db = define_double_buffer()
+    db.configure(memory_size=1024, threshold=512, ext_chin=4, off_x=3,
+                 off_y=3, ext_chout=2, ext_x=8, bound_ch=4, bound_x=10,
+                 stride=1)
+    statements = db.produce_statements()
+    stmts = statements["read"]
+    counters = get_loop_counters(stmts)
+    assert [c.name for c in counters] == ["cin_off", "x_off", "y_off",
+                                          "cout_off", "x_iter", "y_iter"]
+    assert [c.extent for c in counters] == [4, 3, 3, 2, 8, None]
+    definitions = get_definitions(stmts + db.get_global_stmts())
+    assert "read_addr" in definitions
+    pattern = get_access_pattern(db.read_addr, counters, definitions)
+    assert pattern is not None
+    assert [d.stride for d in pattern.dims] == [1, 4, 40, 0, 4, 40]
+    assert pattern.spacing == 1 and pattern.burst == 4
+
+    # compare with the functional model
+    db.reset()
+    addresses = []
+    for _ in range(500):
+        db.read()
+        addresses.append(db.read_addr.eval())
+    assert pattern.get_addresses(501)[1:] == addresses
+
+    # without the counters the address is unknown
+    assert get_access_pattern(db.read_addr, [], definitions) is None
+
+
+def test_address_variable():
+    parent = MemoryModel(64)
+    a = parent.Variable("a", 16)
+    b = parent.Variable("b", 8)
+    parent.Variable("c", 16)
+    parent[a + b * 4] = parent.c
+    parent[a + b * 4 + 1] = parent.c
+    parent.c = parent[a]
+    access = [visit_mem_access(stmt)[0] for stmt in parent.context]
+    var_access = get_var_memory_access(access)
+    assert len(var_access) == 2
+    assert a in var_access
+    # both writes share the same base address
+    address_vars = [v for v in var_access if isinstance(v, AddressVariable)]
+    assert len(address_vars) == 1
+    exps = [exp for exp, _ in var_access[address_vars[0]]]
+    assert len(exps) == 2
+    assert get_linear_spacing(*exps) == (True, 1)
+
+
+def test_state_update_duplicates():
+    model = MemoryModel(64)
+    a = model.Variable("a", 16)
+    b = model.Variable("b", 16)
+    model.If(a > 1, a(a + 1), b(a)).Else(a(a + 1))
+    model.If(a > 2, b(0)).Else(b(a))
+    stmts = model.context[:]
+    updates = get_state_updates(stmts)
+    assert len(updates) == 3
+    assert [get_stmt_key(s) for s in updates] == \
+        [("assign", "a", (operator.add, "a", 1)), ("assign", "b", "a"),
+         ("assign", "b", 0)]
+    # memory accesses are part of the key
+    model[a] = b
+    model[b] = b
+    model[a] = b
+    keys = [get_stmt_key(s) for s in model.context[-3:]]
+    assert keys[0] == keys[2] and keys[0] != keys[1]
+
+
+def test_exclusivity_analysis():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=4)
+    analysis = ExclusivityAnalysis(fifo)
+    matrix = analysis.get_matrix()
+    assert not matrix[("enqueue", "dequeue")]
+    # with one entry the fifo can't be both ready to enqueue and dequeue
+    fifo.configure(memory_size=64, capacity=1)
+    analysis = ExclusivityAnalysis(fifo)
+    assert analysis.is_exclusive("enqueue", "dequeue")
+    assert analysis.get_matrix()[("dequeue", "enqueue")]
+
+    # external constraints on the enable ports
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    analysis = ExclusivityAnalysis(sram)
+    assert not analysis.is_exclusive("read", "write")
+    analysis = ExclusivityAnalysis(sram, [sram.wen + sram.ren <= 1])
+    assert analysis.is_exclusive("read", "write")
+
+
+def test_exclusivity_if_predicates():
+    @define_memory
+    def define_mem():
+        mem = MemoryModel(8)
+        mem.Variable("a", 16)
+        mem.Variable("b", 16)
+
+        @mem.action()
+        def foo():
+            if mem.a > 5:
+                mem.b = 1
+            if mem.a < 3:
+                mem.b = 2
+            if mem.a < 7:
+                mem.b = 3
+
+        return mem
+
+    model = define_mem()
+    analysis = ExclusivityAnalysis(model)
+    assert analysis.names == ["foo", "foo.if0", "foo.if1", "foo.if2"]
+    matrix = analysis.get_matrix(["foo.if0", "foo.if1", "foo.if2"])
+    assert matrix[("foo.if0", "foo.if1")]
+    assert not matrix[("foo.if0", "foo.if2")]
+    assert not matrix[("foo.if1", "foo.if2")]
+
+
+def test_model_fingerprint():
+    lb1 = define_line_buffer()
+    lb1.configure(memory_size=16, num_rows=4, depth=4)
+    lb2 = define_line_buffer()
+    lb2.configure(memory_size=16, num_rows=4, depth=4)
+    assert get_model_fingerprint(lb1) == get_model_fingerprint(lb2)
+    lb2.configure(memory_size=16, num_rows=2, depth=4)
+    assert get_model_fingerprint(lb1) != get_model_fingerprint(lb2)
+    fifo = define_fifo()
+    assert get_model_fingerprint(fifo) != get_model_fingerprint(lb1)
+
+
+def test_dump_statements():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=4)
+    stmts = fifo.produce_statements()
+    loaded = load_statements(dump_statements(fifo, stmts))
+    # memories are identified by the order they are accessed
+    for name, action_stmts in stmts.items():
+        assert _get_canonical_key(tuple(map(get_stmt_key, loaded[name])),
+                                  {}) == \
+            _get_canonical_key(tuple(map(get_stmt_key, action_stmts)), {})
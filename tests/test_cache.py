@@ -0,0 +1,79 @@
+from karst.cache import *
+from karst.scheduler import *
+from karst.basic import *
+from karst.backend import ExclusivityAnalysis, get_expr_key
+import os
+
+
+def test_analysis_cache(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    assert cache.get("foo") is None
+    cache.set("foo", {"bar": 42})
+    assert "foo" in cache
+    assert cache.get("foo") == {"bar": 42}
+    assert cache.hits == 1 and cache.misses == 1
+    # entries from other versions are not visible
+    assert os.path.basename(cache.path) == f"v{CACHE_VERSION}"
+    # corrupted entries are treated as a miss
+    with open(os.path.join(cache.path, "foo.pkl"), "wb") as f:
+        f.write(b"bar")
+    assert cache.get("foo", 0) == 0
+    cache.clear()
+    assert "foo" not in cache
+
+
+def test_scheduler_cache(tmp_path):
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    sram_macro = SRAMMacro(1 << 4, 1 << 4)
+    cache = AnalysisCache(str(tmp_path))
+    scheduler = BasicScheduler(lb, sram_macro, cache=cache)
+    assert cache.misses == 1
+    # a new model with the same statements and configuration
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    cached = BasicScheduler(lb, sram_macro, cache=cache)
+    assert cache.hits == 1
+    for attr in ("update_spacing", "access_spacing"):
+        expected = {var.name: v for var, v in getattr(scheduler,
+                                                      attr).items()}
+        assert {var.name: v for var, v in getattr(cached, attr).items()} \
+            == expected
+    assert len(cached.read_var) == len(scheduler.read_var)
+    assert cached.get_minimum_cycle() == scheduler.get_minimum_cycle()
+
+
+def test_exclusivity_cache(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=1)
+    matrix = ExclusivityAnalysis(fifo, cache=cache).get_matrix()
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=1)
+    analysis = ExclusivityAnalysis(fifo, cache=cache)
+    assert analysis.get_matrix() == matrix
+    assert cache.hits == 1
+    # answered without the solver
+    assert analysis._solver is None
+
+
+def test_exclusivity_cache_flush(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    writes = []
+    set_ = cache.set
+    cache.set = lambda key, value: writes.append(key) or set_(key, value)
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    analysis = ExclusivityAnalysis(lb, cache=cache)
+    analysis.get_matrix(analysis.names)
+    assert len(analysis.names) > 2
+    # written once for all the pairs
+    assert len(writes) == 1
+    analysis.get_matrix(analysis.names)
+    assert len(writes) == 1
+    # single queries are written on flush()
+    analysis.add_predicate("foo", get_expr_key(lb.read_addr > 1))
+    analysis.is_exclusive("foo", analysis.names[0])
+    assert len(writes) == 1
+    analysis.flush()
+    assert len(writes) == 2
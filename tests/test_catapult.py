@@ -1,5 +1,7 @@
 from karst.catapult import *
 from karst.basic import *
+from karst.macro import SRAMMacro
+from karst.model import define_memory
 
 
 def test_fifo_codegen():
@@ -27,3 +29,120 @@ def test_lb_codegen():
     codegen = CatapultCodeGen(lb)
     tester = CatapultTester(codegen)
     tester.test()
+
+
+def test_pipeline_pragmas():
+    sram = define_sram()
+    sram.configure(memory_size=128)
+    scheduler = BasicScheduler(sram, SRAMMacro(128, 16))
+    codegen = CatapultCodeGen(sram, scheduler=scheduler)
+    src = codegen.code_gen()
+    assert 'map_to_module="ccs_sample_mem.ccs_ram_sync_singleport"' in src
+    # read and write share the single port
+    assert codegen.get_initiation_interval() == 2
+    assert "    void run(ac_int<16, false> &addr," in src
+    assert "if (ren) read(addr, data_out);" in src
+    # the top level function streams the ports through channels
+    assert "#pragma hls_design top\n#pragma hls_pipeline_init_interval 2\n" \
+           "void sram_model_top(ac_channel<ac_int<16, false>> &addr_chan," \
+           in src
+    assert '#pragma hls_resource addr_chan_rsc variables="addr_chan" ' \
+           'map_to_module="ccs_ioport.ccs_in_wait"' in src
+    assert '#pragma hls_resource data_out_chan_rsc ' \
+           'variables="data_out_chan" ' \
+           'map_to_module="ccs_ioport.ccs_out_wait"' in src
+    assert "addr = addr_chan.read();" in src
+    assert "data_out_chan.write(data_out);" in src
+    assert "for (unsigned int i = 0; i < 1; i++) {" in src
+    # no directives without a schedule
+    assert "#pragma" not in CatapultCodeGen(sram).code_gen()
+
+
+def test_fifo_pipeline_pragmas():
+    fifo = define_fifo()
+    fifo.configure(memory_size=128, capacity=64)
+    scheduler = BasicScheduler(fifo, SRAMMacro(128, 16, num_ports=2))
+    codegen = CatapultCodeGen(fifo, scheduler=scheduler)
+    src = codegen.code_gen()
+    # the schedule reads on one port and writes on the other
+    assert 'map_to_module="ccs_sample_mem.ccs_ram_sync_1R1W"' in src
+    assert codegen.get_initiation_interval() == 1
+    # the arguments follow the action signature
+    assert "if (EN_enqueue) enqueue(data_in, RDY_dequeue, RDY_enqueue, " \
+           "almost_empty, almost_full);" in src
+    # the state is kept by the top level function
+    assert "static fifo_model<ac_int<16, false>, 0, 64> model = " \
+           "{read_addr, write_addr};" in src
+    assert "static bool RDY_enqueue;" in src
+    assert "RDY_enqueue_chan" not in src
+
+    # a true dual-port macro only needs a 1R1W RAM for this schedule
+    macro = SRAMMacro(128, 16, num_ports=2, num_en_ports=2)
+    codegen = CatapultCodeGen(fifo, scheduler=BasicScheduler(fifo, macro))
+    src = codegen.code_gen()
+    assert 'map_to_module="ccs_sample_mem.ccs_ram_sync_1R1W"' in src
+    assert "// S0(Read[0]: read_addr, Write[1]: write_addr)" in src
+    # the line buffer reads on both ports
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    codegen = CatapultCodeGen(lb, scheduler=BasicScheduler(lb, macro))
+    src = codegen.code_gen()
+    assert 'map_to_module="ccs_sample_mem.ccs_ram_sync_dualport"' in src
+
+
+def test_fractional_initiation_interval():
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    # 4 elements per word, 5 accesses of the single port every 4 iterations
+    scheduler = BasicScheduler(lb, SRAMMacro(1 << 4, 64))
+    codegen = CatapultCodeGen(lb, scheduler=scheduler)
+    src = codegen.code_gen()
+    # a call serves a whole period instead of rounding up to 2 cycles per
+    # iteration
+    assert codegen.get_initiation_interval() == 5
+    assert "#pragma hls_pipeline_init_interval 5\n" in src
+    assert "#pragma hls_unroll yes\n" \
+           "    for (unsigned int i = 0; i < 4; i++) {" in src
+
+
+def test_dead_port_params():
+    @define_memory
+    def mem():
+        model = MemoryModel(8)
+        model.PortIn("a", 16)
+        # only feeds b, which nobody reads
+        model.PortIn("debug", 16)
+        model.PortOut("out", 16)
+        model.Variable("b", 16)
+
+        @model.action()
+        def foo():
+            model.b = model.debug + 1
+            model.out = model.a + 1
+
+        return model
+
+    model = mem()
+    scheduler = BasicScheduler(model, SRAMMacro(8, 16))
+    src = CatapultCodeGen(model, scheduler=scheduler).code_gen()
+    assert "void foo(ac_int<16, false> &a, ac_int<16, false> &out) {" in src
+    assert "if (EN_foo) foo(a, out);" in src
+    assert "debug" not in src
+
+
+def test_wide_word_codegen():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=32)
+    # 4 elements per word
+    scheduler = BasicScheduler(fifo, SRAMMacro(1 << 4, 64))
+    codegen = CatapultCodeGen(fifo, scheduler=scheduler)
+    src = codegen.code_gen()
+    assert "    T mem[16];" in src
+    assert "static fifo_model<ac_int<64, false>, 0, 32> model = " in src
+    # the elements are slices of the words
+    assert "mem[stage0_word].set_slc(16, stage0_1);" in src
+    assert "tb0_1 = mem[tb0_fetch].slc<16>(16);" in src
+    assert "pf0_1 = mem[tb0_fetch].slc<16>(16);" in src
+    assert "data_out = mem[tb0_fetch].slc<16>(cse_1 * 16);" in src
+    # the period of the original schedule
+    assert codegen.get_initiation_interval() == 4
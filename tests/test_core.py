@@ -1,5 +1,7 @@
 from karst.core import *
 import pytest
+import subprocess
+import sys
 
 
 @pytest.fixture
@@ -38,3 +40,52 @@ def test_bitstream(memory_core):
     ins1, ins2 = bitstream
     assert ins1[0] == 0 and ins1[1] == MemoryMode.FIFO.value
     assert ins2[0] == 2 and ins2[1] == capacity
+
+
+def test_latency_pipeline():
+    pipeline = LatencyPipeline(3)
+    records = [{"data_out": i} for i in range(10)]
+    for i, record in enumerate(records):
+        result = pipeline.push(record)
+        if i < 3:
+            assert result == {}
+        else:
+            # no copy is made
+            assert result is records[i - 3]
+    # zero latency is a pass through
+    pipeline = LatencyPipeline()
+    assert pipeline.push(records[0]) is records[0]
+
+
+@pytest.mark.parametrize("latency", [0, 1, 3])
+def test_core_latency(latency):
+    core = MemoryCore(64, {MemoryMode.SRAM: latency,
+                           MemoryMode.FIFO: latency})
+    data_entries = [(i, i + 42) for i in range(16)]
+    core.configure(MemoryInstruction(MemoryMode.SRAM,
+                                     data_entries=data_entries))
+    results = [core.eval(ren=1, addr=i) for i in range(16)]
+    for i in range(latency):
+        assert results[i] == {}
+    for i in range(latency, 16):
+        assert results[i]["data_out"] == i - latency + 42
+
+    core.configure(MemoryInstruction(MemoryMode.FIFO, {"capacity": 16}))
+    results = [core.eval(wen=1, ren=0, data_in=i) for i in range(4)]
+    results += [core.eval(wen=0, ren=1) for _ in range(4 + latency)]
+    for i in range(4):
+        assert results[4 + latency + i]["data_out"] == i
+
+
+def test_import_time():
+    # simulation workers import karst.core. the analysis and codegen
+    # dependencies should not be loaded
+    code = "import sys, time\n" \
+           "start = time.time()\n" \
+           "import karst.core\n" \
+           "print(time.time() - start)\n" \
+           "print(int('z3' in sys.modules or 'astor' in sys.modules))"
+    output = subprocess.check_output([sys.executable, "-c", code])
+    import_time, loaded = output.decode().split()
+    assert float(import_time) < 0.5
+    assert loaded == "0"
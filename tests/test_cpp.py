@@ -1,5 +1,8 @@
 from karst.cpp import *
 from karst.basic import *
+from karst.partition import select_partition
+from karst.cache import AnalysisCache
+import os
 
 
 def test_fifo_codegen():
@@ -27,3 +30,91 @@ def test_lb_codegen():
     codegen = CppCodeGen(lb)
     tester = CPPTester(codegen)
     tester.test()
+
+
+def test_lb_banked_codegen():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+
+    codegen = CppCodeGen(lb, select_partition(lb))
+    src = codegen.code_gen()
+    assert "mem[4][16]" in src
+    tester = CPPTester(codegen)
+    tester.test()
+
+
+def test_codegen_stream():
+    class Sink:
+        def __init__(self):
+            self.fragments = []
+
+        def write(self, s):
+            self.fragments.append(s)
+
+    lb = define_line_buffer()
+    lb.configure(memory_size=1 << 12, num_rows=256, depth=8)
+    codegen = CppCodeGen(lb)
+    sink = Sink()
+    codegen.code_gen_to_stream(sink)
+    # the code is written line by line instead of as a whole
+    assert max([len(s) for s in sink.fragments]) < 100
+    assert "".join(sink.fragments) == codegen.code_gen()
+
+
+def test_compile_all(tmpdir):
+    service = CompileService(str(tmpdir))
+    testers = []
+    for memory_size in [64, 128, 64]:
+        sram = define_sram()
+        sram.configure(memory_size=memory_size)
+        testers.append(CPPTester(CppCodeGen(sram), service))
+    objects = CPPTester.test_all(testers, service)
+    # the identical sources are compiled once
+    assert objects[0] == objects[2] != objects[1]
+    assert service.misses == 2
+    assert all(os.path.isfile(filename) for filename in objects)
+    # and never again
+    assert testers[1].test() == objects[1]
+    assert service.hits == 1
+
+
+def test_compile_cache_size(tmpdir):
+    service = CompileService(str(tmpdir))
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    first = CPPTester(CppCodeGen(sram), service).test()
+    service.max_size = os.path.getsize(first)
+    sram.configure(memory_size=128)
+    second = CPPTester(CppCodeGen(sram), service).test()
+    # the least recently used object makes room for the new one
+    assert not os.path.exists(first) and os.path.isfile(second)
+
+
+def test_compile_uncached(tmpdir, monkeypatch):
+    monkeypatch.setenv("KARST_CACHE_DIR", str(tmpdir))
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    testers = [CPPTester(CppCodeGen(sram)), CPPTester(CppCodeGen(sram))]
+    assert testers[0].test() is None
+    assert CPPTester.test_all(testers) is None
+    # nothing is kept without a service
+    assert not os.listdir(str(tmpdir))
+    # the default service doesn't share the analysis cache directory
+    assert CompileService().path != AnalysisCache().path
+
+
+def test_lb_wide_word_codegen():
+    from karst.aggregate import aggregate_model
+    from karst.scheduler import BasicScheduler
+    from karst.macro import SRAMMacro
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    lb = aggregate_model(lb, BasicScheduler(lb, SRAMMacro(1 << 4, 64)))
+
+    codegen = CppCodeGen(lb)
+    src = codegen.code_gen()
+    # one memory per element of the word
+    assert "T mem[4][16];" in src
+    assert "mem[3][stage0_word] = stage0_3;" in src
+    tester = CPPTester(codegen)
+    tester.test()
@@ -0,0 +1,54 @@
+from karst.dse import *
+from karst.basic import define_line_buffer, define_fifo
+
+
+def test_dse_line_buffer():
+    explorer = DesignSpaceExplorer(define_line_buffer,
+                                   {"memory_size": [64], "num_rows": [2, 4],
+                                    "depth": [8]},
+                                   sizes=[32, 64], port_sizes=[16, 64],
+                                   num_workers=1)
+    assert len(explorer.get_configs()) == 2
+    assert len(explorer.get_macros()) == 12
+    report = explorer.run()
+    assert len(report.points) == 24
+    # 32 x 16 can't hold 64 elements of 16 bits
+    failures = report.failures
+    assert len(failures) == 6
+    assert all([p.macro.size == 32 and p.macro.port_size == 16
+                for p in failures])
+    frontier = report.get_frontier(num_rows=4)
+    assert frontier
+    # the frontier is sorted by area with increasing throughput
+    for p1, p2 in zip(frontier[:-1], frontier[1:]):
+        assert p1.area < p2.area and p1.throughput < p2.throughput
+    assert frontier[-1].throughput == 1
+    # 64 bits words hold 4 elements of 16 bits
+    assert {p.elements_per_word for p in report.points
+            if p.error is None and p.macro.port_size == 64} == {4}
+
+    # same result on the process pool
+    explorer.num_workers = 2
+    assert explorer.run().points == report.points
+
+
+def test_pareto_frontier():
+    config = (("memory_size", 64),)
+    points = [DesignPoint(config, MacroConfig(64, 16), 0.5),
+              DesignPoint(config, MacroConfig(64, 16, 2, 1), 0.5),
+              DesignPoint(config, MacroConfig(64, 32), 1.0),
+              DesignPoint(config, MacroConfig(64, 16), 1.0, error="foo")]
+    frontier = get_pareto_frontier(points)
+    assert frontier == [points[0], points[2]]
+    assert points[0].dominates(points[1])
+    assert not points[0].dominates(points[2])
+
+
+def test_dse_config_error():
+    explorer = DesignSpaceExplorer(define_fifo, {"memory_size": [16],
+                                                 "foo": [1]},
+                                   sizes=[16], port_sizes=[16],
+                                   ports=[(1, 1)], num_workers=1)
+    report = explorer.run()
+    assert len(report.failures) == 1
+    assert not report.frontier
@@ -0,0 +1,85 @@
+from karst.instrument import *
+from karst.basic import define_line_buffer, define_fifo
+from karst.backend import clear_cache, ExclusivityAnalysis, get_expr_key
+from karst.dse import DesignSpaceExplorer
+from karst.scheduler import Scheduler
+from karst.macro import SRAMMacro
+import json
+
+
+def test_profile_scheduler():
+    clear_cache()
+    lb = define_line_buffer()
+    with profile() as profiler:
+        lb.configure(memory_size=16, num_rows=4, depth=4)
+        Scheduler(lb, SRAMMacro(1 << 4, 1 << 4))
+    assert get_profiler() is None
+    scheduler = profiler.root.children["scheduler"]
+    assert scheduler.calls == 1
+    assert "analyze_action" in scheduler.children
+    access = scheduler.children["get_memory_access"]
+    assert "produce_statements" in access.children
+    assert scheduler.get_counter("expr_nodes") > 0
+    assert scheduler.get_counter("z3.nodes") > 0
+
+    result = json.loads(profiler.to_json())
+    assert result["children"][0]["name"] == "scheduler"
+    assert result["elapsed"] == scheduler.elapsed
+    trace = json.loads(profiler.to_chrome_trace())
+    names = [e["name"] for e in trace["traceEvents"]]
+    assert "scheduler" in names and "analyze_action" in names
+    assert "scheduler:" in repr(profiler)
+
+
+def test_profile_counters():
+    clear_cache()
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=4)
+    with profile() as profiler:
+        with timer("query"):
+            analysis = ExclusivityAnalysis(fifo)
+            analysis.get_matrix()
+    query = profiler.root.children["query"]
+    num_actions = len(fifo.get_action_names())
+    assert query.get_counter("z3.check") == \
+        num_actions * (num_actions - 1) // 2
+    assert "exclusivity_solver" in query.children
+
+
+def test_profile_disabled():
+    assert get_profiler() is None
+    # no-ops
+    count("foo")
+    with timer("foo") as node:
+        assert node is None
+    enable()
+    count("foo", 2)
+    profiler = disable()
+    assert profiler.root.counters == {"foo": 2}
+
+
+def test_profile_define_memory():
+    with profile() as profiler:
+        lb = define_line_buffer()
+    # the rewrite and the definition of the model are timed separately
+    assert profiler.root.children["define_memory"].calls == 1
+    assert profiler.root.children["define_memory.body"].calls == 1
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    with profile() as profiler:
+        get_expr_key((lb.read_addr + 1) * 2)
+    assert profiler.root.counters["expr_nodes"] == 2
+
+
+def test_profile_workers():
+    clear_cache()
+    explorer = DesignSpaceExplorer(define_line_buffer,
+                                   {"memory_size": [16], "num_rows": [2, 4],
+                                    "depth": [4]},
+                                   sizes=[16], port_sizes=[16],
+                                   ports=[(1, 1)], num_workers=2)
+    with profile() as profiler:
+        explorer.run()
+    # the profiles of the worker processes are merged
+    scheduler = profiler.root.children["scheduler"]
+    assert scheduler.calls == 2
+    assert scheduler.get_counter("expr_nodes") > 0
@@ -201,3 +201,18 @@ def test_double_buffer():
         db.write()
         index = 0 if i < 512 else 1
         assert db.read_from_mem(i % 512, index) == i
+
+
+def test_reset_values():
+    fifo = define_fifo()
+    fifo.configure(memory_size=4, capacity=4)
+    assert fifo.get_reset_actions() == ["reset"]
+    fifo.reset()
+    fifo.data_in = 42
+    fifo.enqueue()
+    values = fifo.get_reset_values()
+    assert values["write_addr"] == 0 and values["RDY_dequeue"] == 0
+    assert values["RDY_enqueue"] == 1
+    # the current state is kept
+    assert fifo.write_addr.eval() == 1
+    assert fifo.read_from_mem(0) == 42
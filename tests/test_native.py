@@ -0,0 +1,170 @@
+from karst.native import *
+from karst.basic import *
+import array
+import random
+import shutil
+import pytest
+
+pytestmark = pytest.mark.skipif(shutil.which("g++") is None,
+                                reason="g++ not available")
+
+
+@pytest.fixture
+def service(tmpdir):
+    return CompileService(str(tmpdir))
+
+
+def step_model(model, inputs):
+    # same order as the native step: inputs, enabled actions, outputs
+    ports = model.get_ports()
+    for name, value in inputs.items():
+        ports[name].value = value
+    for name, port in ports.items():
+        if name.startswith("EN_") and port.eval() == 1:
+            model[name[3:]]()
+    return {port.name: port.eval() for port in ports.values()}
+
+
+def reset_model(model):
+    # the native model starts from 0. reset is never assigned and always ready
+    for var in list(model.get_ports().values()) + \
+            list(model.get_variables().values()):
+        var.value = 0
+    model.RDY_reset.value = 1
+    for mem in model._mem:
+        mem._data = [0 for _ in mem._data]
+
+
+def get_stimuli(model, sim, num_cycles, seed):
+    rnd = random.Random(seed)
+    ports = model.get_ports()
+    stimuli = []
+    for i in range(num_cycles):
+        values = {name: rnd.randrange(1 << min(ports[name].bit_width, 6))
+                  for name in sim.inputs}
+        # start from the reset state
+        values["EN_reset"] = int(i == 0)
+        stimuli.append(values)
+    return stimuli
+
+
+def test_native_sram(service):
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    sim = NativeSimulator(sram, service=service)
+    reset_model(sram)
+    assert sim.inputs == ["ren", "addr", "wen", "data_in", "EN_reset"]
+    assert "data_out" in sim.outputs
+    for values in get_stimuli(sram, sim, 1000, 0):
+        expected = step_model(sram, values)
+        outputs = sim.step(values)
+        for name in sim.outputs:
+            assert outputs[name] == expected[name], name
+
+
+@pytest.mark.parametrize("memory_size", [16, 64])
+def test_native_fifo(service, memory_size):
+    fifo = define_fifo()
+    fifo.configure(memory_size=memory_size, capacity=memory_size)
+    sim = NativeSimulator(fifo, service=service)
+    reset_model(fifo)
+    # long enough for the addresses to wrap around many times, where
+    # write_addr - read_addr goes negative
+    for values in get_stimuli(fifo, sim, 2000, 1):
+        expected = step_model(fifo, values)
+        outputs = sim.step(values)
+        for name in sim.outputs:
+            assert outputs[name] == expected[name], name
+
+
+def test_native_run_batch(service):
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    sim = NativeSimulator(sram, service=service)
+    stimuli = get_stimuli(sram, sim, 100, 2)
+    expected = [sim.step(values) for values in stimuli]
+    sim.reset()
+    inputs = array.array("I", [values[name] for values in stimuli
+                               for name in sim.inputs])
+    outputs = sim.run_batch(inputs)
+    assert len(outputs) == 100 * len(sim.outputs)
+    for i, values in enumerate(expected):
+        row = outputs[i * len(sim.outputs):(i + 1) * len(sim.outputs)]
+        assert list(row) == [values[name] for name in sim.outputs]
+
+    # the library is reused
+    library = sim.library
+    assert NativeSimulator(sram, service=service).library == library
+    assert service.hits == 1
+    sram.configure(memory_size=32)
+    assert NativeSimulator(sram, service=service).library != library
+    assert service.misses == 2
+
+
+def test_native_run_batch_numpy(service):
+    numpy = pytest.importorskip("numpy")
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    sim = NativeSimulator(sram, service=service)
+    stimuli = get_stimuli(sram, sim, 100, 3)
+    expected = numpy.array([[sim.step(values)[name] for name in sim.outputs]
+                            for values in stimuli])
+    sim.reset()
+    inputs = numpy.array([[values[name] for name in sim.inputs]
+                          for values in stimuli])
+    outputs = sim.run_batch(inputs)
+    assert outputs.shape == (100, len(sim.outputs))
+    assert (outputs == expected).all()
+
+
+def test_native_address_check(service):
+    sram = define_sram()
+    sram.configure(memory_size=16)
+    sim = NativeSimulator(sram, service=service)
+    sim.step({"EN_reset": 1})
+    sim.step({"wen": 1, "addr": 15, "data_in": 42})
+    # the python model raises an IndexError as well
+    with pytest.raises(IndexError, match="40"):
+        sim.step({"wen": 1, "addr": 40, "data_in": 1})
+    # the memory is not corrupted
+    assert sim.step({"ren": 1, "addr": 15})["data_out"] == 42
+
+    stimuli = [{"EN_reset": 1}, {"wen": 1, "addr": 3, "data_in": 7},
+               {"wen": 1, "addr": 40, "data_in": 1},
+               {"ren": 1, "addr": 3}]
+    inputs = array.array("I", [values.get(name, 0) for values in stimuli
+                               for name in sim.inputs])
+    sim.reset()
+    with pytest.raises(IndexError, match="row 2"):
+        sim.run_batch(inputs)
+    # the batch stops at the bad address
+    assert sim.step({"ren": 1, "addr": 3})["data_out"] == 7
+
+    # the outputs have to hold all the rows
+    with pytest.raises(AssertionError):
+        sim.run_batch(inputs, array.array("I"))
+
+
+@pytest.mark.parametrize("define", [define_sram, define_fifo])
+def test_native_aggregate(service, define):
+    from karst.aggregate import aggregate_model
+    from karst.scheduler import BasicScheduler
+    from karst.macro import SRAMMacro
+    ref = define()
+    model = define()
+    for m in (ref, model):
+        m.configure(memory_size=64)
+        if "capacity" in m.get_config_vars():
+            m.configure(capacity=32)
+    # four elements per word, the lanes are separate memories
+    model = aggregate_model(model, BasicScheduler(model, SRAMMacro(16, 64)))
+    sim = NativeSimulator(model, service=service)
+    # producing the statements evaluates them once
+    ref.produce_statements()
+    reset_model(ref)
+    for values in get_stimuli(ref, sim, 2000, 4):
+        expected = step_model(ref, values)
+        outputs = sim.step(values)
+        for name in sim.outputs:
+            if name in expected:
+                assert outputs[name] == expected[name], name
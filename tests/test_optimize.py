@@ -0,0 +1,84 @@
+from karst.optimize import *
+from karst.model import define_memory
+from karst.basic import define_fifo, define_double_buffer
+from karst.cpp import CppCodeGen
+
+
+def define_mem():
+    @define_memory
+    def mem():
+        model = MemoryModel(8)
+        model.PortIn("a", 16)
+        model.PortIn("unused", 16)
+        model.PortOut("out", 16)
+        model.Variable("b", 16)
+        # only feeds c, which nobody reads
+        model.Variable("c", 16)
+        model.Variable("d", 16)
+
+        @model.action()
+        def foo():
+            model.b = (model.a + 1) * 2
+            model.d = model.b
+            model.c = model.d + 1
+            model.out = (model.a + 1) * 2
+            if (model.b - model.a) > 2:
+                model.out = model.b - model.a
+            model.b = model.b + 1
+            model.out = model.b - model.a
+
+        return model
+
+    return mem()
+
+
+def test_dead_variables():
+    model = define_mem()
+    stmts = optimize_statements(model)
+    # d is only read by the assignment to c
+    assert "c" not in stmts.live and "d" not in stmts.live
+    assert "unused" not in stmts.live
+    assert {"a", "b", "out", "EN_foo", "RDY_foo"} <= stmts.live
+    src = CppCodeGen(model).code_gen()
+    assert "unsigned int c;" not in src and "c = " not in src
+    assert "unsigned int unused;" not in src
+    src = CppCodeGen(model, optimize=False).code_gen()
+    assert "c = d + 1;" in src and "unsigned int unused;" in src
+
+
+def test_common_subexpressions():
+    model = define_mem()
+    stmts = optimize_statements(model).actions["foo"]
+    src = CppCodeGen(model).code_gen()
+    # (a + 1) * 2 is computed once
+    assert src.count("(a + 1) * 2") == 1
+    assert "auto cse_0 = (a + 1) * 2;" in src
+    assert "b = cse_0;" in src and "out = cse_0;" in src
+    # the branch reuses the temporary of the predicate
+    assert "auto cse_1 = b - a;" in src
+    assert "if (cse_1 > 2) {" in src
+    assert "out = cse_1;" in src
+    # b changed, so b - a is computed again
+    assert src.count("b - a") == 2
+    temps = [s.left.name for s in stmts if
+             isinstance(s, AssignStatement) and isinstance(s.left, Temporary)]
+    assert temps == ["cse_0", "cse_1"]
+
+
+def test_fifo():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    src = CppCodeGen(fifo).code_gen()
+    assert src.count("auto cse_0 = write_addr - read_addr;") == 2
+    assert "RDY_enqueue = cse_0 < (64 - 0);" in src
+    # the handshakes are kept
+    assert "bool EN_reset;" in src and "bool RDY_reset;" in src
+
+
+def test_constants():
+    db = define_double_buffer()
+    db.configure(memory_size=64, threshold=32, ext_chin=2, off_x=2, off_y=2,
+                 ext_chout=2, ext_x=4, bound_ch=2, bound_x=6, stride=1)
+    src = CppCodeGen(db).code_gen()
+    # configurables are folded by the compiler
+    assert "cse_" not in src
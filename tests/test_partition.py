@@ -0,0 +1,76 @@
+from karst.partition import *
+from karst.basic import define_fifo, define_line_buffer, define_double_buffer
+from karst.values import Const
+import pytest
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 8, 16])
+def test_bank_mapping(block_size):
+    mapping = BankMapping(4, 16, block_size)
+    locations = set()
+    for addr in range(mapping.size):
+        bank = mapping.get_bank(addr)
+        offset = mapping.get_offset(addr)
+        assert 0 <= bank < 4 and 0 <= offset < 16
+        assert mapping.get_address(bank, offset) == addr
+        # the hardware mapping agrees
+        assert mapping.get_bank_expr(Const(addr)).eval() == bank
+        assert mapping.get_offset_expr(Const(addr)).eval() == offset
+        locations.add((bank, offset))
+    assert len(locations) == mapping.size
+
+
+def test_bank_conflicts_closed_form():
+    # every base address is counted once
+    def count_conflicts(mapping, offsets):
+        total = 0
+        for base in range(mapping.size):
+            banks = [mapping.get_bank((base + offset) % mapping.size)
+                     for offset in offsets]
+            total += max([banks.count(bank) for bank in banks]) - 1
+        return total / mapping.size
+
+    for mapping in get_mappings(64, 4):
+        for offsets in ([0, 8, 16, 24], [0, 1, 2, 3], [-3, 5, 9],
+                        [0, 32, 33]):
+            assert get_bank_conflicts(mapping, {"a": [offsets]}) == \
+                pytest.approx(count_conflicts(mapping, offsets))
+        for distance in range(-64, 64):
+            assert mapping.is_disjoint(distance) == \
+                (count_conflicts(mapping, [0, distance]) == 0)
+
+
+def test_select_partition_lb():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    accesses = get_parallel_accesses(lb)
+    assert sorted(accesses["enqueue"]) == [[0], [0, 8, 16, 24]]
+    # rows are one depth apart, so interleaving blocks of depth elements
+    # puts every row in its own bank
+    mapping = select_partition(lb)
+    assert mapping == BankMapping(4, 16, 8)
+    assert mapping.scheme == PartitionScheme.Hybrid
+    assert get_bank_conflicts(mapping, accesses) == 0
+    for mapping in get_mappings(64, 4, PartitionScheme.Cyclic) + \
+            get_mappings(64, 4, PartitionScheme.Block):
+        assert get_bank_conflicts(mapping, accesses) > 0
+    mapping = select_partition(lb, scheme=PartitionScheme.Block)
+    assert mapping == BankMapping(4, 16, 16)
+
+    # consecutive rows are better off with a cyclic partition
+    lb.configure(memory_size=64, num_rows=4, depth=1)
+    mapping = select_partition(lb)
+    assert mapping.scheme == PartitionScheme.Cyclic
+
+
+def test_select_partition_no_parallel_access():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    assert select_partition(fifo) == BankMapping(1, 64, 64)
+    # nothing to gain from interleaving
+    assert select_partition(fifo, num_banks=4).scheme == PartitionScheme.Block
+
+    db = define_double_buffer()
+    db.configure(memory_size=64)
+    with pytest.raises(AssertionError):
+        select_partition(db)
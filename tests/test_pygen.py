@@ -0,0 +1,95 @@
+from karst.pygen import *
+from karst.basic import *
+import random
+import pytest
+
+
+def get_models():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    rb = define_row_buffer()
+    rb.configure(memory_size=64, depth=4)
+    db = define_double_buffer()
+    db.configure(memory_size=64, threshold=32, ext_chin=2, off_x=2, off_y=2,
+                 ext_chout=2, ext_x=4, bound_ch=2, bound_x=6, stride=1)
+    return [fifo, sram, lb, rb, db]
+
+
+def get_state(model):
+    variables = list(model.get_ports().values()) + \
+        list(model.get_variables().values())
+    return {var.name: var for var in variables}
+
+
+@pytest.mark.parametrize("index", range(5))
+def test_python_codegen(index, tmpdir):
+    model = get_models()[index]
+    filename = os.path.join(str(tmpdir), "model.py")
+    PythonCodeGen(model).code_gen_to_file(filename)
+    sim = getattr(load_module(filename), model.model_name)()
+
+    # start both from the same state, ready to take any action
+    state = get_state(model)
+    for name, var in state.items():
+        value = 1 if name.startswith("RDY_") else 0
+        var.value = value
+        setattr(sim, name, value)
+    for mem in model._mem:
+        mem._data = [0 for _ in mem._data]
+
+    rnd = random.Random(index)
+    inputs = [name for name, var in state.items()
+              if isinstance(var, Port) and var.port_type == PortType.In]
+    actions = model.get_action_names()
+    for _ in range(500):
+        for name in inputs:
+            value = rnd.randrange(1 << min(state[name].bit_width, 6))
+            state[name].value = value
+            setattr(sim, name, value)
+        action = rnd.choice(actions)
+        assert getattr(model, action)() == getattr(sim, action)()
+        for name, var in state.items():
+            assert var.eval() == getattr(sim, name), name
+        assert [mem._data for mem in model._mem] == sim.mem
+
+
+def test_compile_model(tmpdir):
+    cache = AnalysisCache(str(tmpdir))
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    cls = compile_model(fifo, cache)
+    assert cache.misses == 1
+    sim = cls()
+    assert "mem" in cls.__slots__
+    with pytest.raises(AttributeError):
+        sim.not_a_variable = 1
+    sim.RDY_enqueue = 1
+    sim.data_in = 42
+    sim.enqueue()
+    sim.dequeue()
+    assert sim.data_out == 42
+    # the module is reused
+    assert compile_model(fifo, cache) is not cls
+    assert cache.hits == 1
+    fifo.configure(memory_size=64, capacity=32)
+    compile_model(fifo, cache)
+    assert cache.misses == 2
+
+
+def test_module_key(tmpdir):
+    cache = AnalysisCache(str(tmpdir))
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    compile_model(fifo, cache)
+    key = get_module_key(fifo)
+    fingerprint = get_model_fingerprint(fifo)
+    # same statements, different port
+    fifo.get_ports()["data_in"].bit_width = 8
+    assert get_model_fingerprint(fifo) == fingerprint
+    assert get_module_key(fifo) != key
+    compile_model(fifo, cache)
+    assert cache.misses == 2
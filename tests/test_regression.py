@@ -0,0 +1,90 @@
+from karst.regression import *
+from karst.tlm import FIFOTransactionModel
+import pytest
+
+
+@pytest.mark.parametrize("mode", list(MemoryMode))
+def test_stimulus_generator(mode):
+    gen1 = StimulusGenerator(mode, 42, 256)
+    gen2 = StimulusGenerator(mode, 42, 256)
+    assert gen1.instr.values == gen2.instr.values
+    for _ in range(10):
+        assert gen1() == gen2()
+
+
+def test_regression_runner():
+    runner = RegressionRunner(num_shards=2, num_cycles=500, num_workers=2)
+    shards = runner.get_shards()
+    assert len(shards) == 2 * len(MemoryMode)
+    assert len({seed for _, seed in shards}) == len(shards)
+    report = runner.run()
+    assert report.passed, report
+    assert report.num_cycles == 500 * len(shards)
+
+
+def test_regression_mismatch(monkeypatch):
+    dequeue = FIFOTransactionModel.dequeue
+
+    def buggy_dequeue(self):
+        dequeue(self)
+        if self.read_addr == 5:
+            self.data_out += 1
+
+    monkeypatch.setattr(FIFOTransactionModel, "dequeue", buggy_dequeue)
+    runner = RegressionRunner(modes=[MemoryMode.FIFO], num_shards=1,
+                              num_cycles=200, num_workers=1)
+    report = runner.run()
+    assert not report.passed
+    result = report.failures[0]
+    assert result.mismatch.port == "data_out"
+    assert result.mismatch.actual == result.mismatch.expected + 1
+    # the bug doesn't depend on earlier cycles
+    start, end = result.window
+    assert end - start == 1
+    assert end == result.mismatch.cycle + 1
+
+
+def test_regression_window_end(monkeypatch):
+    enqueue = FIFOTransactionModel.enqueue
+
+    def buggy_enqueue(self):
+        addr = self.write_addr
+        enqueue(self)
+        # only when the entry is written
+        if addr == 5 and self.write_addr != addr:
+            self.mem[0][addr] += 1
+
+    monkeypatch.setattr(FIFOTransactionModel, "enqueue", buggy_enqueue)
+    runner = RegressionRunner(modes=[MemoryMode.FIFO], num_shards=1,
+                              num_cycles=200, num_workers=1)
+    result = runner.run().failures[0]
+    assert result.mismatch.port == "data_out"
+    # the corrupted entry is also reported when it's written, but that is a
+    # different failure. the window has to cover the write and the read
+    start, end = result.window
+    assert end == result.mismatch.cycle + 1
+    assert end - start > 1
+    assert replay_shard(MemoryMode.FIFO, result.seed, end, 256,
+                        start) == result.mismatch
+
+
+def test_regression_state_window(monkeypatch):
+    enqueue = FIFOTransactionModel.enqueue
+
+    def buggy_enqueue(self):
+        addr = self.write_addr
+        enqueue(self)
+        # an entry that is never read
+        if self.write_addr != addr:
+            self.mem[0][self.memory_size - 1] += 1
+
+    monkeypatch.setattr(FIFOTransactionModel, "enqueue", buggy_enqueue)
+    runner = RegressionRunner(modes=[MemoryMode.FIFO], num_shards=1,
+                              num_cycles=200, num_workers=1)
+    result = runner.run().failures[0]
+    # the divergence is only found at the end of the window, so the end
+    # is reduced to the first write
+    assert result.mismatch.port == "mem0[255]"
+    start, end = result.window
+    assert end - start == 1
+    assert result.mismatch.cycle == end - 1 < 199
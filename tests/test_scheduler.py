@@ -1,12 +1,13 @@
 from karst.scheduler import *
 from karst.basic import *
+from karst.partition import PartitionScheme, select_partition
 import pytest
 
 
 @pytest.mark.parametrize("num_ports", (1, 2))
 def test_basic_scheduler_fifo(num_ports):
     fifo = define_fifo()
-    fifo.configure(memory_size=4)
+    fifo.configure(memory_size=4, capacity=4)
     sram_macro = SRAMMacro(1 << 4, 1 << 4, num_ports=num_ports)
     scheduler = BasicScheduler(fifo, sram_macro)
     # this should be already tested in the backend, some asserts here
@@ -60,3 +61,148 @@ def test_basic_scheduler_lb(num_ports):
     port_size = scheduler.get_port_size(minimum_cycle, minimum_cycle)
     assert port_size == minimum_cycle
     scheduler.schedule()
+
+
+def test_scheduler_double_buffer():
+    db = define_double_buffer()
+    db.configure(memory_size=1024, threshold=512, ext_chin=4, off_x=3,
+                 off_y=3, ext_chout=4, ext_x=32, bound_ch=4, bound_x=4,
+                 stride=1)
+    sram_macro = SRAMMacro(1 << 10, 1 << 4)
+    scheduler = Scheduler(db, sram_macro)
+    # the read address is derived from the nested counters instead of
+    # being treated as random access
+    assert scheduler.update_spacing[db.read_addr] == 1
+    assert scheduler.access_spacing[db.read_addr] == 1
+    pattern = scheduler.access_patterns[db.read_addr]
+    assert pattern.burst == 4
+    assert scheduler.update_spacing[db.write_addr] == 1
+
+
+def test_scheduler_parallel():
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    db = define_double_buffer()
+    for model in (lb, db):
+        sram_macro = SRAMMacro(1 << 4, 1 << 4)
+        serial = Scheduler(model, sram_macro)
+        parallel = Scheduler(model, sram_macro, num_workers=2)
+        for attr in ("update_spacing", "access_spacing"):
+            expected = {var.name: v for var, v in
+                        getattr(serial, attr).items()}
+            result = {var.name: v for var, v in
+                      getattr(parallel, attr).items()}
+            assert result == expected
+        assert [str(e) for e in parallel.read_var] == \
+            [str(e) for e in serial.read_var]
+        assert [str(e) for e in parallel.write_var] == \
+            [str(e) for e in serial.write_var]
+        patterns = {var.name: repr(p) for var, p in
+                    parallel.access_patterns.items()}
+        assert patterns == {var.name: repr(p) for var, p in
+                            serial.access_patterns.items()}
+
+
+@pytest.mark.parametrize("num_ports", (1, 2))
+def test_basic_scheduler_schedule(num_ports):
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    # one element per word
+    scheduler = BasicScheduler(lb, SRAMMacro(1 << 4, 16, num_ports=num_ports))
+    schedule = scheduler.schedule()
+    assert schedule.num_iterations == 1
+    assert schedule.num_cycles == scheduler.get_total_cycle() == \
+        scheduler.get_minimum_cycle()
+    assert len(schedule.accesses) == 5
+    for state in schedule.states:
+        assert len(state.accesses) <= num_ports
+        next_state = list(state.state_transition.values())[0]
+        assert next_state.state_value == (state.state_value + 1) % \
+            schedule.num_cycles
+
+    # four elements per word. each row is read once every four iterations
+    scheduler = BasicScheduler(lb, SRAMMacro(1 << 4, 64, num_ports=num_ports))
+    schedule = scheduler.schedule()
+    assert schedule.num_iterations == 4
+    assert len(schedule.accesses) == 5
+    assert schedule.throughput == (0.8 if num_ports == 1 else 1)
+
+    # random access can't be aggregated
+    sram = define_sram()
+    sram.configure(memory_size=16)
+    scheduler = BasicScheduler(sram, SRAMMacro(1 << 4, 64,
+                                               num_ports=num_ports))
+    schedule = scheduler.schedule()
+    assert len(schedule.accesses) == 8
+    assert schedule.throughput == num_ports / 2
+
+
+def test_basic_scheduler_schedule_pattern():
+    db = define_double_buffer()
+    db.configure(memory_size=1024, threshold=512, ext_chin=2, off_x=3,
+                 off_y=3, ext_chout=4, ext_x=32, bound_ch=4, bound_x=4,
+                 stride=1)
+    scheduler = BasicScheduler(db, SRAMMacro(1 << 10, 128, num_ports=2))
+    schedule = scheduler.schedule()
+    # the read addresses of 8 iterations are 0, 1, 4, 5, 8, 9, 16, 17
+    reads = [a for a in schedule.accesses
+             if a.access_type == Memory.MemoryAccessType.Read]
+    assert [a.iteration for a in reads] == [0, 4, 6]
+    assert schedule.throughput == 1
+
+
+def test_basic_scheduler_dual_port():
+    # true dual-port macros can issue any two accesses per cycle
+    macro = SRAMMacro(1 << 4, 16, num_ports=2, num_en_ports=2)
+    lb = define_line_buffer()
+    lb.configure(memory_size=16, num_rows=4, depth=4)
+    scheduler = BasicScheduler(lb, macro)
+    schedule = scheduler.schedule()
+    assert schedule.num_cycles == scheduler.get_minimum_cycle() == 3
+    ports = [a.port for a in schedule.states[0].accesses]
+    assert ports == [0, 1]
+
+    fifo = define_fifo()
+    fifo.configure(memory_size=16, capacity=8)
+    schedule = BasicScheduler(fifo, macro).schedule()
+    assert schedule.throughput == 1
+    types = {a.access_type for a in schedule.states[0].accesses}
+    assert len(types) == 2
+
+
+def test_basic_scheduler_exclusive():
+    sram = define_sram()
+    sram.configure(memory_size=16)
+    macro = SRAMMacro(1 << 4, 16)
+    assert BasicScheduler(sram, macro).schedule().num_cycles == 2
+    # read and write are never enabled together, so they can share the
+    # port
+    scheduler = BasicScheduler(sram, macro,
+                               constraints=[sram.wen + sram.ren <= 1])
+    schedule = scheduler.schedule()
+    assert schedule.num_cycles == 1
+    assert len(schedule.states[0].accesses) == 2
+    assert {a.action for a in schedule.accesses} == {"read", "write"}
+    # the bound packs the exclusive accesses as well
+    assert scheduler.get_minimum_cycle() == 1
+
+
+@pytest.mark.parametrize("num_ports", (1, 2))
+def test_basic_scheduler_banks(num_ports):
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    macro = SRAMMacro(1 << 4, 16, num_ports=num_ports)
+    num_reads = {}
+    for scheme in PartitionScheme:
+        mapping = select_partition(lb, scheme=scheme)
+        scheduler = BasicScheduler(lb, macro, mapping=mapping)
+        schedule = scheduler.schedule()
+        assert schedule.num_cycles == scheduler.get_minimum_cycle()
+        reads = [a for a in schedule.states[0].accesses
+                 if a.access_type == Memory.MemoryAccessType.Read]
+        num_reads[scheme] = len(reads)
+        # every read is on the read port of its own bank
+        assert {a.port for a in reads} == {0}
+    # the rows are in 4, 2 and 1 banks at a time
+    assert num_reads == {PartitionScheme.Hybrid: 4, PartitionScheme.Block: 2,
+                         PartitionScheme.Cyclic: 1}
@@ -0,0 +1,147 @@
+from karst.simulator import *
+from karst.macro import SRAMMacro
+from karst.partition import PartitionScheme, select_partition
+from karst.basic import define_fifo, define_line_buffer, define_sram
+import random
+import pytest
+
+
+@pytest.mark.parametrize("num_ports", [1, 2])
+def test_simulate_fifo(num_ports):
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    scheduler = BasicScheduler(fifo, SRAMMacro(1 << 4, 16,
+                                               num_ports=num_ports))
+    sim = ScheduleSimulator(fifo, scheduler)
+    rnd = random.Random(0)
+    # keep the fifo from running empty
+    stimuli = [{"EN_enqueue": 1, "EN_dequeue": int(i > 8),
+                "data_in": rnd.randrange(1 << 16)} for i in range(400)]
+    report = sim.run(stimuli)
+    assert not report.mismatches
+    assert report.num_iterations == 400
+    assert report.expected_throughput == (0.5 if num_ports == 1 else 1)
+    assert report.throughput == pytest.approx(report.expected_throughput,
+                                              rel=0.05)
+
+
+def test_simulate_fifo_wide_word():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    scheduler = BasicScheduler(fifo, SRAMMacro(1 << 4, 64))
+    sim = ScheduleSimulator(fifo, scheduler)
+    stimuli = [{"EN_enqueue": 1, "EN_dequeue": int(i > 8), "data_in": i}
+               for i in range(1000)]
+    report = sim.run(stimuli)
+    assert not report.mismatches
+    # aggregation hides the single port
+    assert report.throughput == pytest.approx(1, rel=0.01)
+
+
+def test_simulate_line_buffer():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    scheduler = BasicScheduler(lb, SRAMMacro(1 << 4, 16))
+    sim = ScheduleSimulator(lb, scheduler)
+    stimuli = [{"EN_enqueue": 1, "data_in": i} for i in range(400)]
+    report = sim.run(stimuli)
+    assert not report.mismatches
+    assert report.num_stalls > 0
+    assert report.throughput == pytest.approx(0.2, rel=0.05)
+    # the single port is busy every cycle
+    assert report.words_per_cycle == pytest.approx(1, rel=0.05)
+
+
+def test_simulate_sram():
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    scheduler = BasicScheduler(sram, SRAMMacro(1 << 4, 16))
+    sim = ScheduleSimulator(sram, scheduler)
+    rnd = random.Random(0)
+    stimuli = [{"ren": rnd.randint(0, 1), "wen": rnd.randint(0, 1),
+                "addr": rnd.randrange(64), "data_in": rnd.randrange(1 << 16)}
+               for _ in range(200)]
+    report = sim.run(stimuli)
+    assert not report.mismatches
+    # random accesses go to the SRAM one by one
+    assert report.num_words == sum([s["ren"] + s["wen"] for s in stimuli])
+    # the model is not traced anymore
+    sram.configure(memory_size=64)
+    sram.addr = 1
+    sram.data_in = 42
+    sram.write()
+    assert sram.read() == 42
+
+
+def test_simulate_banks():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    macro = SRAMMacro(1 << 4, 16)
+    stimuli = [{"EN_enqueue": 1, "data_in": i} for i in range(400)]
+    throughput = {}
+    for scheme in PartitionScheme:
+        mapping = select_partition(lb, scheme=scheme)
+        # a schedule that doesn't know about the banks only serves a row
+        # in the state of that row
+        scheduler = BasicScheduler(lb, macro)
+        sim = ScheduleSimulator(lb, scheduler, mapping=mapping)
+        report = sim.run(stimuli)
+        assert not report.mismatches
+        assert report.throughput == pytest.approx(0.2, rel=0.05)
+        # the rows in different banks are read together
+        scheduler = BasicScheduler(lb, macro, mapping=mapping)
+        report = ScheduleSimulator(lb, scheduler).run(stimuli)
+        assert not report.mismatches
+        assert report.num_conflicts == 0
+        throughput[scheme] = report.throughput
+    # every row has its own bank
+    assert throughput[PartitionScheme.Hybrid] == pytest.approx(0.5,
+                                                               rel=0.05)
+    # only every other row
+    assert 0.2 < throughput[PartitionScheme.Block] < 0.5
+    # the rows always share a bank
+    assert throughput[PartitionScheme.Cyclic] == pytest.approx(0.2,
+                                                               rel=0.05)
+
+
+def test_simulate_bank_conflicts():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    scheduler = BasicScheduler(lb, SRAMMacro(1 << 4, 16),
+                               mapping=select_partition(lb))
+    stimuli = [{"EN_enqueue": 1, "data_in": i} for i in range(100)]
+    # the rows scheduled together collide in the banks of another mapping
+    mapping = select_partition(lb, scheme=PartitionScheme.Cyclic)
+    report = ScheduleSimulator(lb, scheduler, mapping=mapping).run(stimuli)
+    assert not report.mismatches
+    assert report.num_conflicts > 0
+    assert report.throughput < report.expected_throughput
+
+
+def test_simulate_state_order():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    scheduler = BasicScheduler(lb, SRAMMacro(1 << 4, 16))
+    sim = ScheduleSimulator(lb, scheduler)
+    stimuli = [{"EN_enqueue": 1, "data_in": i} for i in range(100)]
+    assert sim.run(stimuli).throughput == pytest.approx(0.2, rel=0.05)
+    # the rows are read in order, so reading them in the opposite order
+    # takes one period per row
+    states = sim.schedule.states
+    accesses = [state.accesses for state in states[:4]]
+    for state, state_accesses in zip(states[:4], reversed(accesses)):
+        state.accesses = state_accesses
+    report = sim.run(stimuli)
+    assert not report.mismatches
+    assert report.throughput == pytest.approx(0.05, rel=0.05)
+
+
+def test_simulate_unscheduled_stream():
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    scheduler = BasicScheduler(sram, SRAMMacro(1 << 4, 16))
+    schedule = scheduler.schedule()
+    schedule.states[1].accesses = []
+    scheduler.schedule = lambda: schedule
+    with pytest.raises(AssertionError):
+        ScheduleSimulator(sram, scheduler)
@@ -0,0 +1,101 @@
+from karst.tlm import *
+import random
+import pytest
+
+
+DB_CONFIG = {"threshold": 16, "ext_chin": 2, "off_x": 2, "off_y": 2,
+             "ext_chout": 2, "ext_x": 4, "bound_ch": 2, "bound_x": 4}
+
+
+def get_stimulus(mode: MemoryMode, rnd: random.Random, memory_size: int):
+    stimulus = {"wen": rnd.randint(0, 1), "ren": rnd.randint(0, 1),
+                "data_in": rnd.randrange(1 << 16)}
+    if mode == MemoryMode.SRAM:
+        stimulus["addr"] = rnd.randrange(memory_size)
+    return stimulus
+
+
+@pytest.mark.parametrize("mode, values", [
+    (MemoryMode.SRAM, {}),
+    (MemoryMode.FIFO, {"capacity": 32}),
+    (MemoryMode.FIFO, {"capacity": 16, "almost_t": 2}),
+    (MemoryMode.RowBuffer, {"depth": 10}),
+    (MemoryMode.DoubleBuffer, DB_CONFIG)])
+def test_differential(mode, values):
+    memory_size = 1024
+    core = DifferentialCore(memory_size)
+    core.configure(MemoryInstruction(mode, values))
+    rnd = random.Random(0)
+    for _ in range(200):
+        core.eval(**get_stimulus(mode, rnd, 64))
+    assert core.num_checked == 200
+    assert not core.mismatches
+
+
+def test_differential_window():
+    core = DifferentialCore(1024, period=50, window=5, rate=0.01, seed=42)
+    core.configure(MemoryInstruction(MemoryMode.FIFO, {"capacity": 64}))
+    rnd = random.Random(0)
+    for _ in range(500):
+        core.eval(**get_stimulus(MemoryMode.FIFO, rnd, 64))
+    assert 50 <= core.num_checked < 500
+    assert not core.mismatches
+
+
+def test_differential_mismatch():
+    core = DifferentialCore(1024)
+    core.configure(MemoryInstruction(MemoryMode.RowBuffer, {"depth": 4}))
+    # corrupt the TLM configuration so that the output is valid one cycle
+    # earlier
+    core.tlm._mem.depth = 3
+    for i in range(10):
+        core.eval(wen=1, data_in=i)
+    assert core.mismatches
+    mismatch = core.mismatches[0]
+    assert mismatch.cycle == 3
+    assert mismatch.port == "valid"
+    assert mismatch.expected == 0 and mismatch.actual == 1
+
+
+def test_differential_state_mismatch():
+    core = DifferentialCore(64, period=10, window=2)
+    core.configure(MemoryInstruction(MemoryMode.SRAM))
+    # the entry is never read, so the outputs don't show it
+    core.tlm._mem.mem[0][5] = 42
+    for i in range(20):
+        core.eval(wen=1, addr=i % 4, data_in=i)
+    assert core.mismatches
+    mismatch = core.mismatches[0]
+    # reported at the end of the first window
+    assert mismatch.cycle == 1
+    assert mismatch.port == "mem0[5]"
+    assert mismatch.expected == 0 and mismatch.actual == 42
+    # the next window starts over from the TLM state
+    assert len(core.mismatches) == 1
+
+
+def test_transaction_core():
+    core = TransactionCore(64)
+    instr = MemoryInstruction(MemoryMode.FIFO, {"capacity": 8})
+    core.configure(instr)
+    result = core.eval(wen=1, data_in=42)
+    assert result["almost_empty"] == 0
+    result = core.eval(wen=0, ren=1)
+    assert result["data_out"] == 42
+    assert result["almost_empty"] == 1
+
+    data_entries = [(i, i + 42) for i in range(42)]
+    core.configure(MemoryInstruction(MemoryMode.SRAM,
+                                     data_entries=data_entries))
+    assert core.eval(ren=1, addr=1) == {}
+    assert core.eval(ren=0)["data_out"] == 43
+
+
+def test_differential_latency():
+    core = DifferentialCore(1024, period=7, window=3,
+                            latency={MemoryMode.FIFO: 2})
+    core.configure(MemoryInstruction(MemoryMode.FIFO, {"capacity": 64}))
+    rnd = random.Random(0)
+    for _ in range(200):
+        core.eval(**get_stimulus(MemoryMode.FIFO, rnd, 64))
+    assert not core.mismatches
@@ -0,0 +1,373 @@
+from karst.verilog import *
+from karst.basic import *
+from karst.macro import SRAMMacro
+from karst.partition import select_partition
+import os
+import random
+import re
+import shutil
+import subprocess
+import pytest
+
+requires_verilator = pytest.mark.skipif(shutil.which("verilator") is None,
+                                        reason="verilator not available")
+
+
+def check_structure(src: str):
+    assert src.startswith("module ")
+    assert src.rstrip().endswith("endmodule")
+    words = re.findall(r"\w+", src)
+    assert words.count("begin") == words.count("end")
+
+
+def test_fifo_register_file():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    src = SystemVerilogCodeGen(fifo).code_gen()
+    check_structure(src)
+    assert "input logic [15:0] data_in," in src
+    assert "output logic RDY_enqueue," in src
+    assert "logic [15:0] mem_q [64], mem_d [64];" in src
+    # the actions are fired in order and see the earlier updates
+    assert "if (EN_enqueue && RDY_enqueue_d) begin" in src
+    assert src.index("EN_enqueue &&") < src.index("EN_dequeue &&")
+    assert "mem_d[write_addr_d] = data_in;" in src
+    assert "read_addr_q <= read_addr_d;" in src
+    # reset never changes its ready signal
+    assert "assign RDY_reset = 1'b1;" in src
+    assert "if (EN_reset) begin" in src
+
+
+def test_double_buffer_register_file():
+    db = define_double_buffer()
+    db.configure(memory_size=64)
+    src = SystemVerilogCodeGen(db).code_gen()
+    check_structure(src)
+    assert "logic [15:0] mem_q [2][32], mem_d [2][32];" in src
+    assert "data_out_d = mem_d[select_d][read_addr_d];" in src
+    assert "mem_d[0][write_addr_d] = data_in;" in src
+    # inputs can't be driven
+    assert "ren =" not in src
+
+
+def test_sram_macro():
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    macro = SRAMMacro(64, 16)
+    scheduler = BasicScheduler(sram, macro)
+    src = SystemVerilogCodeGen(sram, scheduler).code_gen()
+    check_structure(src)
+    assert "sram_1p_64x16 sram_macro (" in src
+    for name in macro.get_ports():
+        assert f".{name}(sram_{name})" in src
+    # read and write take turns on the single port
+    assert "assign RDY_read = RDY_read_q && (state_q == 0);" in src
+    assert "assign RDY_write = RDY_write_q && (state_q == 1);" in src
+    assert "sram_addr0 = addr;" in src
+    assert "assign data_out = (data_out_src_q == 1) ? sram_data_out0 : " \
+           "data_out_q;" in src
+
+
+def test_fifo_dual_port_macro():
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    scheduler = BasicScheduler(fifo, SRAMMacro(64, 16, num_ports=2))
+    src = SystemVerilogCodeGen(fifo, scheduler).code_gen()
+    check_structure(src)
+    # one read port and one write port, both used every cycle
+    assert "sram_addr0 = read_addr_d;" in src
+    assert "sram_addr1 = write_addr_d;" in src
+    assert "assign RDY_enqueue = RDY_enqueue_q && (state_q == 0);" in src
+    assert "assign RDY_dequeue = RDY_dequeue_q && (state_q == 0);" in src
+
+
+def test_reset_values():
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    src = SystemVerilogCodeGen(sram).code_gen()
+    # the async reset action makes the sram ready
+    assert "RDY_read_q <= 1;" in src
+    assert "RDY_write_q <= 1;" in src
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    src = SystemVerilogCodeGen(fifo).code_gen()
+    assert "RDY_enqueue_q <= 1;" in src
+    assert "RDY_dequeue_q <= 0;" in src
+    # global statements run after the reset as well
+    assert "almost_empty_q <= 1;" in src
+    # the model state is untouched
+    fifo.RDY_enqueue.value = 0
+    SystemVerilogCodeGen(fifo).code_gen()
+    assert fifo.RDY_enqueue.eval() == 0
+
+
+def test_line_buffer_macro():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=2, depth=8)
+    scheduler = BasicScheduler(lb, SRAMMacro(64, 16))
+    src = SystemVerilogCodeGen(lb, scheduler).code_gen()
+    check_structure(src)
+    # the action fires with the first row read, the other accesses are
+    # latched for their states
+    assert "assign RDY_enqueue = RDY_enqueue_q && (state_q == 0);" in src
+    assert "if (enqueue_read1_valid_q && (state_q == 1)) begin" in src
+    assert "if (enqueue_write0_valid_q && (state_q == 2)) begin" in src
+    assert "enqueue_write0_data_d = data_in;" in src
+    # the rows see the write of the action
+    assert "data_out_0_d = enqueue_forward0_data;" in src
+
+    # four elements per word, which go through the aggregation buffers
+    scheduler = BasicScheduler(lb, SRAMMacro(16, 64))
+    codegen = SystemVerilogCodeGen(lb, scheduler)
+    src = codegen.code_gen()
+    check_structure(src)
+    assert "sram_1p_16x64 sram_macro (" in src
+    assert codegen.get_num_cycles() == 3
+    # the staged elements are written to their bits of the word
+    assert "sram_wenb0[16 +: 16] = '1;" in src
+    assert "sram_data_in0[16 +: 16] = enqueue_write" in src
+    # the rows take their elements of the word
+    assert "assign tb0_1 = " in src
+    assert "(tb0_1_src_q == 2) ? sram_data_out0[16 +: 16] : " in src
+
+
+def test_double_buffer_macro():
+    db = define_double_buffer()
+    db.configure(memory_size=64)
+    scheduler = BasicScheduler(db, SRAMMacro(32, 16))
+    src = SystemVerilogCodeGen(db, scheduler).code_gen()
+    check_structure(src)
+    # one macro per memory, selected at run time
+    assert "sram_1p_32x16 sram0_macro (" in src
+    assert "sram_1p_32x16 sram1_macro (" in src
+    assert "if ((select_d == 1)) begin" in src
+    assert "assign data_out = (data_out_src_q == 1) ? sram0_data_out0 : " \
+           "(data_out_src_q == 2) ? sram1_data_out0 : data_out_q;" in src
+
+
+def test_bank_macro():
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    mapping = select_partition(lb)
+    scheduler = BasicScheduler(lb, SRAMMacro(16, 16), mapping=mapping)
+    src = SystemVerilogCodeGen(lb, scheduler).code_gen()
+    check_structure(src)
+    for bank in range(4):
+        assert f"sram_1p_16x16 sram{bank}_macro (" in src
+    # every row is read in the same cycle from its own bank
+    assert "assign RDY_enqueue = RDY_enqueue_q && (state_q == 0);" in src
+    assert "sram3_ren0 = 1;" in src
+
+    # a bank has to fit in the macro
+    scheduler = BasicScheduler(lb, SRAMMacro(8, 16), mapping=mapping)
+    with pytest.raises(AssertionError):
+        SystemVerilogCodeGen(lb, scheduler).code_gen()
+
+
+def get_macro_model(macro: SRAMMacro, name: str) -> str:
+    """behavioral model of the SRAM macro. reads return the old data"""
+    ports = macro.get_ports()
+    lines = [f"module {name} (", "    input logic clk,"]
+    for idx, (port, width) in enumerate(ports.items()):
+        direction = "output" if port.startswith("data_out") else "input"
+        t = "logic" if width == 1 else f"logic [{width - 1}:0]"
+        lines.append(f"    {direction} {t} {port}" +
+                     ("," if idx != len(ports) - 1 else ""))
+    lines += [");", f"    logic [{macro.port_size - 1}:0] mem [{macro.size}];",
+              "    always_ff @(posedge clk) begin"]
+    for idx in range(macro.num_en_ports):
+        # a single enable port writes through the last address port
+        write_addr = idx if macro.num_en_ports > 1 else macro.num_ports - 1
+        data = f"data_in{idx}"
+        if macro.partial_write:
+            # only the bits of the mask are written
+            data = f"(mem[addr{write_addr}] & ~wenb{idx}) | " \
+                   f"(data_in{idx} & wenb{idx})"
+        lines += [f"        if (ren{idx}) data_out{idx} <= mem[addr{idx}];",
+                  f"        if (wen{idx}) mem[addr{write_addr}] <= {data};"]
+    lines += ["    end", "endmodule"]
+    return os.linesep.join(lines) + os.linesep
+
+
+def build(tmpdir, model, scheduler=None, testbench: str = None) -> str:
+    codegen = SystemVerilogCodeGen(model, scheduler)
+    files = [os.path.join(tmpdir, f"{model.model_name}.sv")]
+    codegen.code_gen_to_file(files[0])
+    if scheduler is not None:
+        macro = scheduler.sram_macro
+        name = f"sram_{macro.num_ports}p_{macro.size}x{macro.port_size}"
+        files.append(os.path.join(tmpdir, f"{name}.sv"))
+        with open(files[-1], "w") as f:
+            f.write(get_macro_model(macro, name))
+    # the model widths are not carried to the expressions
+    args = ["verilator", "-Wall", "-Wno-WIDTH", "-Wno-DECLFILENAME",
+            "-Wno-UNUSEDSIGNAL", "--top-module", model.model_name,
+            "-Mdir", os.path.join(tmpdir, "obj")]
+    if testbench is None:
+        args.append("--lint-only")
+    else:
+        files.append(os.path.join(tmpdir, "testbench.cc"))
+        with open(files[-1], "w") as f:
+            f.write(testbench)
+        args += ["--cc", "--exe", "--build", "-o", "testbench"]
+    result = subprocess.run(args + files, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+    return os.path.join(tmpdir, "obj", "testbench")
+
+
+def get_testbench(model_name: str, inputs: List[str], outputs: List[str],
+                  stimuli: List[Dict[str, int]], num_cycles: int) -> str:
+    """reset the design, then hold every row of stimuli for num_cycles and
+    print the outputs"""
+    rows = ", ".join("{" + ", ".join(str(values[name]) for name in inputs)
+                     + "}" for values in stimuli)
+    lines = [f'#include "V{model_name}.h"',
+             '#include "verilated.h"',
+             "#include <cstdio>",
+             f"static const unsigned stimuli[{len(stimuli)}]"
+             f"[{len(inputs)}] = {{{rows}}};",
+             "int main(int argc, char **argv) {",
+             "    Verilated::commandArgs(argc, argv);",
+             f"    V{model_name} top;",
+             "    top.clk = 0;",
+             "    top.rst_n = 1;",
+             "    top.eval();",
+             "    top.rst_n = 0;",
+             "    top.eval();",
+             "    top.rst_n = 1;",
+             "    top.eval();",
+             f"    for (int i = 0; i < {len(stimuli)}; i++) {{"]
+    lines += [f"        top.{name} = stimuli[i][{idx}];"
+              for idx, name in enumerate(inputs)]
+    lines += [f"        for (int c = 0; c < {num_cycles}; c++) {{",
+              "            top.eval();",
+              "            top.clk = 1;",
+              "            top.eval();",
+              "            top.clk = 0;",
+              "            top.eval();",
+              "        }",
+              '        printf("' + " ".join(["%u"] * len(outputs)) + '\\n", ' +
+              ", ".join(f"(unsigned)top.{name}" for name in outputs) + ");",
+              "    }",
+              "    top.final();",
+              "    return 0;",
+              "}"]
+    return os.linesep.join(lines) + os.linesep
+
+
+def step_model(model, inputs):
+    # the actions fire in order, the same as the always_comb block
+    for name, value in inputs.items():
+        model[name].value = value
+    for action_name in model.get_action_names():
+        if model[f"EN_{action_name}"].eval() == 1:
+            model[action_name]()
+    return {name: port.eval() for name, port in model.get_ports().items()}
+
+
+def compare(tmpdir, model, scheduler=None, num_steps=200, seed=0):
+    codegen = SystemVerilogCodeGen(model, scheduler)
+    src = codegen.code_gen()
+    inputs = re.findall(r"input logic (?:\[\d+:0\] )?(\w+)", src)[2:]
+    outputs = re.findall(r"output logic (?:\[\d+:0\] )?(\w+)", src)
+    if scheduler is not None:
+        # the handshakes depend on the state of the schedule
+        outputs = [name for name in outputs if not name.startswith("RDY_")]
+    ports = model.get_ports()
+    rnd = random.Random(seed)
+    stimuli = []
+    for _ in range(num_steps):
+        values = {name: rnd.randrange(1 << min(ports[name].bit_width, 6))
+                  for name in inputs}
+        values["EN_reset"] = int(rnd.random() < 0.05)
+        stimuli.append(values)
+    num_cycles = codegen.get_num_cycles()
+    testbench = get_testbench(model.model_name, inputs, outputs, stimuli,
+                              num_cycles)
+    binary = build(str(tmpdir), model, scheduler, testbench)
+    result = subprocess.run([binary], stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout.splitlines()
+
+    # the python model starts from the same reset. RDY_reset is never
+    # assigned, which is always high in the hardware
+    model.RDY_reset.value = 1
+    model["reset"]()
+    for step, (values, line) in enumerate(zip(stimuli, result)):
+        expected = step_model(model, values)
+        for name, value in zip(outputs, line.split()):
+            assert int(value) == expected[name], f"{name} at step {step}"
+    assert len(result) == num_steps
+
+
+@requires_verilator
+def test_lint(tmpdir):
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    db = define_double_buffer()
+    db.configure(memory_size=64)
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    designs = [(fifo, None), (db, None), (lb, None),
+               (fifo, BasicScheduler(fifo, SRAMMacro(64, 16, num_ports=2))),
+               (db, BasicScheduler(db, SRAMMacro(32, 16))),
+               (lb, BasicScheduler(lb, SRAMMacro(64, 16))),
+               (lb, BasicScheduler(lb, SRAMMacro(16, 16),
+                                   mapping=select_partition(lb)))]
+    for idx, (model, scheduler) in enumerate(designs):
+        build(str(tmpdir.mkdir(str(idx))), model, scheduler)
+
+
+@requires_verilator
+@pytest.mark.parametrize("use_macro", (False, True))
+def test_compare_sram(tmpdir, use_macro):
+    sram = define_sram()
+    sram.configure(memory_size=64)
+    scheduler = BasicScheduler(sram, SRAMMacro(64, 16)) if use_macro \
+        else None
+    compare(tmpdir, sram, scheduler)
+
+
+@requires_verilator
+def test_compare_fifo(tmpdir):
+    fifo = define_fifo()
+    fifo.configure(memory_size=64, capacity=64)
+    compare(tmpdir, fifo)
+
+
+@requires_verilator
+@pytest.mark.parametrize("memory", (None, "macro", "banks"))
+def test_compare_line_buffer(tmpdir, memory):
+    lb = define_line_buffer()
+    lb.configure(memory_size=64, num_rows=4, depth=8)
+    scheduler = None
+    if memory == "macro":
+        scheduler = BasicScheduler(lb, SRAMMacro(64, 16))
+    elif memory == "banks":
+        scheduler = BasicScheduler(lb, SRAMMacro(16, 16),
+                                   mapping=select_partition(lb))
+    # short enough for the addresses not to wrap around
+    compare(tmpdir, lb, scheduler, num_steps=100)
+
+
+@requires_verilator
+def test_compare_double_buffer_macro(tmpdir):
+    db = define_double_buffer()
+    db.configure(memory_size=64, threshold=16, ext_chin=2, off_x=1, off_y=1,
+                 ext_chout=1, ext_x=4, bound_ch=2, bound_x=4, stride=1)
+    compare(tmpdir, db, BasicScheduler(db, SRAMMacro(32, 16)))
+
+
+@requires_verilator
+@pytest.mark.parametrize("name", ("sram", "fifo", "line_buffer"))
+def test_compare_wide_word(tmpdir, name):
+    model = {"sram": define_sram, "fifo": define_fifo,
+             "line_buffer": define_line_buffer}[name]()
+    config = {"sram": {}, "fifo": {"capacity": 32},
+              "line_buffer": {"num_rows": 4, "depth": 8}}[name]
+    model.configure(memory_size=64, **config)
+    # four elements per SRAM word. the fifo actions fire in the same state,
+    # in the order of the python model
+    num_ports = 2 if name == "fifo" else 1
+    scheduler = BasicScheduler(model, SRAMMacro(16, 64, num_ports=num_ports))
+    compare(tmpdir, model, scheduler, num_steps=100)